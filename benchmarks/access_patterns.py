@@ -0,0 +1,92 @@
+#!/usr/bin/python
+"""
+Measure repository pattern matching for large ``writable`` lists.
+
+Builds one group with ``--names`` plain repository names and
+``--patterns`` wildcard patterns, then reports
+
+- the time to compile the list into a :class:`gitosis.pattern.PatternSet`,
+- the average lookup time through the trie,
+- the average lookup time of the old approach, splitting the line and
+  searching the list for the name or its ``dirname/*``, for comparison,
+- the average :func:`gitosis.access.allowed` call on a config using
+  that group, with the compiled patterns cached on the config.
+
+Usage::
+
+    python benchmarks/access_patterns.py [--names N] [--patterns N]
+"""
+
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import access
+from gitosis import pattern
+from gitosis.config import GitosisRawConfigParser
+
+def per_call(func, args, rounds=1):
+    start = time.time()
+    for _ in xrange(rounds):
+        for arg in args:
+            func(arg)
+    return (time.time() - start) / (rounds * len(args)) * 1e6
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--names', type='int', default=20000)
+    parser.add_option('--patterns', type='int', default=2000)
+    parser.add_option('--lookups', type='int', default=2000)
+    (options, args) = parser.parse_args()
+
+    rand = random.Random(0)
+    names = ['team%d/repo%d' % (rand.randint(0, 500), i)
+             for i in xrange(options.names)]
+    globs = []
+    for i in xrange(options.patterns):
+        kind = i % 3
+        if kind == 0:
+            globs.append('proj%d-*' % i)
+        elif kind == 1:
+            globs.append('area%d/**' % i)
+        else:
+            globs.append('team%d/mirror-?' % i)
+    listed = names + globs
+    rand.shuffle(listed)
+
+    lookups = [rand.choice(names) for _ in xrange(options.lookups // 2)]
+    lookups += ['area%d/x/y' % (rand.randint(0, options.patterns) * 3 + 1)
+                for _ in xrange(options.lookups // 4)]
+    lookups += ['nothing/here%d' % i for i in xrange(options.lookups // 4)]
+
+    start = time.time()
+    patterns = pattern.PatternSet(listed)
+    compile_ms = (time.time() - start) * 1000
+
+    line = ' '.join(listed)
+    def linear(path):
+        repos = line.split()
+        return path in repos or \
+            os.path.join(os.path.dirname(path), '*') in repos
+
+    cfg = GitosisRawConfigParser()
+    cfg.add_section('group big')
+    cfg.set('group big', 'members', 'jdoe')
+    cfg.set('group big', 'writable', line)
+    def allowed(path):
+        return access.allowed(cfg, user='jdoe', mode='writable', path=path)
+
+    print '%d names, %d patterns' % (len(names), len(globs))
+    print '%-18s %10.2f ms' % ('compile', compile_ms)
+    print '%-18s %10.2f us' % ('trie lookup',
+                               per_call(patterns.match, lookups, rounds=5))
+    print '%-18s %10.2f us' % ('split and scan',
+                               per_call(linear, lookups[:100]))
+    print '%-18s %10.2f us' % ('access.allowed', per_call(allowed, lookups))
+
+if __name__ == '__main__':
+    main()
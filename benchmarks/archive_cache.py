@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""
+Measure what serving ``git archive --remote`` costs with and without
+``archive-cache``.
+
+Each number is the best of ``--runs`` runs of serving the
+``--format=tar.gz`` archive of a tag of a repository of ``--files``
+files:
+
+- ``upload-archive``: ``git upload-archive`` itself, without the cache,
+- ``cache miss``: ``gitosis-upload-archive`` on an empty cache,
+- ``cache hit``: ``gitosis-upload-archive`` with the archive in the
+  cache.
+
+Usage::
+
+    python benchmarks/archive_cache.py [--runs N] [--files N]
+"""
+
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import archive
+from gitosis import repository
+
+def best_of(runs, args, env, data, setup=None):
+    best = None
+    for _ in xrange(runs):
+        if setup is not None:
+            setup()
+        start = time.time()
+        child = subprocess.Popen(args, env=env, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, close_fds=True)
+        out = child.communicate(data)[0]
+        elapsed = time.time() - start
+        if child.returncode != 0 or not out.endswith(archive.FLUSH):
+            raise SystemExit('%r failed with %d' % (args, child.returncode))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--files', type='int', default=5000)
+    (options, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        git_dir = os.path.join(tmp, 'foo.git')
+        repository.init(path=git_dir)
+        rand = random.Random(42)
+        repository.fast_import(
+            git_dir=git_dir,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='Benchmark\n',
+            files=[('file%d' % i,
+                    ''.join('%x\n' % rand.getrandbits(64)
+                            for _ in xrange(200)))
+                   for i in xrange(options.files)],
+            )
+        subprocess.check_call(['git', '--git-dir=%s' % git_dir, 'tag',
+                               'v1.0', 'master'], close_fds=True)
+        request = ''.join(archive.pkt_line('argument %s\n' % arg)
+                          for arg in ['--format=tar.gz', '--prefix=foo/',
+                                      'v1.0']) + archive.FLUSH
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = TOPDIR
+        cache = os.path.join(tmp, 'archive-cache')
+        hook = [sys.executable, '-c',
+                'from gitosis.archive import Main; Main.run()',
+                '--cache=%s' % cache, git_dir]
+
+        def empty():
+            if os.path.exists(cache):
+                shutil.rmtree(cache)
+            os.mkdir(cache)
+
+        results = [
+            ('upload-archive', best_of(
+                    options.runs, ['git', 'upload-archive', git_dir], env,
+                    request)),
+            ('cache miss', best_of(options.runs, hook, env, request, empty)),
+            ('cache hit', best_of(options.runs, hook, env, request)),
+            ]
+    finally:
+        shutil.rmtree(tmp)
+
+    for (label, ms) in results:
+        print '%-18s %10.2f ms' % (label, ms)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+"""
+Measure how many decisions ``gitosis-authd`` makes per second.
+
+Starts a ``gitosis-authd`` on a scratch config, then reports
+
+- ``decisions/s``: requests answered per second with ``--clients``
+  concurrent connections sending ``--requests`` requests in total,
+- ``serve via authd``: a complete ``gitosis-serve`` run up to
+  ``execvp`` of a dummy ``git``, asking the daemon,
+- ``serve in-process``: the same with the daemon bypassed.
+
+Usage::
+
+    python benchmarks/authd_throughput.py [--clients N] [--requests N]
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import serve
+
+CONFIG = """\
+[gitosis]
+repositories = %(repositories)s
+
+[group bench]
+members = jdoe @others
+writable = foo
+
+[group others]
+members = %(others)s
+"""
+
+def best_of(runs, args, env):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        code = subprocess.call(args, env=env, close_fds=True)
+        elapsed = time.time() - start
+        if code != 0:
+            raise SystemExit('%r failed with %d' % (args, code))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def wait_for(path):
+    for _ in xrange(100):
+        if serve.ask_authd(path, 'jdoe', "git-upload-pack 'foo'"):
+            return
+        time.sleep(0.1)
+    raise SystemExit('gitosis-authd did not come up')
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--clients', type='int', default=16)
+    parser.add_option('--requests', type='int', default=4000)
+    parser.add_option('--runs', type='int', default=10)
+    (options, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    daemon = None
+    try:
+        repositories = os.path.join(tmp, 'repositories')
+        os.makedirs(os.path.join(repositories, 'foo.git'))
+        config = os.path.join(tmp, 'gitosis.conf')
+        fp = file(config, 'w')
+        fp.write(CONFIG % dict(
+                repositories=repositories,
+                others=' '.join('user%d' % i for i in xrange(1000)),
+                ))
+        fp.close()
+
+        bindir = os.path.join(tmp, 'bin')
+        os.mkdir(bindir)
+        git = os.path.join(bindir, 'git')
+        fp = file(git, 'w')
+        fp.write('#!/bin/sh\nexit 0\n')
+        fp.close()
+        os.chmod(git, 0755)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = TOPDIR
+        env['PATH'] = bindir + os.pathsep + env.get('PATH', '')
+        env['HOME'] = tmp
+        env['SSH_ORIGINAL_COMMAND'] = "git-upload-pack 'foo'"
+
+        sock = os.path.join(tmp, 'authd.sock')
+        daemon = subprocess.Popen(
+            [sys.executable, '-c',
+             'from gitosis.authd import Main; Main.run()',
+             '--config=%s' % config, '--socket=%s' % sock],
+            env=env, close_fds=True)
+        wait_for(sock)
+
+        per_client = options.requests // options.clients
+        def client(number):
+            user = 'user%d' % number
+            for _ in xrange(per_client):
+                reply = serve.ask_authd(sock, user, "git-upload-pack 'foo'")
+                assert 'command' in reply, reply
+        threads = [threading.Thread(target=client, args=(i,))
+                   for i in xrange(options.clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        rate = per_client * options.clients / (time.time() - start)
+
+        serve_args = [sys.executable, '-c',
+                      'from gitosis.serve import Main; Main.run()',
+                      '--config=%s' % config]
+        via_authd = best_of(options.runs,
+                            serve_args + ['--authd-socket=%s' % sock, 'jdoe'],
+                            env)
+        in_process = best_of(options.runs,
+                             serve_args + ['--authd-socket=', 'jdoe'], env)
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        shutil.rmtree(tmp)
+
+    print '%-18s %10.0f' % ('decisions/s', rate)
+    print '%-18s %10.2f ms' % ('serve via authd', via_authd)
+    print '%-18s %10.2f ms' % ('serve in-process', in_process)
+
+if __name__ == '__main__':
+    main()
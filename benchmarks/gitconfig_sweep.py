@@ -0,0 +1,86 @@
+#!/usr/bin/python
+"""
+Measure how long the post-update hook takes to bring the git config of
+many repositories in line with ``gitosis.conf``.
+
+Creates ``--repositories`` repositories, each with the ``config`` file
+``git init`` writes, and reports the time :func:`gitosis.gitconfig.apply`
+takes:
+
+- ``first sweep``: every config is rewritten,
+- ``no changes``: every config is read and compared, none is written.
+
+Usage::
+
+    python benchmarks/gitconfig_sweep.py [--repositories N]
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import gitconfig
+from gitosis.config import GitosisRawConfigParser
+
+CONFIG = """\
+[gitosis]
+repositories = %(repositories)s
+gitconfig.uploadpack.allowFilter = true
+gitconfig.receive.unpackLimit = 100
+hide-refs = refs/pipelines
+
+[group ci]
+writable = team0/*
+gitconfig.pack.threads = 2
+hide-refs = refs/changes
+
+[repo team1/repo1]
+gitconfig.core.bigFileThreshold = 16m
+"""
+
+GIT_INIT_CONFIG = """\
+[core]
+\trepositoryformatversion = 0
+\tfilemode = true
+\tbare = true
+"""
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--repositories', type='int', default=20000)
+    (options, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        repositories = os.path.join(tmp, 'repositories')
+        for i in xrange(options.repositories):
+            path = os.path.join(repositories, 'team%d' % (i % 100),
+                                'repo%d.git' % i)
+            os.makedirs(path)
+            fp = file(os.path.join(path, 'config'), 'w')
+            fp.write(GIT_INIT_CONFIG)
+            fp.close()
+        cfg = GitosisRawConfigParser()
+        cfg.readfp(StringIO(CONFIG % dict(repositories=repositories)))
+
+        results = []
+        for label in ['first sweep', 'no changes']:
+            start = time.time()
+            gitconfig.apply(cfg)
+            results.append((label, time.time() - start))
+    finally:
+        shutil.rmtree(tmp)
+
+    print '%d repositories' % options.repositories
+    for (label, seconds) in results:
+        print '%-18s %10.2f s' % (label, seconds)
+
+if __name__ == '__main__':
+    main()
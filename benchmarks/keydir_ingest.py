@@ -0,0 +1,91 @@
+#!/usr/bin/python
+"""
+Measure :func:`gitosis.ssh.readKeys` over a ``keydir`` of ``--users``
+key files, as the ``post-update`` hook reads it on every push to
+``gitosis-admin``.
+
+Reported are the best of ``--runs`` runs of reading all of them
+
+- without a cache, parsing them one by one,
+- into an empty cache, parsing them in a pool of ``--jobs`` processes,
+- from the cache, nothing changed,
+- from the cache, after one key file changed.
+
+Usage::
+
+    python benchmarks/keydir_ingest.py [--runs N] [--users N] [--jobs N]
+"""
+
+import base64
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import ssh
+
+def best_of(runs, func):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=3)
+    parser.add_option('--users', type='int', default=20000)
+    parser.add_option('--jobs', type='int', default=None)
+    (options, args) = parser.parse_args()
+
+    rand = random.Random(42)
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        keydir = os.path.join(tmp, 'keydir')
+        os.mkdir(keydir)
+        for i in xrange(options.users):
+            blob = base64.b64encode(''.join(chr(rand.getrandbits(8))
+                                            for _ in xrange(279)))
+            fp = file(os.path.join(keydir, 'user%d.pub' % i), 'w')
+            fp.write('# gitosis-name: User %d\n' % i)
+            fp.write('ssh-rsa %s user%d@host\n' % (blob, i))
+            fp.close()
+        cache = os.path.join(tmp, 'keys-cache')
+
+        def uncached():
+            list(ssh.readKeys(keydir, {}, jobs=1))
+        def cold():
+            if os.path.exists(cache):
+                os.unlink(cache)
+            list(ssh.readKeys(keydir, {}, cache=cache, jobs=options.jobs))
+        def warm():
+            list(ssh.readKeys(keydir, {}, cache=cache, jobs=options.jobs))
+        def one_changed():
+            fp = file(os.path.join(keydir, 'user0.pub'), 'a')
+            fp.write('\n')
+            fp.close()
+            warm()
+
+        results = [
+            ('uncached', best_of(options.runs, uncached)),
+            ('cold cache, pool', best_of(options.runs, cold)),
+            ('warm cache', best_of(options.runs, warm)),
+            ('one changed', best_of(options.runs, one_changed)),
+            ]
+    finally:
+        shutil.rmtree(tmp)
+
+    for (label, ms) in results:
+        print '%-18s %10.2f ms' % (label, ms)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+Measure ``gitosis-keys-lookup`` against ``--keys`` keys.
+
+Reported are the time the ``post-update`` hook takes to write the
+index, and the best of ``--runs`` runs of a complete
+``gitosis-keys-lookup`` process, for the last key written, and for a
+key that is not there. The lookup should not depend on ``--keys``.
+
+Usage::
+
+    python benchmarks/keys_lookup.py [--runs N] [--keys N]
+"""
+
+import base64
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import keydb
+from gitosis import sshkey
+
+def best_of(runs, args, env):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        child = subprocess.Popen(args, env=env, stdout=subprocess.PIPE,
+                                 close_fds=True)
+        child.communicate()
+        elapsed = time.time() - start
+        if child.returncode != 0:
+            raise SystemExit('%r failed with %d' % (args, child.returncode))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=20)
+    parser.add_option('--keys', type='int', default=50000)
+    (options, args) = parser.parse_args()
+
+    rand = random.Random(42)
+    keys = []
+    for i in xrange(options.keys):
+        blob = ''.join(chr(rand.getrandbits(8)) for _ in xrange(279))
+        line = 'ssh-rsa %s user%d@host' % (base64.b64encode(blob), i)
+        keys.append(('user%d' % i, sshkey.get_ssh_pubkey(line)))
+    last = keydb.fingerprint(keys[-1][1].key.split()[1])
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        config = os.path.join(tmp, 'gitosis.conf')
+        fp = file(config, 'w')
+        fp.write('[gitosis]\ngenerate-files-in = %s\n' % tmp)
+        fp.close()
+        start = time.time()
+        keydb.write(os.path.join(tmp, 'authorized-keys.db'), keys)
+        results = [('write index', (time.time() - start) * 1000)]
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = TOPDIR
+        lookup = [sys.executable, '-c',
+                  'from gitosis.keydb import Main; Main.run()',
+                  '--config=%s' % config]
+        results.append(('lookup hit', best_of(options.runs, lookup + [last],
+                                              env)))
+        results.append(('lookup miss', best_of(
+                    options.runs, lookup + ['SHA256:nosuchkey'], env)))
+    finally:
+        shutil.rmtree(tmp)
+
+    for (label, ms) in results:
+        print '%-18s %10.2f ms' % (label, ms)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""
+Measure what serving the pack of a clone costs with and without
+``pack-cache``.
+
+Each number is the best of ``--runs`` runs of what ``git upload-pack``
+runs for a full clone of a repository of ``--files`` files:
+
+- ``pack-objects``: ``git pack-objects`` itself, without the cache,
+- ``cache miss``: ``gitosis-pack-objects`` on an empty cache,
+- ``cache hit``: ``gitosis-pack-objects`` with the pack in the cache.
+
+Usage::
+
+    python benchmarks/pack_cache.py [--runs N] [--files N]
+"""
+
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import repository
+
+PACK_OBJECTS = ['git', 'pack-objects', '--revs', '--thin', '--stdout',
+                '--delta-base-offset']
+
+def best_of(runs, args, env, data, setup=None):
+    best = None
+    for _ in xrange(runs):
+        if setup is not None:
+            setup()
+        start = time.time()
+        child = subprocess.Popen(args, env=env, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, close_fds=True)
+        out = child.communicate(data)[0]
+        elapsed = time.time() - start
+        if child.returncode != 0 or not out.startswith('PACK'):
+            raise SystemExit('%r failed with %d' % (args, child.returncode))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--files', type='int', default=20000)
+    (options, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        git_dir = os.path.join(tmp, 'foo.git')
+        repository.init(path=git_dir)
+        rand = random.Random(42)
+        repository.fast_import(
+            git_dir=git_dir,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='Benchmark\n',
+            files=[('file%d' % i,
+                    ''.join('%x\n' % rand.getrandbits(64)
+                            for _ in xrange(200)))
+                   for i in xrange(options.files)],
+            )
+        head = subprocess.Popen(
+            ['git', '--git-dir=%s' % git_dir, 'rev-parse', 'HEAD'],
+            stdout=subprocess.PIPE, close_fds=True).communicate()[0]
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = TOPDIR
+        env['GIT_DIR'] = git_dir
+        cache = os.path.join(tmp, 'pack-cache')
+        hook = [sys.executable, '-c',
+                'from gitosis.packcache import Main; Main.run()',
+                '--cache=%s' % cache] + PACK_OBJECTS
+
+        def empty():
+            if os.path.exists(cache):
+                shutil.rmtree(cache)
+            os.mkdir(cache)
+
+        results = [
+            ('pack-objects', best_of(options.runs, PACK_OBJECTS, env, head)),
+            ('cache miss', best_of(options.runs, hook, env, head, empty)),
+            ('cache hit', best_of(options.runs, hook, env, head)),
+            ]
+    finally:
+        shutil.rmtree(tmp)
+
+    for (label, ms) in results:
+        print '%-18s %10.2f ms' % (label, ms)
+
+if __name__ == '__main__':
+    main()
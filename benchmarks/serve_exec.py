@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""
+Measure the latency of a connection with and without ``direct-exec``.
+
+Each number is the best of ``--runs`` runs of a complete
+``gitosis-serve`` run for ``git-upload-pack``, with the real ``git``,
+for a client that hangs up right after the ref advertisement:
+
+- ``git shell``: the default, ``git shell -c`` parses the command again
+  and runs ``git upload-pack``,
+- ``direct-exec``: ``gitosis-serve`` runs ``git upload-pack`` itself.
+
+The same is reported for ``git`` alone, without ``gitosis-serve``.
+
+Usage::
+
+    python benchmarks/serve_exec.py [--runs N]
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import repository
+
+CONFIG = """\
+[gitosis]
+repositories = %(repositories)s
+direct-exec = %(direct)s
+
+[group bench]
+members = jdoe
+writable = foo
+"""
+
+def best_of(runs, args, env):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        child = subprocess.Popen(args, env=env, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, close_fds=True)
+        out = child.communicate('0000')[0]
+        elapsed = time.time() - start
+        if child.returncode != 0 or not out:
+            raise SystemExit('%r failed with %d' % (args, child.returncode))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=50)
+    (options, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        repositories = os.path.join(tmp, 'repositories')
+        git_dir = os.path.join(repositories, 'foo.git')
+        os.mkdir(repositories)
+        repository.init(path=git_dir)
+        repository.fast_import(
+            git_dir=git_dir,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='Benchmark\n',
+            files=[('foo', 'content')],
+            )
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = TOPDIR
+        env['HOME'] = tmp
+        env['SSH_ORIGINAL_COMMAND'] = "git-upload-pack 'foo'"
+
+        results = []
+        for (label, direct) in [('git shell', 'no'),
+                                ('direct-exec', 'yes')]:
+            config = os.path.join(tmp, 'gitosis-%s.conf' % direct)
+            fp = file(config, 'w')
+            fp.write(CONFIG % dict(repositories=repositories,
+                                   direct=direct))
+            fp.close()
+            results.append((label, best_of(
+                        options.runs,
+                        [sys.executable, '-c',
+                         'from gitosis.serve import Main; Main.run()',
+                         '--config=%s' % config, '--authd-socket=',
+                         'jdoe'],
+                        env)))
+        results.append(('git shell alone', best_of(
+                    options.runs,
+                    ['git', 'shell', '-c', "git-upload-pack '%s'" % git_dir],
+                    env)))
+        results.append(('direct alone', best_of(
+                    options.runs, ['git', 'upload-pack', git_dir], env)))
+    finally:
+        shutil.rmtree(tmp)
+
+    for (label, ms) in results:
+        print '%-18s %10.2f ms' % (label, ms)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""
+Measure what a single ``gitosis-serve`` invocation costs before git runs.
+
+Three numbers are reported, each the best of ``--runs`` runs:
+
+- ``interpreter``: starting Python and doing nothing,
+- ``import``: starting Python and importing :mod:`gitosis.serve`,
+- ``exec``: a complete ``gitosis-serve`` run up to ``execvp`` of a
+  dummy ``git`` that exits immediately.
+
+Pass ``--budget MS`` to exit non-zero when importing ``gitosis.serve``
+costs more than ``MS`` milliseconds on top of the bare interpreter.
+
+Usage::
+
+    python benchmarks/serve_startup.py [--runs N] [--budget MS]
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """\
+[gitosis]
+repositories = %(repositories)s
+
+[group bench]
+members = jdoe
+writable = foo
+"""
+
+def best_of(runs, args, env):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        code = subprocess.call(args, env=env, close_fds=True)
+        elapsed = time.time() - start
+        if code != 0:
+            raise SystemExit('%r failed with %d' % (args, code))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=20)
+    parser.add_option('--budget', type='float', default=None,
+                      help='fail if the import costs more than MS')
+    (options, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        repositories = os.path.join(tmp, 'repositories')
+        os.makedirs(os.path.join(repositories, 'foo.git'))
+        config = os.path.join(tmp, 'gitosis.conf')
+        fp = file(config, 'w')
+        fp.write(CONFIG % dict(repositories=repositories))
+        fp.close()
+
+        bindir = os.path.join(tmp, 'bin')
+        os.mkdir(bindir)
+        git = os.path.join(bindir, 'git')
+        fp = file(git, 'w')
+        fp.write('#!/bin/sh\nexit 0\n')
+        fp.close()
+        os.chmod(git, 0755)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = TOPDIR
+        env['PATH'] = bindir + os.pathsep + env.get('PATH', '')
+        env['HOME'] = tmp
+        env['SSH_ORIGINAL_COMMAND'] = "git-upload-pack 'foo'"
+
+        python = [sys.executable]
+        results = [
+            ('interpreter', best_of(options.runs, python + ['-c', 'pass'],
+                                    env)),
+            ('import', best_of(options.runs,
+                               python + ['-c', 'import gitosis.serve'], env)),
+            ('exec', best_of(options.runs,
+                             python + ['-c',
+                                       'from gitosis.serve import Main; '
+                                       'Main.run()',
+                                       '--config=%s' % config, 'jdoe'],
+                             env)),
+            ]
+    finally:
+        shutil.rmtree(tmp)
+
+    for (name, ms) in results:
+        print '%-12s %8.2f ms' % (name, ms)
+    overhead = results[1][1] - results[0][1]
+    print '%-12s %8.2f ms' % ('import cost', overhead)
+
+    if options.budget is not None and overhead > options.budget:
+        print >> sys.stderr, ('import of gitosis.serve takes %.2f ms, '
+                              'budget is %.2f ms' % (overhead, options.budget))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""
+Measure the throughput of the SSH public key parser over ``--lines``
+``authorized_keys`` lines, a mix of plain keys, keys with options as
+``gitosis`` writes them and a few with quoting, against the ``shlex``
+based parser it replaced.
+
+Reported are the best of ``--runs`` runs of parsing all lines with
+:func:`gitosis.sshkey.get_ssh_pubkey` and of
+:func:`gitosis.ssh.filterAuthorizedKeys` over all of them, and a single
+run of the old parser alone over the first ``--shlex-lines``, which
+takes long enough already.
+
+Usage::
+
+    python benchmarks/sshkey_parse.py [--runs N] [--lines N]
+        [--shlex-lines N]
+"""
+
+import base64
+import optparse
+import os
+import random
+import sys
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+from gitosis import ssh
+from gitosis import sshkey
+from gitosis.test import shlex_sshkey
+
+def best_of(runs, func, lines):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        func(lines)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def make_lines(count):
+    rand = random.Random(42)
+    lines = []
+    for i in xrange(count):
+        blob = base64.b64encode(''.join(chr(rand.getrandbits(8))
+                                        for _ in xrange(279)))
+        kind = i % 4
+        if kind == 0:
+            line = 'ssh-rsa %s user%d@host' % (blob, i)
+        elif kind == 1:
+            key = sshkey.get_ssh_pubkey('ssh-rsa %s user%d@host' % (blob, i))
+            line = ssh.authorizedKeysLine('user%d' % i, key)
+        elif kind == 2:
+            line = ('from="10.0.%d.0/24,!10.0.0.1" ssh-dss %s user%d@host'
+                    % (i % 256, blob, i))
+        else:
+            line = ('command="echo \\"hello\\"",no-pty ssh-rsa %s '
+                    'User %d <user%d@example.com>' % (blob, i, i))
+        lines.append(line)
+    return lines
+
+def parse_all(lines):
+    for line in lines:
+        sshkey.get_ssh_pubkey(line)
+
+def parse_all_shlex(lines):
+    for line in lines:
+        shlex_sshkey.explode_ssh_key(line)
+
+def filter_all(lines):
+    for _ in ssh.filterAuthorizedKeys(lines):
+        pass
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=3)
+    parser.add_option('--lines', type='int', default=100000)
+    parser.add_option('--shlex-lines', type='int', default=10000)
+    (options, args) = parser.parse_args()
+
+    lines = make_lines(options.lines)
+    old = lines[:options.shlex_lines]
+    results = [
+        ('parse', len(lines), best_of(options.runs, parse_all, lines)),
+        ('parse (shlex)', len(old), best_of(1, parse_all_shlex, old)),
+        ('filter', len(lines), best_of(options.runs, filter_all, lines)),
+        ]
+    for (label, count, ms) in results:
+        print '%-18s %10.2f ms  %8.0f lines/s' % (
+            label, ms, count / (ms / 1000))
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,11 @@ import os
 import logging
 
 from gitosis import group as _group
+from gitosis import pattern as _pattern
+
+#: Access modes granted in ``[group ...]`` sections, strongest first.
+#: ``writeable`` is a popular misspelling of ``writable``.
+MODES = ("writable", "writeable", "readonly")
 
 
 def get_repository_prefix(config, group = None):
@@ -28,6 +33,79 @@ def get_repository_prefix(config, group = None):
     return prefix or "repositories"
 
 
+class ConfigACL(object):
+    """Answer the questions :func:`allowed` asks straight from a parsed
+    ``gitosis`` config.
+
+    :class:`gitosis.snapshot.Snapshot` implements the same methods from
+    precompiled tables.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def owner(self, path):
+        return self.config.get("repo {0}".format(path), "owner")
+
+    def membership(self, user):
+        return _group.getMembership(config=self.config, user=user)
+
+    def patterns(self, group, mode):
+        cache = getattr(self.config, "cache", {})
+        key = ("patterns", group, mode)
+        patterns = cache.get(key)
+        if patterns is None:
+            patterns = cache[key] = _pattern.PatternSet(
+                self.config.get("group {0}".format(group), mode,
+                                default="").split())
+        return patterns
+
+    def mapping(self, group, mode, path):
+        return self.config.get("group {0}".format(group),
+                               "map {0} {1}".format(mode, path))
+
+    def prefix(self, group=None):
+        return get_repository_prefix(self.config, group)
+
+
+def get_acl(config):
+    """Return the fastest available access data source for `config`."""
+    return getattr(config, "snapshot", None) or ConfigACL(config)
+
+
+def _strip_extension(log, path):
+    """Repositories may always be referred to with a ``.git`` suffix."""
+    basename, ext = os.path.splitext(path)
+    if ext == ".git":
+        log.debug("Stripped `.git` suffix from {0}, new value {1}."
+                  .format(path, basename))
+        path = basename
+    return path
+
+
+def _grant(log, acl, user, group, mode, path):
+    """Check if `group` has `mode` access to `path`.
+
+    Returns ``None`` for no access, or the (possibly mapped) relative
+    path to the physical repository.
+    """
+    matched = acl.patterns(group, mode).match(path)
+    if matched == path:
+        log.debug("Access ok for {0!r} as {1!r} on {2!r}"
+                  .format(user, mode, path))
+        return path
+    elif matched is not None:
+        log.debug("Wildcard access ok for {0!r} as {1!r} on {2!r} ({3!r})"
+                  .format(user, mode, path, matched))
+        return path
+
+    mapping = acl.mapping(group, mode, path)
+    if mapping:
+        log.debug("Access ok for {0!r} as {1!r} on {2!r}={3!r}"
+                  .format(user, mode, path, mapping))
+        return mapping
+
+
 def allowed(config, user, mode, path):
     """Check if a user is allowed to access a given path.
 
@@ -44,44 +122,65 @@ def allowed(config, user, mode, path):
     """
     log = logging.getLogger("gitosis.access.allowed")
     log.debug("Access check for {0} as {1} on {2}...".format(user, mode, path))
-
-    basename, ext = os.path.splitext(path)
-    if ext == ".git":
-        log.debug("Stripped `.git` suffix from {0}, new value {1}."
-                  .format(path, basename))
-        path = basename
+    acl = get_acl(config)
+    path = _strip_extension(log, path)
 
     # a) first check if a user is an owner of the repository
     #    == has unlimited access.
-    owner = config.get("repo {0}".format(path), "owner")
+    owner = acl.owner(path)
     if owner and owner == user:
         log.debug("Acces ok for {0!r} as {1!r} on {2!r} (owner)"
                   .format(user, mode, path))
-        return get_repository_prefix(config), path
+        return acl.prefix(), path
 
     # b) iterate over user's groups and check if it has requested
     #    pass in any of the sections.
-    ok = False
-    for group in _group.getMembership(config=config, user=user):
-        repos = config.get("group {0}".format(group), mode, default="").split()
-        if path in repos:
-            log.debug("Access ok for {0!r} as {1!r} on {2!r}"
-                      .format(user, mode, path))
-            ok = True
-        elif os.path.join(os.path.dirname(path), "*") in repos:
-            log.debug("Wildcard access ok for {0!r} as {1!r} on {2!r}"
-                      .format(user, mode, path))
-            ok = True
-        else:
-            mapping = config.get("group {0}".format(group),
-                                 "map {0} {1}".format(mode, path))
-
-            if mapping:
-                log.debug("Access ok for {0!r} as {1!r} on {2!r}={3!r}"
-                          .format(user, mode, path, mapping))
-                ok, path = True, mapping
-
-        if ok:
-            prefix = get_repository_prefix(config, group)
-            log.debug("Using prefix {0!r}for {1!r}".format(prefix, path))
-            return prefix, path
+    for group in acl.membership(user):
+        relpath = _grant(log, acl, user, group, mode, path)
+        if relpath is not None:
+            prefix = acl.prefix(group)
+            log.debug("Using prefix {0!r}for {1!r}".format(prefix, relpath))
+            return prefix, relpath
+
+
+def resolve(config, user, path):
+    """Find the strongest access a user has to a given path.
+
+    This is equivalent to calling :func:`allowed` for every mode in
+    :data:`MODES` until one succeeds, but walks the user's groups only
+    once.
+
+    Returns ``None`` for no access, or a tuple of the granted mode,
+    toplevel directory containing repositories and a relative path to
+    the physical repository.
+
+    :param config: ``gitosis`` config object
+    :param str user: a user to check access rights for
+    :param str path: name of the repository to check access
+                     rights for
+    """
+    log = logging.getLogger("gitosis.access.resolve")
+    log.debug("Access check for {0} on {1}...".format(user, path))
+    acl = get_acl(config)
+    path = _strip_extension(log, path)
+
+    owner = acl.owner(path)
+    if owner and owner == user:
+        log.debug("Access ok for {0!r} on {1!r} (owner)".format(user, path))
+        return MODES[0], acl.prefix(), path
+
+    # the first group granting a mode wins for that mode, so only
+    # stronger modes are worth checking once something was granted.
+    best, grant = len(MODES), None
+    for group in acl.membership(user):
+        for rank, mode in enumerate(MODES[:best]):
+            relpath = _grant(log, acl, user, group, mode, path)
+            if relpath is not None:
+                best, grant = rank, (mode, acl.prefix(group), relpath)
+                break
+        if best == 0:
+            break
+
+    if grant is not None:
+        log.debug("Using {0!r} with prefix {1!r} for {2!r}".format(*grant))
+    return grant
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.admission
+    ~~~~~~~~~~~~~~~~~
+
+    This module implements limits on the number of fetches and pushes
+    running at the same time::
+
+        [gitosis]
+        ## defaults for every repository
+        max-concurrent-fetch = 20
+        max-concurrent-push = 5
+        ## wait this many seconds for a free slot, 0 to reject at once
+        max-concurrent-wait = 30
+        ## and let at most this many requests wait per limit
+        max-concurrent-queue = 50
+
+        [repo huge]
+        max-concurrent-fetch = 4
+
+        [group ci]
+        members = bot1 bot2
+        ## per member of the group, over all repositories
+        max-concurrent-fetch = 2
+
+    A repository limit comes from its ``[repo ...]`` section, or the
+    ``[gitosis]`` section. A user limit comes from the first group of
+    the user setting one.
+
+    Each limit is a set of slot files in ``locks`` under
+    :attr:`~gitosis.config.GitosisRawConfigParser.generated_files_dir`.
+    A request holds an exclusive :func:`fcntl.flock` on one slot file per
+    limit it is subject to, and keeps the descriptors open across the
+    ``exec`` of ``git``, so the kernel releases the slots whenever git
+    exits, however it exits. If no slot is free, the request takes a
+    queue slot, tells the user on stderr that it waits, and polls until
+    a slot frees up or the wait is over.
+
+    :license: GPL
+"""
+
+import binascii
+import errno
+import fcntl
+import os
+import sys
+import time
+
+from gitosis import access
+
+#: Verbs limited by ``max-concurrent-fetch``, archives are fetches too;
+#: everything else is a push.
+FETCH_VERBS = ('git-upload-pack', 'git upload-pack',
+               'git-upload-archive', 'git upload-archive')
+
+# descriptors of the slots held; they must stay open until exec
+_held = []
+
+_POLL_MIN = 0.05
+_POLL_MAX = 1.0
+
+
+class Busy(Exception):
+    """Too many requests running"""
+
+    def __str__(self):
+        return '%s, %s' % (self.__doc__, ': '.join(self.args))
+
+
+def _int(config, section, option):
+    value = config.get(section, option)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _escape(name):
+    return name.replace('%', '%25').replace('/', '%2F')
+
+
+def _filename(name):
+    """Shorten `name` to fit in a file name, keeping it unique."""
+    if len(name) <= 200:
+        return name
+    return '%s-%08x' % (name[:150], binascii.crc32(name) & 0xffffffff)
+
+
+def parameters(config, user, request):
+    """Returns the keyword arguments for :func:`admit` for a request, as
+    noted by :func:`gitosis.serve.serve`, or ``None`` if it is not
+    limited at all.
+    """
+    if request.get('verb') in FETCH_VERBS:
+        kind = 'fetch'
+    else:
+        kind = 'push'
+    option = 'max-concurrent-%s' % kind
+
+    limits = []
+    repo_limit = _int(config, 'repo %s' % request['repo'], option)
+    if repo_limit is None:
+        repo_limit = _int(config, 'gitosis', option)
+    if repo_limit is not None:
+        limits.append(('repo-%s-%s' % (kind, _escape(request['path'])),
+                       repo_limit))
+
+    for group in access.get_acl(config).membership(user):
+        user_limit = _int(config, 'group %s' % group, option)
+        if user_limit is not None:
+            limits.append(('user-%s-%s' % (kind, _escape(user)),
+                           user_limit))
+            break
+
+    if not limits:
+        return None
+    return dict(
+        lockdir=os.path.join(config.generated_files_dir, 'locks'),
+        limits=limits,
+        wait=_int(config, 'gitosis', 'max-concurrent-wait') or 0,
+        queue=_int(config, 'gitosis', 'max-concurrent-queue') or 0,
+        )
+
+
+def _lock_one(lockdir, name, count):
+    """Returns a descriptor holding one of `count` slots of `name`."""
+    for index in xrange(count):
+        path = os.path.join(lockdir, '%s.%d' % (_filename(name), index))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0640)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            continue
+        return fd
+    return None
+
+
+def _lock_all(lockdir, limits):
+    """Returns descriptors holding a slot of each limit, or ``None``."""
+    fds = []
+    for (name, count) in limits:
+        fd = _lock_one(lockdir, name, count)
+        if fd is None:
+            for fd in fds:
+                os.close(fd)
+            return None
+        fds.append(fd)
+    return fds
+
+
+def admit(lockdir, limits, wait=0, queue=0, stderr=None, clock=time.time,
+          sleep=time.sleep):
+    """Take a slot of each of `limits`, a list of ``(name, count)``.
+
+    Waits up to `wait` seconds for slots, if one of at most `queue`
+    places in line is free. Raises :exc:`Busy` when giving up. The slots
+    are held until the process, or the one it ``exec``\\s, exits.
+    """
+    if stderr is None:
+        stderr = sys.stderr
+    if not os.path.isdir(lockdir):
+        os.makedirs(lockdir, 0750)
+
+    fds = _lock_all(lockdir, limits)
+    if fds is not None:
+        _held.extend(fds)
+        return
+    if wait <= 0 or queue <= 0:
+        raise Busy('try again later')
+
+    # take a place in line; one queue per set of limits
+    name = 'queue-' + '+'.join(name for (name, _) in limits)
+    place = _lock_one(lockdir, name, queue)
+    if place is None:
+        raise Busy('too many waiting, try again later')
+    try:
+        stderr.write('gitosis: too many requests running,'
+                     ' waiting up to %d seconds...\n' % wait)
+        deadline = clock() + wait
+        delay = _POLL_MIN
+        while True:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                raise Busy('gave up after %d seconds' % wait)
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, _POLL_MAX)
+            fds = _lock_all(lockdir, limits)
+            if fds is not None:
+                _held.extend(fds)
+                return
+    finally:
+        os.close(place)
+
+
+def release():
+    """Give up all slots held by this process."""
+    while _held:
+        os.close(_held.pop())
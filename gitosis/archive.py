@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.archive
+    ~~~~~~~~~~~~~~~
+
+    This module implements a cache of the archives sent to
+    ``git archive --remote``, so that release tooling asking for the
+    tarball of the same tag again and again gets it from disk instead of
+    having it compressed each time::
+
+        [gitosis]
+        archive-cache = yes
+        ## MiB, the least recently used archives are evicted beyond that
+        archive-cache-size = 1024
+
+        [repo secret]
+        archive-cache = no
+
+    ``git upload-archive`` has no hook to run something else in its
+    place, so ``gitosis-serve`` runs ``gitosis-upload-archive`` instead
+    of it for the repositories the cache is enabled for. That speaks the
+    upload-archive protocol itself: it reads the arguments the client
+    sends, and keys the archive on them and on the object the tree-ish
+    among them resolves to, as the archive of a commit holds its id and
+    time. A hit sends the cached archive. A miss, or arguments that
+    can't be cached, run ``git upload-archive--writer``, which checks
+    and parses them like ``git upload-archive`` does, and the archive it
+    writes is stored as it is sent, like :mod:`gitosis.packcache` stores
+    packs. The arguments are part of the key as the client sent them,
+    so only what the writer accepted before is ever sent from the cache.
+
+    Archives live in ``archive-cache`` under
+    :attr:`~gitosis.config.GitosisRawConfigParser.generated_files_dir`;
+    hits and misses are counted in its ``stats`` file::
+
+        gitosis-upload-archive --cache=DIR --stats
+
+    :license: GPL
+"""
+
+import errno
+import os
+import sys
+
+from gitosis import app
+from gitosis import packcache
+
+#: How ``gitosis-serve`` runs the cache, see :func:`command_argv`.
+COMMAND = 'gitosis-upload-archive'
+
+#: Default for ``archive-cache-size``, in MiB.
+MAX_SIZE = 1024
+
+ARCHIVE_VERBS = ('git-upload-archive', 'git upload-archive')
+
+#: Options of ``git archive`` whose value may be the next argument.
+OPTIONS_WITH_VALUE = frozenset(['--format', '--prefix', '--output', '-o',
+                                '--remote', '--exec', '--add-file',
+                                '--mtime'])
+
+_SUFFIX = '.archive'
+
+# as many as git upload-archive takes
+_MAX_ARGS = 64
+
+# the most data a side-band packet carries: LARGE_PACKET_MAX, minus the
+# length and the band
+_SIDEBAND_MAX = 65520 - 5
+
+_DATA = 1
+_PROGRESS = 2
+_ERROR = 3
+
+
+class ProtocolError(Exception):
+    """Bad upload-archive request"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+
+def cache_dir(config):
+    """Returns where the archives of `config` are cached."""
+    return os.path.join(config.generated_files_dir, 'archive-cache')
+
+
+def command_argv(config, request):
+    """Returns the command line to ``exec`` for a request, as noted by
+    :func:`gitosis.serve.serve`, or ``None`` if it is not cached."""
+    if request.get('verb') not in ARCHIVE_VERBS:
+        return None
+    enabled = config.getboolean('gitosis', 'archive-cache', default=False)
+    if not config.getboolean('repo %s' % request['repo'], 'archive-cache',
+                             default=enabled):
+        return None
+    try:
+        size = int(config.get('gitosis', 'archive-cache-size',
+                              default=MAX_SIZE))
+    except ValueError:
+        size = MAX_SIZE
+    return [COMMAND,
+            '--cache=%s' % cache_dir(config),
+            '--max-size=%d' % (size * 1024 * 1024),
+            request['path']]
+
+
+def pkt_line(data):
+    """Returns `data` as a pkt-line."""
+    return '%04x%s' % (len(data) + 4, data)
+
+
+#: The pkt-line ending a list.
+FLUSH = '0000'
+
+
+def read_pkt_line(fp):
+    """Returns the next pkt-line of `fp`, without its newline, or
+    ``None`` for a flush."""
+    header = fp.read(4)
+    if len(header) != 4:
+        raise ProtocolError('unexpected end of input')
+    try:
+        size = int(header, 16)
+    except ValueError:
+        raise ProtocolError('bad pkt-line', repr(header))
+    if size == 0:
+        return None
+    if size < 4:
+        raise ProtocolError('bad pkt-line', repr(header))
+    data = fp.read(size - 4)
+    if len(data) != size - 4:
+        raise ProtocolError('unexpected end of input')
+    if data.endswith('\n'):
+        data = data[:-1]
+    return data
+
+
+def read_arguments(fp):
+    """Returns the arguments the client sends, up to the flush."""
+    args = []
+    while True:
+        line = read_pkt_line(fp)
+        if line is None:
+            return args
+        if len(args) >= _MAX_ARGS - 1:
+            raise ProtocolError('too many options')
+        if not line.startswith('argument '):
+            raise ProtocolError("'argument' token or flush expected")
+        args.append(line[len('argument '):])
+
+
+def treeish_index(args):
+    """Returns the index of the tree-ish in the ``git archive``
+    arguments `args`, or ``None`` if there is none, or the archive
+    can't be cached, e.g. for ``--list``."""
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--':
+            i += 1
+            break
+        if not arg.startswith('-') or arg == '-':
+            break
+        if arg in ('-l', '--list'):
+            return None
+        if arg in OPTIONS_WITH_VALUE:
+            i += 1
+        i += 1
+    if i < len(args):
+        return i
+    return None
+
+
+def resolve(git_dir, treeish):
+    """Returns the object id `treeish` names in `git_dir`, tags peeled,
+    or ``None`` if it names none."""
+    import subprocess
+
+    if ':' not in treeish:
+        # with a path, whatever follows the colon is part of it
+        treeish += '^{}'
+    child = subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir, 'rev-parse', '--verify',
+              '--quiet', '--end-of-options', treeish],
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    out = child.communicate()[0]
+    if child.returncode != 0:
+        return None
+    return out.strip() or None
+
+
+def cache_key(repository, args, object_id):
+    """Returns the key of the archive `args` ask for from `repository`,
+    their tree-ish naming `object_id`."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    digest.update(os.path.realpath(repository))
+    for arg in args:
+        digest.update('\0' + arg)
+    digest.update('\0\0' + object_id)
+    return digest.hexdigest()
+
+
+def _path(cache, key):
+    return os.path.join(cache, key[:2], key[2:] + _SUFFIX)
+
+
+def _sideband(out, band, data):
+    for start in xrange(0, len(data), _SIDEBAND_MAX):
+        out.write(pkt_line(chr(band) + data[start:start+_SIDEBAND_MAX]))
+
+
+def _send_cached(path, stdout):
+    """Send the archive at `path`, returns ``False`` if it is not
+    there."""
+    try:
+        fp = file(path, 'rb')
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+    try:
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        stdout.write(pkt_line('ACK\n') + FLUSH)
+        while True:
+            chunk = fp.read(_SIDEBAND_MAX)
+            if not chunk:
+                break
+            _sideband(stdout, _DATA, chunk)
+    finally:
+        fp.close()
+    stdout.write(FLUSH)
+    stdout.flush()
+    return True
+
+
+def _run_writer(git_dir, args, stdout, out, max_size):
+    """Run ``git upload-archive--writer`` for `args`, sending what it
+    writes to `stdout` and the archive to `out` too, until it grows
+    beyond `max_size`.
+
+    Returns the exit status and whether `out` got all of the archive.
+    """
+    import select
+    import subprocess
+
+    request = ''.join(pkt_line('argument %s\n' % arg) for arg in args)
+    try:
+        child = subprocess.Popen(
+            args=['git', 'upload-archive--writer', git_dir],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            close_fds=True,
+            )
+    except OSError:
+        stdout.write(pkt_line('NACK unable to spawn subprocess\n'))
+        stdout.flush()
+        raise
+    stdout.write(pkt_line('ACK\n') + FLUSH)
+    stdout.flush()
+    # it reads all arguments before writing anything
+    child.stdin.write(request + FLUSH)
+    child.stdin.close()
+
+    size = 0
+    complete = out is not None
+    bands = {child.stdout.fileno(): _DATA, child.stderr.fileno(): _PROGRESS}
+    while bands:
+        (ready, _, _) = select.select(list(bands), [], [])
+        for fd in ready:
+            chunk = os.read(fd, _SIDEBAND_MAX)
+            if not chunk:
+                del bands[fd]
+                continue
+            _sideband(stdout, bands[fd], chunk)
+            if bands[fd] == _DATA and complete:
+                size += len(chunk)
+                if size > max_size:
+                    # too big to keep
+                    complete = False
+                else:
+                    out.write(chunk)
+        stdout.flush()
+    status = child.wait()
+    if status != 0:
+        _sideband(stdout, _ERROR,
+                  'upload-archive: archiver died with error\n')
+    else:
+        stdout.write(FLUSH)
+    stdout.flush()
+    return (status, complete and status == 0)
+
+
+def upload_archive(cache, max_size, git_dir, stdin, stdout):
+    """Serve a ``git archive --remote`` client on `stdin` and `stdout`
+    from `cache` if the archive it asks for is there.
+
+    Returns the exit status.
+    """
+    try:
+        args = read_arguments(stdin)
+    except ProtocolError, e:
+        stdout.write(pkt_line('NACK %s\n' % e))
+        stdout.flush()
+        return 1
+
+    key = None
+    index = treeish_index(args)
+    if index is not None:
+        object_id = resolve(git_dir, args[index])
+        if object_id is not None:
+            key = cache_key(git_dir, args, object_id)
+    if key is None:
+        (status, _) = _run_writer(git_dir, args, stdout, None, max_size)
+        return status
+
+    path = _path(cache, key)
+    if _send_cached(path, stdout):
+        packcache.count(cache, 'hits')
+        return 0
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0750)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    packcache.count(cache, 'misses')
+    tmp = os.path.join(directory, '.tmp-%d-%s' % (os.getpid(), key[:16]))
+    out = file(tmp, 'wb')
+    try:
+        try:
+            (status, complete) = _run_writer(git_dir, args, stdout, out,
+                                             max_size)
+        finally:
+            out.close()
+    except:
+        os.unlink(tmp)
+        raise
+    if complete:
+        os.rename(tmp, path)
+        packcache.evict(cache, max_size, suffix=_SUFFIX)
+    else:
+        os.unlink(tmp)
+    return status
+
+
+class Main(app.App):
+    """gitosis-upload-archive program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog --cache=DIR [OPTS] REPOSITORY')
+        parser.set_description(
+            'Serve git archive --remote like git upload-archive, caching'
+            ' the archives')
+        parser.set_defaults(
+            max_size=MAX_SIZE * 1024 * 1024,
+            )
+        parser.add_option('--cache', metavar='DIR',
+                          help='cache archives in DIR')
+        parser.add_option('--max-size', metavar='BYTES', type='int',
+                          help='keep at most BYTES of archives')
+        parser.add_option('--stats', action='store_true',
+                          help='print the hit and miss counters and exit')
+        return parser
+
+    def read_config(self, options, cfg):
+        """It gets all it needs on the command line."""
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        if options.cache is None:
+            parser.error('Missing option --cache.')
+        if options.stats:
+            counters = packcache.stats(options.cache)
+            for name in ('hits', 'misses'):
+                print '%s %d' % (name, counters[name])
+            return
+        try:
+            (git_dir,) = args
+        except ValueError:
+            parser.error('Missing repository.')
+        try:
+            status = upload_archive(
+                cache=options.cache,
+                max_size=options.max_size,
+                git_dir=git_dir,
+                stdin=sys.stdin,
+                stdout=sys.stdout,
+                )
+        except IOError, e:
+            # the client hung up
+            if e.errno != errno.EPIPE:
+                raise
+            status = 1
+        sys.exit(status)
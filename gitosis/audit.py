@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.audit
+    ~~~~~~~~~~~~~
+
+    This module implements the audit log of access decisions, and
+    ``gitosis-audit`` to read it. It is enabled with::
+
+        [gitosis]
+        audit-log = /var/log/gitosis/audit.log
+        ## rotate when the log grows beyond this many bytes, 0 for never
+        audit-rotate-size = 104857600
+        ## start a new log every this many seconds, 0 for never
+        audit-rotate-interval = 86400
+
+    Every request served by :func:`gitosis.serve.serve` adds one JSON
+    object per line::
+
+        {"time": 1350000000.123, "pid": 4711, "user": "jdoe",
+         "decision": "granted", "verb": "git-upload-pack", "repo": "foo",
+         "mode": "writable"}
+
+    ``decision`` is one of ``granted``, ``created``, when the repository
+    was created on the fly, ``denied``, or ``busy``, when the server
+    turned it away for now (see :mod:`gitosis.admission`), the latter two
+    with the message given to the user in ``reason``. A request let
+    through is only logged once ``gitosis-serve`` got its slot, right
+    before it runs git. ``verb`` and ``repo`` are left out if the request
+    was denied before they were known, the raw ``command`` is included
+    instead.
+
+    Records are formatted by hand, so ``gitosis-serve`` doesn't pay for
+    importing :mod:`json`, and written with a single ``write`` to a file
+    opened with ``O_APPEND``: concurrent requests never mix their lines
+    and nothing is locked. Rotation renames the log to
+    ``audit.log.YYYYmmddHHMMSS.INODE``, the time being that of the last
+    record in it; a request racing a rotation may still add its record
+    to the renamed file, but no record is ever lost.
+
+    :license: GPL
+"""
+
+import errno
+import os
+import sys
+import time
+
+from gitosis import app
+
+GRANTED = "granted"
+CREATED = "created"
+DENIED = "denied"
+BUSY = "busy"
+
+#: Default for ``audit-rotate-size``.
+ROTATE_SIZE = 100 * 1024 * 1024
+
+# JSON string escapes for the characters that need them; everything
+# beyond ASCII is passed through as a code point of the same number,
+# as we don't know the encoding
+_ESCAPES = dict((chr(i), "\\u%04x" % i)
+                for i in range(0x20) + range(0x7f, 0x100))
+_ESCAPES.update({'"': '\\"', "\\": "\\\\"})
+
+
+def _quote(value):
+    if isinstance(value, unicode):
+        # read back from a log, see above
+        try:
+            value = value.encode("latin-1")
+        except UnicodeEncodeError:
+            value = value.encode("utf-8")
+    return '"%s"' % "".join([_ESCAPES.get(c, c) for c in value])
+
+
+def format_record(record):
+    """Returns `record`, a dict of strings and numbers, as a JSON line.
+
+    ``time`` always comes first, so lines can be found by time with a
+    plain text search.
+    """
+    fields = ['"time": %.3f' % record["time"]]
+    for key in sorted(record):
+        value = record[key]
+        if key == "time" or value is None:
+            continue
+        if isinstance(value, bool):
+            value = value and "true" or "false"
+        elif isinstance(value, (int, long, float)):
+            value = repr(value)
+        else:
+            value = _quote(value)
+        fields.append("%s: %s" % (_quote(key), value))
+    return "{%s}\n" % ", ".join(fields)
+
+
+def _rotated_name(path, st):
+    stamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(st.st_mtime))
+    return "%s.%s.%d" % (path, stamp, st.st_ino)
+
+
+def _needs_rotation(st, now, size, interval):
+    if st.st_size == 0:
+        return False
+    if size and st.st_size >= size:
+        return True
+    if interval and int(st.st_mtime // interval) != int(now // interval):
+        return True
+    return False
+
+
+def append(path, data, now=None, size=ROTATE_SIZE, interval=0):
+    """Append `data` to the log at `path`, rotating it first if it grew
+    beyond `size` bytes, or its last record is from an earlier `interval`
+    of seconds than `now`.
+    """
+    if now is None:
+        now = time.time()
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+    fd = os.open(path, flags, 0640)
+    try:
+        st = os.fstat(fd)
+        if _needs_rotation(st, now, size, interval):
+            try:
+                current = os.stat(path)
+            except OSError:
+                current = None
+            # only rotate the file we looked at, not one another
+            # process has started since
+            if current is not None and current.st_ino == st.st_ino:
+                os.rename(path, _rotated_name(path, st))
+            os.close(fd)
+            fd = os.open(path, flags, 0640)
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def log_path(config):
+    """Returns the audit log of `config`, or ``None``."""
+    path = config.get("gitosis", "audit-log")
+    if path:
+        return os.path.expanduser(path)
+    return None
+
+
+def settings(config):
+    """Returns where and how `config` wants records logged, a dict for
+    :func:`write`, or ``None`` if auditing is disabled."""
+    path = log_path(config)
+    if path is None:
+        return None
+    try:
+        return dict(
+            path=path,
+            size=int(config.get("gitosis", "audit-rotate-size",
+                                default=ROTATE_SIZE)),
+            interval=int(config.get("gitosis", "audit-rotate-interval",
+                                    default=0)),
+            )
+    except ValueError:
+        return None
+
+
+def write(settings, user, decision, **fields):
+    """Log `decision` on a request of `user` as told by `settings`, see
+    :func:`settings`, if auditing is enabled.
+
+    Failing to log never fails the request.
+    """
+    if settings is None:
+        return
+    fields.update(
+        time=time.time(),
+        pid=os.getpid(),
+        user=user,
+        decision=decision,
+        )
+    try:
+        append(
+            settings["path"],
+            format_record(fields),
+            now=fields["time"],
+            size=settings["size"],
+            interval=settings["interval"],
+            )
+    except (IOError, OSError):
+        pass
+
+
+def record(config, user, decision, **fields):
+    """Log `decision` on a request of `user`, if auditing is enabled."""
+    write(settings(config), user, decision, **fields)
+
+
+def record_request(settings, user, request, decision=None, **fields):
+    """Log `decision` on `request`, as noted by :func:`gitosis.serve.serve`.
+
+    Without a `decision`, the request was let through and is logged as
+    ``created`` if the repository was created for it, ``granted``
+    otherwise.
+    """
+    fields.update(request)
+    if decision is None:
+        if fields.pop("created", False):
+            decision = CREATED
+        else:
+            decision = GRANTED
+    write(settings, user, decision, **fields)
+
+
+def log_files(path):
+    """Returns the rotated logs of `path`, oldest first, and `path`."""
+    directory, name = os.path.split(path)
+    prefix = name + "."
+    rotated = []
+    for filename in os.listdir(directory or "."):
+        if not filename.startswith(prefix):
+            continue
+        parts = filename[len(prefix):].split(".")
+        if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+            rotated.append((parts[0], int(parts[1]), filename))
+    rotated.sort()
+    files = [os.path.join(directory, filename)
+             for (_, _, filename) in rotated]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read(files, since=None):
+    """Generate the records in `files`, one line at a time.
+
+    Rotated logs whose last record is older than `since` are skipped
+    without opening them. Malformed lines are skipped, too.
+    """
+    import json
+
+    for path in files:
+        if since is not None:
+            stamp = os.path.basename(path).split(".")[-2:-1]
+            if stamp and stamp[0].isdigit() and len(stamp[0]) == 14:
+                last = time.strptime(stamp[0], "%Y%m%d%H%M%S")
+                if _timegm(last) < int(since):
+                    continue
+        fp = file(path)
+        try:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since is not None and record.get("time", 0) < since:
+                    continue
+                yield record
+        finally:
+            fp.close()
+
+
+def _timegm(struct):
+    import calendar
+    return calendar.timegm(struct)
+
+
+def parse_time(value):
+    """Parse a UNIX timestamp or an UTC date ``YYYY-MM-DD[THH:MM[:SS]]``."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for pattern in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return float(_timegm(time.strptime(value, pattern)))
+        except ValueError:
+            pass
+    raise ValueError("invalid time: %r" % value)
+
+
+def matches(record, options):
+    """Returns whether `record` passes the filters in `options`."""
+    import fnmatch
+
+    if options.until is not None and record.get("time", 0) >= options.until:
+        return False
+    for key in ("user", "decision", "verb"):
+        wanted = getattr(options, key)
+        if wanted is not None and record.get(key) != wanted:
+            return False
+    if options.repo is not None and not fnmatch.fnmatchcase(
+            record.get("repo", ""), options.repo):
+        return False
+    return True
+
+
+class Main(app.App):
+    """gitosis-audit program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Print audit log records, oldest first')
+        parser.add_option('--log', metavar='FILE',
+                          help='read FILE and its rotated logs instead'
+                          +' of audit-log from the config')
+        parser.add_option('--user', help='only records of USER')
+        parser.add_option('--repo', metavar='PATTERN',
+                          help='only repositories matching PATTERN')
+        parser.add_option('--decision',
+                          help='only %s, %s, %s or %s' % (
+                              GRANTED, CREATED, DENIED, BUSY))
+        parser.add_option('--verb', help='only this git command')
+        parser.add_option('--since', metavar='TIME',
+                          help='only records at TIME or later, a UNIX'
+                          +' timestamp or YYYY-MM-DD[THH:MM[:SS]] in UTC')
+        parser.add_option('--until', metavar='TIME',
+                          help='only records before TIME')
+        return parser
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        if args:
+            parser.error('not expecting arguments')
+        path = options.log or log_path(cfg)
+        if path is None:
+            parser.error('no audit-log in the config, use --log')
+        try:
+            for key in ('since', 'until'):
+                value = getattr(options, key)
+                if value is not None:
+                    setattr(options, key, parse_time(value))
+        except ValueError, e:
+            parser.error(str(e))
+
+        out = sys.stdout
+        try:
+            for record in read(log_files(path), since=options.since):
+                if matches(record, options):
+                    out.write(format_record(record))
+        except IOError, e:
+            # e.g. piped into head
+            if e.errno != errno.EPIPE:
+                raise
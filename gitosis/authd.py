@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.authd
+    ~~~~~~~~~~~~~
+
+    This module implements ``gitosis-authd``, an optional long-running
+    process that makes the access decisions of ``gitosis-serve``.
+
+    The daemon keeps the parsed config, and with it the membership index
+    and compiled repository patterns, in memory and answers requests on
+    a UNIX socket. ``gitosis-serve`` sends the user name and
+    ``SSH_ORIGINAL_COMMAND`` there, and only loads the config itself if
+    nobody is listening.
+
+    Every request checks whether ``gitosis.conf`` changed since it was
+    loaded, the same way snapshots are checked (see
+    :func:`gitosis.snapshot.stamp`), and reloads it if so.
+
+    A request is a :mod:`marshal` dump of ``(user, command)``, the reply
+    one of a dict holding either ``error``, the message to show the user,
+    or ``command`` and ``env``, what to run and with which extra
+    environment, and ``admission``, the concurrency limits to wait for
+    (see :mod:`gitosis.admission`). With timing enabled (see
+    :mod:`gitosis.timing`), it also holds ``timing-log``, ``phases`` and
+    ``fields`` for the record ``gitosis-serve`` writes. The socket is
+    only accessible by the gitosis user.
+
+    :license: GPL
+"""
+
+import logging
+import marshal
+import os
+import SocketServer
+import sys
+import threading
+
+from gitosis import admission
+from gitosis import app
+from gitosis import audit
+from gitosis import identity
+from gitosis import packcache
+from gitosis import protocol
+from gitosis import resources
+from gitosis import serve
+from gitosis import snapshot
+from gitosis import timing
+
+log = logging.getLogger("gitosis.authd")
+
+#: Requests are a user name and a command line; anything bigger is junk.
+MAX_REQUEST = 64 * 1024
+
+
+class Authorizer(object):
+    """Decides on requests, using the config loaded by `load`.
+
+    `load` is called again whenever the file at `config_path` changed.
+    """
+
+    def __init__(self, config_path, load, config=None):
+        self.config_path = config_path
+        self._load = load
+        self._lock = threading.Lock()
+        self._config = config
+        self._stamp = None
+        if config is not None:
+            self._stamp = self._current_stamp()
+
+    def _current_stamp(self):
+        try:
+            return snapshot.stamp(self.config_path)
+        except OSError:
+            return None
+
+    def config(self):
+        """Returns the config, reloading it first if it changed."""
+        current = self._current_stamp()
+        if self._config is None or current != self._stamp:
+            self._lock.acquire()
+            try:
+                if self._config is None or current != self._stamp:
+                    log.info('Loading %r', self.config_path)
+                    self._config = self._load()
+                    self._stamp = current
+            finally:
+                self._lock.release()
+        return self._config
+
+    def decide(self, user, command):
+        """Returns the reply for `user` asking to run `command`."""
+        cfg = self.config()
+        timer = timing.Timer()
+        timer.note('user', user)
+        request = {}
+        try:
+            newcmd = serve.serve(cfg=cfg, user=user, command=command,
+                                 timer=timer, request=request)
+        except serve.ServingError, e:
+            timer.note('decision', 'deny: %s' % e)
+            reply = dict(error=str(e))
+        else:
+            timer.note('decision', 'allow')
+            reply = dict(
+                command=newcmd,
+                argv=serve.command_argv(cfg, request, newcmd),
+                env=identity.lookup(cfg, user),
+                )
+            timer.mark('identity')
+            # the slots are taken by gitosis-serve, which execs git
+            params = admission.parameters(cfg, user, request)
+            if params is not None:
+                reply['admission'] = params
+            policy = protocol.policy(cfg, request)
+            if policy is not None:
+                reply['protocol'] = policy
+            params = resources.parameters(cfg, user, request)
+            if params is not None:
+                reply['resources'] = params
+            command = packcache.hook(cfg, request)
+            if command is not None:
+                reply['pack-cache'] = command
+            settings = audit.settings(cfg)
+            if settings is not None:
+                # gitosis-serve logs the grant, once it got its slot
+                reply['audit'] = settings
+                reply['request'] = request
+        path = timing.log_path(cfg)
+        if path is not None:
+            # gitosis-serve writes the record, adding its own phases
+            reply['timing-log'] = path
+            reply['phases'] = timer.phases
+            reply['fields'] = timer.fields
+        return reply
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Answers a single request from ``gitosis-serve``."""
+
+    def handle(self):
+        data = self.rfile.read(MAX_REQUEST + 1)
+        try:
+            (user, command) = marshal.loads(data[:MAX_REQUEST])
+        except (EOFError, ValueError, TypeError):
+            log.warning('Ignoring malformed request')
+            return
+        if not isinstance(user, str) or not isinstance(command, str):
+            log.warning('Ignoring malformed request')
+            return
+        try:
+            reply = self.server.authorizer.decide(user, command)
+        except Exception:
+            # no reply makes gitosis-serve decide by itself, which
+            # reports the problem to the user
+            log.exception('Failed to serve %r for %r', command, user)
+            return
+        self.wfile.write(marshal.dumps(reply))
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """A UNIX socket server answering with `authorizer`."""
+
+    daemon_threads = True
+
+    # CI jobs connect in bursts; the default backlog of 5 turns most of
+    # a burst away, and every client turned away decides by itself.
+    request_queue_size = 128
+
+    def __init__(self, path, authorizer):
+        if os.path.exists(path):
+            os.unlink(path)
+        old_umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.authorizer = authorizer
+
+
+class Main(app.App):
+    """gitosis-authd program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Answer gitosis-serve access requests on a UNIX socket')
+        parser.set_defaults(
+            socket=serve.AUTHD_SOCKET,
+            )
+        parser.add_option('--socket',
+                          metavar='PATH',
+                          help='listen on PATH',
+                          )
+        return parser
+
+    def read_config(self, options, cfg):
+        """Restore the config from its snapshot, parse it if there's none."""
+        if not snapshot.restore(cfg, options.config):
+            super(Main, self).read_config(options, cfg)
+
+    def load(self, options):
+        """Returns a freshly read config."""
+        cfg = self.create_config(options)
+        self.read_config(options, cfg)
+        return cfg
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        if args:
+            parser.error('not expecting arguments')
+
+        # behave like gitosis-serve, which runs in the home directory
+        os.umask(0022)
+        os.chdir(os.path.expanduser('~'))
+        # once for all requests; timing-log may be set by a later config
+        timing.clock = timing.monotonic()
+
+        authorizer = Authorizer(
+            config_path=options.config,
+            load=lambda: self.load(options),
+            config=cfg,
+            )
+        path = os.path.expanduser(options.socket)
+        server = Server(path, authorizer)
+        log.info('Listening on %r', path)
+        try:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        finally:
+            server.server_close()
+            os.unlink(path)
+        sys.exit(0)
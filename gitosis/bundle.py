@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.bundle
+    ~~~~~~~~~~~~~~
+
+    This module implements ``gitosis-bundle``, which keeps git bundles of
+    the repositories owned by :mod:`gitosis` in a bundle store, so that
+    fresh clones of big repositories can start from a static file instead
+    of a pack ``git upload-pack`` generates for each of them::
+
+        [gitosis]
+        ## bundle every repository, default no
+        bundle = yes
+        ## default bundles under generate-files-in
+        bundle-dir = /srv/bundles
+        ## after that many incremental bundles, the next is a full one
+        bundle-max-incremental = 8
+        ## repositories refreshed in parallel, default one per CPU
+        bundle-jobs = 4
+
+        [repo tiny]
+        bundle = no
+
+    Run it from cron. For each repository whose branches or tags changed
+    since the last run, it writes a bundle of what is new since then,
+    or of everything, the first time and every ``bundle-max-incremental``
+    runs. Repositories that didn't change cost a single
+    ``git for-each-ref``.
+
+    The store has a directory per repository, with its bundles, the
+    refs they were made of in ``refs``, and ``bundle-list``, a bundle
+    list as ``git clone --bundle-uri`` of recent git reads it: the
+    latest full bundle and the incremental ones after it, with relative
+    URIs and increasing ``creationToken``\ s. Publish the store with any web
+    server and point clients to ``URL/REPO/bundle-list``, then have them
+    fetch the rest from :mod:`gitosis` as usual.
+
+    Files are written under temporary names and renamed into place, the
+    list last, so the store can be served while it is refreshed.
+
+    :license: GPL
+"""
+
+import errno
+import logging
+import os
+import sys
+import time
+
+from gitosis import app
+from gitosis import gitconfig
+from gitosis import util
+
+log = logging.getLogger('gitosis.bundle')
+
+#: Default for ``bundle-max-incremental``.
+MAX_INCREMENTAL = 8
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+
+_SUFFIX = '.bundle'
+
+# what a bundle holds
+_REFS = ['refs/heads', 'refs/tags']
+
+
+class BundleError(Exception):
+    """Git bundle failed"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+
+def store_dir(config):
+    """Returns the directory of the bundle store of `config`."""
+    path = config.get('gitosis', 'bundle-dir')
+    if path is None:
+        path = os.path.join(config.generated_files_dir, 'bundles')
+    return os.path.expanduser(path)
+
+
+def enabled(config, name):
+    """Returns whether repository `name` is bundled."""
+    default = config.getboolean('gitosis', 'bundle', default=False)
+    return config.getboolean('repo %s' % name, 'bundle', default=default)
+
+
+def repositories(config):
+    """Generate the names of the repositories owned by :mod:`gitosis`."""
+    base_dir = config.repository_dir
+    for dirpath, dirnames, _ in util.walk(base_dir):
+        reldir = os.path.relpath(dirpath, base_dir)
+        reldir = reldir if reldir != '.' else ''
+        for dirname in sorted(dirnames):
+            if not dirname.endswith('.git'):
+                continue
+            dirnames.remove(dirname)
+            yield os.path.join(reldir, dirname[:-len('.git')])
+
+
+def _git(git_dir, args, stdin=None):
+    import subprocess
+
+    child = subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir] + args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=True,
+        )
+    (out, err) = child.communicate(stdin)
+    if child.returncode != 0:
+        raise BundleError(args[0], err.strip()
+                          or 'exit status %d' % child.returncode)
+    return out
+
+
+def read_refs(git_dir):
+    """Returns the branches and tags of `git_dir`, a sorted list of
+    ``(refname, object name)``."""
+    out = _git(git_dir, ['for-each-ref',
+                         '--format=%(refname) %(objectname)'] + _REFS)
+    return sorted(tuple(line.split(' ', 1)) for line in out.splitlines())
+
+
+def _format_refs(refs):
+    return ''.join('%s %s\n' % ref for ref in refs)
+
+
+def _read_file(path):
+    try:
+        fp = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        return fp.read()
+    finally:
+        fp.close()
+
+
+def _write_file(path, data):
+    tmp = '%s.tmp-%d' % (path, os.getpid())
+    fp = file(tmp, 'w')
+    try:
+        fp.write(data)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+
+
+def bundles(path):
+    """Returns the bundles in the store directory `path`, a sorted list
+    of ``(creation token, kind)``."""
+    found = []
+    try:
+        names = os.listdir(path)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return found
+    for name in names:
+        if not name.endswith(_SUFFIX):
+            continue
+        (token, _, kind) = name[:-len(_SUFFIX)].partition('-')
+        if kind in (FULL, INCREMENTAL) and token.isdigit():
+            found.append((int(token), kind))
+    return sorted(found)
+
+
+def bundle_name(token, kind):
+    """Returns the file name of a bundle."""
+    return '%d-%s%s' % (token, kind, _SUFFIX)
+
+
+def bundle_list(current):
+    """Returns the ``bundle-list`` text for the bundles `current`, as
+    :func:`bundles` returns them."""
+    cfg = gitconfig.ConfigFile()
+    cfg.set_all('bundle.version', ['1'])
+    cfg.set_all('bundle.mode', ['all'])
+    cfg.set_all('bundle.heuristic', ['creationToken'])
+    for (token, kind) in current:
+        key = 'bundle.%d-%s' % (token, kind)
+        cfg.set_all(key + '.uri', [bundle_name(token, kind)])
+        cfg.set_all(key + '.creationToken', [str(token)])
+    return cfg.text()
+
+
+def _create(git_dir, path, refs, exclude):
+    """Write the bundle of `refs` minus what `exclude` reaches to
+    `path`. Returns ``False`` if there is nothing to bundle."""
+    tmp = '%s.tmp-%d' % (path, os.getpid())
+    lines = [refname for (refname, _) in refs]
+    lines.extend('^%s' % sha for sha in sorted(set(exclude)))
+    try:
+        _git(git_dir, ['bundle', 'create', '-q', tmp, '--stdin'],
+             stdin=''.join(line + '\n' for line in lines))
+    except BundleError, e:
+        util.unlink(tmp)
+        if 'empty bundle' in str(e):
+            return False
+        raise
+    os.rename(tmp, path)
+    return True
+
+
+def refresh(git_dir, path, max_incremental=MAX_INCREMENTAL, now=None):
+    """Bring the bundles of repository `git_dir` in the store directory
+    `path` up to date.
+
+    Returns what was written, :data:`FULL`, :data:`INCREMENTAL`, or
+    ``None`` if the refs didn't change since the last run.
+    """
+    refs = read_refs(git_dir)
+    if not refs:
+        # nothing to clone yet, or any more
+        return None
+    refs_file = os.path.join(path, 'refs')
+    old = _read_file(refs_file)
+    current = bundles(path)
+    if old == _format_refs(refs) and current:
+        return None
+    util.makedirs(path)
+
+    if now is None:
+        now = time.time()
+    token = int(now)
+    if current and token <= current[-1][0]:
+        # the clock went back, or two runs within a second
+        token = current[-1][0] + 1
+
+    # the list always starts with the full bundle
+    kind = None
+    if (old is not None and current and current[0][1] == FULL
+        and len(current) <= max_incremental):
+        exclude = [line.split(' ', 1)[1] for line in old.splitlines()]
+        bundle = os.path.join(path, bundle_name(token, INCREMENTAL))
+        try:
+            if _create(git_dir, bundle, refs, exclude):
+                kind = INCREMENTAL
+        except BundleError, e:
+            # e.g. an old tip that was garbage collected since
+            log.warning('Incremental bundle of %r failed, %s',
+                        git_dir, e)
+            kind = FULL
+    else:
+        kind = FULL
+    if kind == FULL:
+        bundle = os.path.join(path, bundle_name(token, FULL))
+        _create(git_dir, bundle, refs, [])
+
+    if kind == INCREMENTAL:
+        current.append((token, kind))
+        obsolete = []
+    elif kind == FULL:
+        obsolete = current
+        current = [(token, kind)]
+    else:
+        # nothing new, e.g. refs were deleted: keep the bundles there are
+        obsolete = []
+    _write_file(os.path.join(path, 'bundle-list'), bundle_list(current))
+    _write_file(refs_file, _format_refs(refs))
+    for (old_token, old_kind) in obsolete:
+        util.unlink(os.path.join(path, bundle_name(old_token, old_kind)))
+    return kind
+
+
+def _refresh_one(args):
+    (name, git_dir, path, max_incremental) = args
+    try:
+        return (name, refresh(git_dir, path, max_incremental), None)
+    except (BundleError, IOError, OSError), e:
+        return (name, None, e)
+
+
+def refresh_all(config, names=None, jobs=None):
+    """Refresh the bundles of the repositories `names`, by default all
+    those :func:`enabled`, running `jobs` at a time.
+
+    Returns the number of repositories that failed.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if names is None:
+        names = [name for name in repositories(config)
+                 if enabled(config, name)]
+    store = store_dir(config)
+    try:
+        max_incremental = int(config.get('gitosis', 'bundle-max-incremental',
+                                         default=MAX_INCREMENTAL))
+    except ValueError:
+        max_incremental = MAX_INCREMENTAL
+    if jobs is None:
+        try:
+            jobs = int(config.get('gitosis', 'bundle-jobs', default=0))
+        except ValueError:
+            jobs = 0
+    if jobs <= 0:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+
+    work = [(name,
+             os.path.join(config.repository_dir, '%s.git' % name),
+             os.path.join(store, name),
+             max_incremental)
+            for name in names]
+    failed = 0
+    # the work is done by git, threads are enough to keep it busy
+    pool = ThreadPool(min(jobs, len(work)) or 1)
+    try:
+        for (name, kind, error) in pool.imap_unordered(_refresh_one, work):
+            if error is not None:
+                log.error('Bundling %r failed: %s', name, error)
+                failed += 1
+            elif kind is not None:
+                log.info('Wrote a %s bundle of %r', kind, name)
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+
+class Main(app.App):
+    """gitosis-bundle program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] [REPO..]')
+        parser.set_description(
+            'Refresh the bundles of the repositories whose refs changed')
+        parser.add_option('--jobs', type='int', metavar='N',
+                          help='refresh N repositories at a time, instead'
+                          +' of bundle-jobs from the config')
+        return parser
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        names = None
+        if args:
+            names = []
+            for name in args:
+                if name.endswith('.git'):
+                    name = name[:-len('.git')]
+                if not os.path.isdir(os.path.join(cfg.repository_dir,
+                                                  '%s.git' % name)):
+                    parser.error('no repository %r' % name)
+                names.append(name)
+        if refresh_all(cfg, names, jobs=options.jobs):
+            sys.exit(1)
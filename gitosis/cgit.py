@@ -16,6 +16,7 @@
 
 from __future__ import with_statement
 
+import errno
 import logging
 import os
 import re
@@ -72,13 +73,19 @@ def find_readme(path, treeish="master"):
             return "{0}:{1}".format(treeish, fname)
 
 
-def generate_project(name, section, buf, config):
+def _repository_path(section):
+    """Returns the repository path of a ``[repo ...]`` section."""
     _, path = section.split(" ", 1)
-    base_path = config.repository_dir
 
     # ``gitosis`` requires all repositories to have a .git suffix.
     if not path.endswith(".git"):
         path += ".git"
+    return path
+
+
+def generate_project(name, section, buf, config):
+    path = _repository_path(section)
+    base_path = config.repository_dir
 
     if not os.path.exists(os.path.join(base_path, path)):
         log.debug("Repo {0} doesn't exist @ {1}.".format(path, base_path))
@@ -110,8 +117,10 @@ def generate_project(name, section, buf, config):
         buf.write(os.linesep)
 
 
-def generate_project_list(config, path):
-    log.debug("Generating `repos.list` file @ {0}.".format(path))
+def _write_project_list(config, path, project):
+    """Write ``repos.list`` to `path`, using `project` to fill in the
+    buffer for every repository.
+    """
     buf = StringIO()  # Write to a temporary buffer.
 
     for cgit_group, repos in find_repositories(config):
@@ -123,13 +132,58 @@ def generate_project_list(config, path):
             buf.write(os.linesep)
 
         for (name, section) in repos:
-            generate_project(name, section, buf, config)
+            project(name, section, buf, config)
 
     log.debug("Saving to {0} ...".format(path))
-    with open(path, "w") as fp:
+    tmp = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as fp:
         fp.write(buf.getvalue())
-        fp.close()
+    os.rename(tmp, path)
     log.debug("Done.")
 
 
-logging.basicConfig()
+def generate_project_list(config, path):
+    log.debug("Generating `repos.list` file @ {0}.".format(path))
+    _write_project_list(config, path, generate_project)
+
+
+def update_project_list(config, path, repo):
+    """Update the entry for repository `repo` in ``repos.list``, reusing
+    the existing entries of all other repositories. Unlike
+    :func:`generate_project_list`, this does not look for a readme in
+    every repository.
+
+    Falls back to :func:`generate_project_list` if there's no
+    ``repos.list`` yet.
+    """
+    log.debug("Updating {0!r} in `repos.list` file @ {1}.".format(repo, path))
+    try:
+        with open(path) as fp:
+            content = fp.read()
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return generate_project_list(config, path)
+        raise
+
+    # Every repository is a block of ``key=value`` lines followed by an
+    # empty line, the first being ``repo.url``. The ``section`` header
+    # of a cgit group may start the block of its first repository; it is
+    # written anew for every group.
+    existing = {}
+    for block in content.split(os.linesep * 2):
+        if block.startswith("section="):
+            block = block.partition(os.linesep)[2]
+        if block.startswith("repo.url="):
+            url = block.split(os.linesep, 1)[0][len("repo.url="):]
+            existing[url] = block + os.linesep * 2
+
+    updated = _repository_path("repo {0}".format(repo))
+
+    def project(name, section, buf, config):
+        path = _repository_path(section)
+        if path != updated and path in existing:
+            buf.write(existing[path])
+        else:
+            generate_project(name, section, buf, config)
+
+    _write_project_list(config, path, project)
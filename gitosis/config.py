@@ -16,9 +16,19 @@ from UserDict import IterableUserDict
 
 
 class GitosisConfigDict(IterableUserDict):
+    """Sections ordered ``gitosis`` first, then sorted ``group`` and
+    ``repo`` sections, then everything else. The order is computed once
+    and kept until a section is added or removed.
+    """
+    _order = None
+
     def keys(self):
         return list(self.__iter__())
     def __iter__(self):
+        if self._order is None:
+            self._order = list(self._sorted())
+        return iter(self._order)
+    def _sorted(self):
         saw = set()
         if 'gitosis' in self.data:
             saw.add('gitosis')
@@ -38,11 +48,78 @@ class GitosisConfigDict(IterableUserDict):
                 saw.add(_)
                 yield _
 
+    def __setitem__(self, key, item):
+        if key not in self.data:
+            self._order = None
+        IterableUserDict.__setitem__(self, key, item)
+    def __delitem__(self, key):
+        self._order = None
+        IterableUserDict.__delitem__(self, key)
+    def clear(self):
+        self._order = None
+        IterableUserDict.clear(self)
+    def update(self, *args, **kwargs):
+        self._order = None
+        IterableUserDict.update(self, *args, **kwargs)
+    def pop(self, key, *args):
+        self._order = None
+        return IterableUserDict.pop(self, key, *args)
+    def popitem(self):
+        self._order = None
+        return IterableUserDict.popitem(self)
+
 
 class GitosisRawConfigParser(RawConfigParser):
+    #: Compiled access data (see :mod:`gitosis.snapshot`) the config was
+    #: restored from, or ``None``. Dropped on any modification.
+    snapshot = None
+
     def __init__(self, defaults=None):
         RawConfigParser.__init__(self, defaults)
         self._sections = GitosisConfigDict(self._sections)
+        #: Data derived from the current contents, such as the group
+        #: membership index. Cleared on any modification.
+        self.cache = {}
+
+    def _invalidate(self):
+        """Forget anything precomputed from the current contents."""
+        self.snapshot = None
+        self.cache = {}
+
+    def _read(self, fp, fpname):
+        RawConfigParser._read(self, fp, fpname)
+        self._invalidate()
+
+    def add_section(self, section):
+        RawConfigParser.add_section(self, section)
+        self._invalidate()
+
+    def set(self, section, option, value=None):
+        RawConfigParser.set(self, section, option, value)
+        self._invalidate()
+
+    def remove_option(self, section, option):
+        self._invalidate()
+        return RawConfigParser.remove_option(self, section, option)
+
+    def remove_section(self, section):
+        self._invalidate()
+        return RawConfigParser.remove_section(self, section)
+
+    def freeze(self):
+        """Return the parsed contents as plain, marshallable data."""
+        sections = dict((name, dict(options))
+                        for (name, options) in self._sections.data.items())
+        return (dict(self._defaults), sections)
+
+    def thaw(self, frozen):
+        """Replace the contents with data returned by :meth:`freeze`."""
+        defaults, sections = frozen
+        self._defaults = self._dict(defaults)
+        self._sections = GitosisConfigDict(
+            dict((name, self._dict(options))
+                 for (name, options) in sections.iteritems()))
+        self._invalidate()
 
     def get(self, section, option, default=None):
         """Same as :meth:`dict.get` but for
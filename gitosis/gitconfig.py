@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.gitconfig
+    ~~~~~~~~~~~~~~~~~
+
+    This module manages the git config of the repositories owned by
+    :mod:`gitosis`, from ``gitconfig.`` options in ``gitosis.conf``::
+
+        [gitosis]
+        gitconfig.uploadpack.allowFilter = true
+
+        [group ci]
+        writable = huge
+        gitconfig.pack.threads = 2
+
+        [repo huge]
+        gitconfig.core.bigFileThreshold = 16m
+        gitconfig.receive.unpackLimit = 100
+
+    A repository gets the value of its ``[repo ...]`` section, or of the
+    first group listing it in ``writable``, ``readonly`` or a ``map``, or
+    of ``[gitosis]``, in that order. Keys none of these sections set are
+    left alone, unless :mod:`gitosis` set them before: the keys it wrote
+    are listed in ``gitosis.managed`` in the repository's config, and
+    removed again once no section sets them. Keys are case insensitive,
+    so are subsection names here, as ``gitosis.conf`` doesn't keep their
+    case. ``uploadpack.hideRefs`` comes from :mod:`gitosis.hiderefs`.
+
+    The post-update hook reads each repository's ``config`` itself, and
+    rewrites it only when a managed key differs, taking ``config.lock``
+    like git does. No ``git config`` is run, so sweeping thousands of
+    repositories takes seconds.
+
+    :license: GPL
+"""
+
+import errno
+import logging
+import os
+
+from gitosis import hiderefs
+from gitosis import util
+
+log = logging.getLogger("gitosis.gitconfig")
+
+#: Prefix of the options in ``gitosis.conf`` setting git config keys.
+PREFIX = "gitconfig."
+
+#: The key listing, in each repository, the keys :mod:`gitosis` wrote.
+MANAGED = "gitosis.managed"
+
+_NAME_CHARS = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-")
+_SECTION_CHARS = _NAME_CHARS | frozenset(".")
+_ESCAPES = {"n": "\n", "t": "\t", "b": "\b", "\\": "\\", '"': '"'}
+
+
+class ConfigError(ValueError):
+    """Malformed git config"""
+
+    def __str__(self):
+        return "%s: %s" % (self.__doc__, ": ".join(self.args))
+
+
+def split_key(key):
+    """Returns ``(section, subsection, name)`` of a key such as
+    ``remote.origin.url``, with the case insensitive parts lowercased.
+    """
+    (section, _, rest) = key.partition(".")
+    (subsection, _, name) = rest.rpartition(".")
+    if not section or not name:
+        raise ConfigError("invalid key", key)
+    return (section.lower(), subsection or None, name.lower())
+
+
+def _skip_blanks(text, i, end):
+    while i < end and text[i] in " \t\r":
+        i += 1
+    return i
+
+
+def _parse_header(text, i):
+    """Parse the section header at ``text[i] == '['``.
+
+    Returns ``((section, subsection), index after ']')``.
+    """
+    start = i = i + 1
+    while i < len(text) and text[i] in _SECTION_CHARS:
+        i += 1
+    section = text[start:i].lower()
+    if not section:
+        raise ConfigError("invalid section header", text[start-1:i+1])
+    if i < len(text) and text[i] == "]":
+        # deprecated [section.subsection], case insensitive
+        (section, _, subsection) = section.partition(".")
+        return ((section, subsection or None), i + 1)
+    i = _skip_blanks(text, i, len(text))
+    if i >= len(text) or text[i] != '"':
+        raise ConfigError("invalid section header", section)
+    i += 1
+    subsection = []
+    while True:
+        if i >= len(text) or text[i] == "\n":
+            raise ConfigError("unterminated subsection", section)
+        c = text[i]
+        i += 1
+        if c == '"':
+            break
+        if c == "\\":
+            if i >= len(text):
+                raise ConfigError("unterminated subsection", section)
+            c = text[i]
+            i += 1
+        subsection.append(c)
+    if i >= len(text) or text[i] != "]":
+        raise ConfigError("invalid section header", section)
+    return ((section, "".join(subsection)), i + 1)
+
+
+def _parse_value(text, i):
+    """Parse the value starting at `i`, up to the end of its line, or of
+    its last line if it is continued with a backslash.
+
+    Returns ``(value, index after the newline)``.
+    """
+    end = text.find("\n", i)
+    end = len(text) if end < 0 else end + 1
+    plain = text[i:end]
+    if ('"' not in plain and "\\" not in plain and ";" not in plain
+        and "#" not in plain):
+        # the common case, nothing to unquote
+        plain = plain.strip(" \t\r\n")
+        if "\t" in plain or "\r" in plain:
+            plain = plain.replace("\t", " ").replace("\r", " ")
+        return (plain, end)
+    out = []
+    quote = False
+    comment = False
+    space = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        i += 1
+        if c == "\n":
+            if quote:
+                raise ConfigError("unterminated quote")
+            break
+        if comment:
+            continue
+        if not quote and c in " \t\r":
+            if out:
+                space += 1
+            continue
+        if not quote and c in ";#":
+            comment = True
+            continue
+        if space:
+            out.append(" " * space)
+            space = 0
+        if c == "\\":
+            if i >= n:
+                raise ConfigError("incomplete escape")
+            c = text[i]
+            i += 1
+            if c == "\n":
+                continue
+            if c not in _ESCAPES:
+                raise ConfigError("invalid escape", "\\" + c)
+            out.append(_ESCAPES[c])
+        elif c == '"':
+            quote = not quote
+        else:
+            out.append(c)
+    else:
+        if quote:
+            raise ConfigError("unterminated quote")
+    return ("".join(out), i)
+
+
+def _quote(value):
+    """Returns `value` as written in a config file."""
+    quoted = (value.replace("\\", "\\\\").replace('"', '\\"')
+              .replace("\n", "\\n").replace("\t", "\\t")
+              .replace("\b", "\\b"))
+    if (value != value.strip(" ") or ";" in value or "#" in value):
+        quoted = '"%s"' % quoted
+    return quoted
+
+
+class ConfigFile(object):
+    """A git config file, which can be changed keeping everything but
+    the changed keys as it was.
+
+    It is a list of entries ``(section, name, value, text)``, where
+    ``section`` is ``(section, subsection)``, ``name`` and ``value`` are
+    ``None`` for anything but variables, and ``text`` is what the entry
+    was read from.
+    """
+
+    def __init__(self, text=""):
+        self.entries = []
+        section = None
+        pos = 0
+        n = len(text)
+        while pos < n:
+            end = text.find("\n", pos)
+            end = n if end < 0 else end + 1
+            i = _skip_blanks(text, pos, end)
+            c = text[i] if i < end else "\n"
+            if c in "\n#;":
+                self.entries.append((section, None, None, text[pos:end]))
+                pos = end
+            elif c == "[":
+                (section, i) = _parse_header(text, i)
+                i = _skip_blanks(text, i, end)
+                if i < end and text[i] not in "\n#;":
+                    # a variable on the same line
+                    self.entries.append((section, None, None, text[pos:i]))
+                    pos = i
+                else:
+                    self.entries.append((section, None, None,
+                                         text[pos:end]))
+                    pos = end
+            else:
+                start = i
+                while i < end and text[i] in _NAME_CHARS:
+                    i += 1
+                name = text[start:i].lower()
+                if section is None or not name or not name[0].isalpha():
+                    raise ConfigError("invalid line", text[pos:end].strip())
+                i = _skip_blanks(text, i, end)
+                if i < end and text[i] == "=":
+                    (value, i) = _parse_value(text, i + 1)
+                elif i == end or text[i] in "\n#;":
+                    # a boolean true written as just the name
+                    (value, i) = (None, end)
+                else:
+                    raise ConfigError("invalid line", text[pos:end].strip())
+                self.entries.append((section, name, value, text[pos:i]))
+                pos = i
+
+    def get_all(self, key):
+        """Returns the values of `key`, in order. A variable without a
+        value is a ``None``.
+        """
+        (section, subsection, name) = split_key(key)
+        section = (section, subsection)
+        return [value for (entry_section, entry_name, value, _)
+                in self.entries
+                if entry_name == name and entry_section == section]
+
+    def set_all(self, key, values):
+        """Replace all values of `key` with `values`.
+
+        The new values go where the old ones were, or after the last
+        variable of their section, which is added if there is none. A
+        section left without variables or comments is removed.
+        """
+        (section, subsection, name) = split_key(key)
+        section = (section, subsection)
+        var = key.rpartition(".")[2]
+        lines = [(section, name, value, "\t%s = %s\n" % (var, _quote(value)))
+                 for value in values]
+        entries = []
+        where = None
+        replaced = False
+        for entry in self.entries:
+            if entry[0] == section:
+                if entry[1] == name:
+                    if entries and not entries[-1][3].endswith("\n"):
+                        # it was on the same line as the header
+                        previous = entries[-1]
+                        entries[-1] = previous[:3] + (previous[3] + "\n",)
+                    where = len(entries)
+                    replaced = True
+                    continue
+                elif not replaced and (entry[1] is not None
+                                       or where is None):
+                    # after the last variable of the section
+                    where = len(entries) + 1
+            entries.append(entry)
+        if not lines:
+            if replaced:
+                self.entries = _drop_empty_section(entries, section)
+            return
+        if where is None:
+            if subsection is None:
+                header = "[%s]\n" % section[0]
+            else:
+                header = '[%s "%s"]\n' % (
+                    section[0],
+                    subsection.replace("\\", "\\\\").replace('"', '\\"'))
+            where = len(entries) + 1
+            entries.append((section, None, None, header))
+        if where > 0 and not entries[where-1][3].endswith("\n"):
+            previous = entries[where-1]
+            entries[where-1] = previous[:3] + (previous[3] + "\n",)
+        entries[where:where] = lines
+        self.entries = entries
+
+    def text(self):
+        """Returns the file contents."""
+        return "".join(entry[3] for entry in self.entries)
+
+
+def _drop_empty_section(entries, section):
+    """Returns `entries` without the headers of `section`, if nothing but
+    headers and blank lines are left of it."""
+    headers = []
+    for (i, (entry_section, name, _, text)) in enumerate(entries):
+        if entry_section != section:
+            continue
+        if name is not None:
+            return entries
+        text = text.strip(" \t\r\n")
+        if text.startswith("["):
+            headers.append(i)
+        elif text:
+            # a comment
+            return entries
+    headers = set(headers)
+    return [entry for (i, entry) in enumerate(entries) if i not in headers]
+
+
+def read(path):
+    """Returns the :class:`ConfigFile` at `path`, empty if there's none."""
+    try:
+        fp = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return ConfigFile()
+        raise
+    try:
+        return ConfigFile(fp.read())
+    finally:
+        fp.close()
+
+
+def write(path, config):
+    """Write `config` to `path` through ``path.lock``, like git does.
+
+    Raises :exc:`OSError` with ``EEXIST`` if git holds the lock.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0777
+    except OSError:
+        mode = 0644
+    lock = path + ".lock"
+    fd = os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    try:
+        try:
+            os.write(fd, config.text())
+        finally:
+            os.close(fd)
+        os.rename(lock, path)
+    except:
+        util.unlink(lock)
+        raise
+
+
+def _settings(config, section):
+    """Returns the git config keys `section` sets, and their values."""
+    settings = {}
+    for option in config.options(section):
+        if option.startswith(PREFIX):
+            settings[option[len(PREFIX):]] = config.get(section, option)
+    return settings
+
+
+def _rules(config):
+    """Returns the settings of ``[gitosis]``, ``(settings, patterns,
+    names)`` for every group setting git config keys, and what
+    :func:`gitosis.hiderefs.group_rules` returns, or ``None`` if no
+    section hides refs."""
+    defaults = {}
+    if config.has_section("gitosis"):
+        defaults = _settings(config, "gitosis")
+    groups = []
+    for section in config.sections():
+        if not section.startswith("group "):
+            continue
+        settings = _settings(config, section)
+        if settings:
+            (patterns, names) = hiderefs.group_repositories(config, section)
+            groups.append((settings, patterns, names))
+    refs_rules = None
+    if hiderefs.configured(config):
+        refs_rules = hiderefs.group_rules(config)
+    return (defaults, groups, refs_rules)
+
+
+def wanted(config, name, rules=None):
+    """Returns the values of the keys set for repository `name`, as a
+    dict of lists.
+
+    :param rules: what :func:`_rules` returns, when asking for many
+                  repositories
+    """
+    if rules is None:
+        rules = _rules(config)
+    (defaults, groups, refs_rules) = rules
+    settings = dict(defaults)
+    for (group_settings, patterns, names) in reversed(groups):
+        if name in names or name in patterns:
+            settings.update(group_settings)
+    section = "repo {0}".format(name)
+    if config.has_section(section):
+        settings.update(_settings(config, section))
+    result = dict((key, [value]) for (key, value) in settings.iteritems())
+    if refs_rules is not None:
+        refs = hiderefs.hidden_refs(config, name, refs_rules)
+        if refs:
+            result[hiderefs.KEY] = refs
+    return result
+
+
+def update(path, values):
+    """Make the repository at `path` have `values`, as returned by
+    :func:`wanted`, and remove the keys written before that are not in
+    `values` any more. Keys with no values are left alone.
+
+    Returns whether its config was written to.
+    """
+    config_path = os.path.join(path, "config")
+    current = read(config_path)
+    values = dict((key, value) for (key, value) in values.iteritems()
+                  if value)
+    written = set(split_key(key) for key in values)
+    for key in current.get_all(MANAGED):
+        if key is None:
+            continue
+        try:
+            if split_key(key) not in written:
+                values[key] = []
+        except ConfigError:
+            pass
+    values[MANAGED] = sorted(key for key in values if values[key])
+    changed = False
+    for key in sorted(values):
+        if current.get_all(key) != values[key]:
+            current.set_all(key, values[key])
+            changed = True
+    if changed:
+        write(config_path, current)
+        log.debug("Updated the git config of {0!r}".format(path))
+    return changed
+
+
+def _update(path, values):
+    """Like :func:`update`, but logs failures instead of raising."""
+    try:
+        update(path, values)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+        log.warning("Not updating {0!r}, its config is locked".format(path))
+    except ConfigError, e:
+        log.warning("Not updating {0!r}, {1}".format(path, e))
+
+
+def apply(config):
+    """Walks all repositories owned by :mod:`gitosis`, and updates their
+    git config."""
+    rules = _rules(config)
+    base_dir = config.repository_dir
+    for dirpath, dirnames, _ in util.walk(base_dir):
+        reldir = os.path.relpath(dirpath, base_dir)
+        reldir = reldir if reldir != "." else ""
+        for dirname in dirnames[:]:
+            if not dirname.endswith(".git"):
+                continue
+            dirnames.remove(dirname)
+            name = os.path.join(reldir, dirname[:-len(".git")])
+            _update(os.path.join(dirpath, dirname),
+                    wanted(config, name, rules))
+
+
+def apply_repository(config, name):
+    """Updates the git config of the single repository `name`, without
+    walking all the others.
+    """
+    path = os.path.join(config.repository_dir, "{0}.git".format(name))
+    if not os.path.isdir(path):
+        log.debug("Repo {0!r} doesn't exist".format(path))
+        return
+    _update(path, wanted(config, name))
@@ -34,6 +34,12 @@ def export_one(path, enable=True):
         util.unlink(export_path(path))
 
 
+def _enabled(config, repo, global_enable):
+    """Checks if ``gitdaemon`` is enabled for a repository."""
+    return config.getboolean("repo {0}".format(repo),
+                             "daemon", default=global_enable)
+
+
 def export(config):
     """Walks all repositories owned by :mod:`gitosis`, and manage the
     ``git-daemon-export-ok`` markers.
@@ -63,8 +69,20 @@ def export(config):
 
             # Checking if ``gitdaemon`` is enabled for the processed
             # repository.
-            enable = config.getboolean("repo {0}".format(repo),
-                                       "daemon", default=global_enable)
+            enable = _enabled(config, repo, global_enable)
 
             # Hardcore action.
             export_one(os.path.join(dirpath, dirname), enable=enable)
+
+
+def export_repository(config, repo):
+    """Manage the ``git-daemon-export-ok`` marker of the single
+    repository `repo`, without walking all the others.
+    """
+    path = os.path.join(config.repository_dir, "{0}.git".format(repo))
+    if not os.path.isdir(path):
+        log.debug("Repo {0!r} doesn't exist".format(path))
+        return
+
+    global_enable = config.getboolean("gitosis", "daemon")
+    export_one(path, enable=_enabled(config, repo, global_enable))
@@ -25,7 +25,7 @@ To plug this into ``gitweb``, you have two choices.
    isolates the changes a bit more nicely. Recommended.
 """
 
-import os, urllib, logging
+import errno, os, urllib, logging
 
 from gitosis import util
 
@@ -36,18 +36,8 @@ def _escape_filename(i):
     i = i.replace('"', '\\"')
     return i
 
-def generate_project_list_fp(config, fp):
-    """
-    Generate projects list for ``gitweb``.
-
-    :param config: configuration to read projects from
-    :type config: RawConfigParser
-
-    :param fp: writable for ``projects.list``
-    :type fp: (file-like, anything with ``.write(data)``)
-    """
-    log = logging.getLogger("gitosis.gitweb.generate_projects_list")
-    repositories = config.repository_dir
+def _enabled_repositories(config):
+    """Generate ``(section, name)`` of all repositories shown in ``gitweb``."""
     global_enable = config.getboolean("gitosis", "gitweb", default=False)
 
     for section in config.sections():
@@ -61,14 +51,36 @@ def generate_project_list_fp(config, fp):
         if not config.getboolean(section, "gitweb", default=global_enable):
             continue  # Disabled?
 
-        line = []
-        line.append(_repository_exists(log, repositories, value, value))
+        yield section, value
+
+
+def _project_line(log, config, repositories, section, name):
+    """Return the ``projects.list`` line for a single repository."""
+    line = []
+    line.append(_repository_exists(log, repositories, name, name))
 
-        owner = config.get(section, "owner")
-        if owner:
-            line.append(owner)
+    owner = config.get(section, "owner")
+    if owner:
+        line.append(owner)
 
-        fp.write(" ".join(map(urllib.quote_plus, line)) + os.linesep)
+    return " ".join(map(urllib.quote_plus, line)) + os.linesep
+
+
+def generate_project_list_fp(config, fp):
+    """
+    Generate projects list for ``gitweb``.
+
+    :param config: configuration to read projects from
+    :type config: RawConfigParser
+
+    :param fp: writable for ``projects.list``
+    :type fp: (file-like, anything with ``.write(data)``)
+    """
+    log = logging.getLogger("gitosis.gitweb.generate_projects_list")
+    repositories = config.repository_dir
+
+    for section, name in _enabled_repositories(config):
+        fp.write(_project_line(log, config, repositories, section, name))
 
 
 def _repository_exists(log, repositories, name, default_value):
@@ -108,6 +120,80 @@ def generate_project_list(config, path):
     os.rename(tmp, path)
 
 
+def update_project_list(config, path, name):
+    """
+    Update the line for repository ``name`` in the projects list for
+    ``gitweb``, reusing the existing lines of all other repositories
+    instead of looking them up on disk again.
+
+    Falls back to :func:`generate_project_list` if there's no projects
+    list yet.
+
+    :param config: configuration to read projects from
+    :type config: RawConfigParser
+
+    :param path: path of the projects list
+    :type path: str
+
+    :param name: repository to update
+    :type name: str
+    """
+    log = logging.getLogger("gitosis.gitweb.update_project_list")
+    try:
+        fp = file(path)
+    except IOError, ex:
+        if ex.errno == errno.ENOENT:
+            return generate_project_list(config, path)
+        raise
+    try:
+        existing = dict((line.split(" ", 1)[0].rstrip(os.linesep), line)
+                        for line in fp)
+    finally:
+        fp.close()
+
+    repositories = config.repository_dir
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = file(tmp, 'w')
+    try:
+        for section, value in _enabled_repositories(config):
+            line = None
+            if value != name:
+                line = existing.get(urllib.quote_plus(value)) \
+                    or existing.get(urllib.quote_plus(value + '.git'))
+            if line is None:
+                line = _project_line(log, config, repositories,
+                                     section, value)
+            fp.write(line)
+    finally:
+        fp.close()
+
+    os.rename(tmp, path)
+
+
+def _set_description(log, config, repositories, section, name):
+    """Write the description of a single repository, if it has one."""
+    description = config.get(section, 'description')
+    if not description:
+        return
+
+    name = _repository_exists(log, repositories, name, False)
+    if not name:
+        return
+
+    path = os.path.join(
+        repositories,
+        name,
+        'description',
+        )
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = file(tmp, 'w')
+    try:
+        print >> fp, description
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+
+
 def set_descriptions(config):
     """
     Set descriptions for gitweb use.
@@ -121,25 +207,13 @@ def set_descriptions(config):
         if not sectiontitle or sectiontitle[0] != 'repo':
             continue
 
-        description = config.get(section, 'description')
-        if not description: #pragma: no cover
-            continue
-
-        name = sectiontitle[1]
+        _set_description(log, config, repositories, section, sectiontitle[1])
 
-        name = _repository_exists(log, repositories, name, False)
-        if not name:
-            continue
 
-        path = os.path.join(
-            repositories,
-            name,
-            'description',
-            )
-        tmp = '%s.%d.tmp' % (path, os.getpid())
-        fp = file(tmp, 'w')
-        try:
-            print >> fp, description
-        finally:
-            fp.close()
-        os.rename(tmp, path)
+def set_description(config, name):
+    """
+    Set the description of repository ``name`` for gitweb use.
+    """
+    log = logging.getLogger('gitosis.gitweb.set_description')
+    _set_description(log, config, config.repository_dir,
+                     'repo %s' % name, name)
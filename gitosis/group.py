@@ -5,47 +5,96 @@ import logging
 
 _GROUP_PREFIX = 'group '
 
-def _getMembership(config, user, seen):
+class _MembershipIndex(object):
     """
-    Internal implementation of getMembership.
-    Generate groups ``user`` is member of, according to ``config``.
-    Groups already seen are tracked by ``seen``.
-
-    :type config: RawConfigParser
-    :type user: str
-    :type seen: Set
+    Inverted index of ``members`` lines: which groups list a given user
+    or ``@group``, in section order. Built once per loaded config.
     """
-    log = logging.getLogger('gitosis.group.getMembership')
 
-    for section in config.sections():
-        if not section.startswith(_GROUP_PREFIX):
-            continue
-        group = section[len(_GROUP_PREFIX):]
-        if group in seen:
-            continue
+    def __init__(self, config):
+        self._member_of = {}
+        position = {}
+        for section in config.sections():
+            if not section.startswith(_GROUP_PREFIX):
+                continue
+            group = section[len(_GROUP_PREFIX):]
+            position[group] = len(position)
+            for member in config.get(section, 'members', "").split():
+                groups = self._member_of.setdefault(member, [])
+                if not groups or groups[-1] != group:
+                    groups.append(group)
+        self._position = position
+        self._candidates = {}
+        self._closure = {}
 
-        members = config.get(section, 'members', "").split()
+    def candidates(self, member):
+        """
+        Groups listing ``member`` or ``@all``, in section order.
+        """
+        try:
+            return self._candidates[member]
+        except KeyError:
+            pass
+        groups = set(self._member_of.get(member, ()))
+        groups.update(self._member_of.get('@all', ()))
+        groups = sorted(groups, key=self._position.__getitem__)
+        self._candidates[member] = groups
+        return groups
 
-        # @all is the only group where membership needs to be
-        # bootstrapped like this, anything else gets started from the
-        # username itself
-        if (user in members
-            or '@all' in members):
+    def closure(self, user):
+        """
+        All groups ``user`` is member of, directly or through nested
+        ``@group`` members, in the order the config lists them.
+        Memoized per user.
+        """
+        try:
+            return self._closure[user]
+        except KeyError:
+            pass
+        log = logging.getLogger('gitosis.group.getMembership')
+
+        # Depth first, like walking the sections recursively for
+        # ``@group`` and then ``@all`` after each group found, but with
+        # an explicit stack. ``seen`` also breaks membership cycles.
+        seen = set()
+        found = []
+        stack = [(user, iter(self.candidates(user)))]
+        while stack:
+            member, groups = stack[-1]
+            for group in groups:
+                if group not in seen:
+                    break
+            else:
+                stack.pop()
+                continue
             log.debug('found %(user)r in %(group)r' % dict(
-                user=user,
+                user=member,
                 group=group,
                 ))
             seen.add(group)
-            yield group
+            found.append(group)
+            stack.append(('@all', iter(self.candidates('@all'))))
+            stack.append(('@%s' % group,
+                          iter(self.candidates('@%s' % group))))
+
+        found = tuple(found)
+        self._closure[user] = found
+        return found
 
-            for member_of in _getMembership(
-                config, '@%s' % group, seen,
-                ):
-                yield member_of
-            for member_of in _getMembership(
-                config, '@all', seen,
-                ):
-                yield member_of
+def _getIndex(config):
+    """
+    Return the membership index for ``config``, reusing the one built
+    for its current contents if possible.
+
+    :type config: RawConfigParser
+    """
+    cache = getattr(config, 'cache', None)
+    if cache is None:
+        return _MembershipIndex(config)
+    index = cache.get('membership')
+    if index is None:
+        index = cache['membership'] = _MembershipIndex(config)
+    return index
 
 def getMembership(config, user):
     """
@@ -55,10 +104,8 @@ def getMembership(config, user):
     :type user: str
     """
 
-    seen = set()
-    for member_of in _getMembership(config, user, seen):
+    for member_of in _getIndex(config).closure(user):
         yield member_of
 
     # everyone is always a member of group "all"
     yield 'all'
-
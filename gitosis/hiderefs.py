@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.hiderefs
+    ~~~~~~~~~~~~~~~~
+
+    This module keeps refs out of the ref advertisement of fetches, by
+    setting ``uploadpack.hideRefs`` in the repositories managed by
+    :mod:`gitosis`::
+
+        [gitosis]
+        ## hidden in every repository
+        hide-refs = refs/pipelines
+
+        [group ci]
+        writable = huge
+        ## hidden in every repository of the group
+        hide-refs = refs/changes
+
+        [repo huge]
+        hide-refs = refs/keep-around !refs/keep-around/release
+
+    A repository hides the refs of ``[gitosis]``, those of every group
+    listing it in ``writable``, ``readonly`` or a ``map``, and its own,
+    in that order; see ``git help config`` for what a ``!`` means.
+    Hidden refs can still be pushed to, they are just not advertised.
+
+    They are set along with the rest of the git config, see
+    :mod:`gitosis.gitconfig`, only in the repositories hiding refs.
+    Without ``hide-refs`` anywhere, ``uploadpack.hideRefs`` is left
+    alone everywhere.
+
+    :license: GPL
+"""
+
+from gitosis import access
+from gitosis import pattern as _pattern
+
+#: The git config key set in each repository.
+KEY = "uploadpack.hideRefs"
+
+
+def _split(value):
+    return (value or "").split()
+
+
+def group_repositories(config, section):
+    """Returns the repositories the group `section` lists, as
+    ``(patterns, names)``."""
+    patterns = []
+    names = set()
+    for mode in access.MODES:
+        for name in _split(config.get(section, mode)):
+            if _pattern.is_pattern(name):
+                patterns.append(name)
+            else:
+                names.add(name)
+    for option in config.options(section):
+        words = option.split(None, 2)
+        if len(words) == 3 and words[0] == "map":
+            names.add(config.get(section, option))
+    return (_pattern.PatternSet(patterns), names)
+
+
+def configured(config):
+    """Returns whether any section of `config` hides refs."""
+    for section in config.sections():
+        if config.has_option(section, "hide-refs"):
+            return True
+    return False
+
+
+def group_rules(config):
+    """Returns ``(refs, patterns, names)`` for every group hiding refs."""
+    rules = []
+    for section in config.sections():
+        if not section.startswith("group "):
+            continue
+        refs = _split(config.get(section, "hide-refs"))
+        if refs:
+            (patterns, names) = group_repositories(config, section)
+            rules.append((refs, patterns, names))
+    return rules
+
+
+def hidden_refs(config, name, rules=None):
+    """Returns the refs repository `name` hides, in order.
+
+    :param rules: what :func:`group_rules` returns, when asking for
+                  many repositories
+    """
+    if rules is None:
+        rules = group_rules(config)
+    refs = []
+    def add(values):
+        for ref in values:
+            if ref not in refs:
+                refs.append(ref)
+    add(_split(config.get("gitosis", "hide-refs")))
+    for (group_refs, patterns, names) in rules:
+        if name in names or name in patterns:
+            add(group_refs)
+    add(_split(config.get("repo {0}".format(name), "hide-refs")))
+    return refs
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.identity
+    ~~~~~~~~~~~~~~~~
+
+    This module implements the index of user identities, the name and
+    email given on the first line of ``keydir/USER.pub``::
+
+        # gitosis-identity: John Doe <jdoe@example.com>
+
+    or::
+
+        # gitosis-name: John Doe
+        # gitosis-email: jdoe@example.com
+
+    The ``post-update`` hook collects them while reading ``keydir`` for
+    ``authorized_keys`` and stores them in ``identities`` under
+    :attr:`~gitosis.config.GitosisRawConfigParser.generated_files_dir`,
+    so ``gitosis-serve`` can set ``GITOSIS_NAME`` and ``GITOSIS_EMAIL``
+    with a single lookup instead of opening and searching the key file.
+
+    :license: GPL
+"""
+
+import logging
+import marshal
+import os
+import re
+
+log = logging.getLogger("gitosis.identity")
+
+#: Format marker, bump whenever the layout of the index changes.
+MAGIC = "gitosis-identities 1"
+
+_IDENTITY_RE = re.compile("^# gitosis-identity: *([^\<]+)? *(?:\<([^\>, ]*)\>)?")
+_NAME_RE = re.compile("^# gitosis-name: *(.*)$")
+_EMAIL_RE = re.compile("^# gitosis-email: *<?(.*)>?$")
+
+# path -> (stamp, identities) of the last index read by this process
+_loaded = {}
+
+
+def parse(line):
+    """Returns the environment the first line of a key file sets."""
+    env = {}
+    m = _IDENTITY_RE.search(line)
+    if m:
+        if m.group(1) is not None:
+            env['GITOSIS_NAME'] = m.group(1).strip()
+        if m.group(2) is not None:
+            env['GITOSIS_EMAIL'] = m.group(2)
+    else:
+        m = _NAME_RE.search(line)
+        if m:
+            env['GITOSIS_NAME'] = m.group(1).strip()
+        m = _EMAIL_RE.search(line)
+        if m:
+            env['GITOSIS_EMAIL'] = m.group(1).strip()
+    return env
+
+
+def path_for(config):
+    """Returns the location of the index for `config`."""
+    return os.path.join(config.generated_files_dir, "identities")
+
+
+def write(config, identities):
+    """Store `identities`, mapping users to what :func:`parse` found."""
+    path = path_for(config)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    fp = file(tmp, "wb")
+    try:
+        fp.write(marshal.dumps((MAGIC, identities)))
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+    log.debug("Wrote {0} identities to {1!r}".format(len(identities), path))
+
+
+def _load(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    current = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == current:
+        return cached[1]
+    try:
+        fp = file(path, "rb")
+        try:
+            (magic, identities) = marshal.load(fp)
+        finally:
+            fp.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        log.warning("Ignoring unreadable identity index %r", path)
+        return None
+    if magic != MAGIC:
+        return None
+    _loaded[path] = (current, identities)
+    return identities
+
+
+def lookup(config, user):
+    """Returns ``GITOSIS_NAME`` and ``GITOSIS_EMAIL`` for `user`.
+
+    Without an index, e.g. before the ``post-update`` hook first ran,
+    the key file of `user` is read instead.
+    """
+    identities = _load(path_for(config))
+    if identities is not None:
+        return dict(identities.get(user, {}))
+
+    userfile = os.path.join(config.repository_dir, 'gitosis-admin.git',
+                            'gitosis-export', 'keydir', user + '.pub')
+    try:
+        fp = open(userfile, 'r')
+    except (IOError, OSError):
+        # don't fail if file is not found
+        return {}
+    try:
+        return parse(fp.readline())
+    finally:
+        fp.close()
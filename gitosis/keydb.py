@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.keydb
+    ~~~~~~~~~~~~~
+
+    This module implements ``gitosis-keys-lookup``, an
+    ``AuthorizedKeysCommand`` for ``sshd`` answering from an index of
+    the keys in ``keydir``, instead of having ``sshd`` read and parse all
+    of ``~/.ssh/authorized_keys`` at every login::
+
+        [gitosis]
+        ## file, the default, writes authorized_keys only, command the
+        ## index only, both writes both
+        authorized-keys = command
+        ## default authorized-keys.db under generate-files-in
+        authorized-keys-db = /var/lib/gitosis/authorized-keys.db
+
+    and in ``/etc/ssh/sshd_config``::
+
+        Match User git
+            AuthorizedKeysCommand /usr/bin/gitosis-keys-lookup %f
+            AuthorizedKeysCommandUser git
+
+    The ``post-update`` hook builds the index, an SQLite database of the
+    ``authorized_keys`` lines :mod:`gitosis.ssh` would write, by SHA256
+    fingerprint of the key, in a new file renamed into place. A lookup
+    prints the lines of the key ``sshd`` asks about, if any, after a
+    single indexed query. It can also be given the key itself, as
+    ``%t %k``, for an ``sshd`` too old for ``%f``. Where the index is
+    comes from the access snapshot ``post-update`` compiled (see
+    :mod:`gitosis.snapshot`), ``gitosis.conf`` is only parsed without
+    one.
+
+    With ``authorized-keys = command``, the lines ``gitosis`` wrote to
+    ``authorized_keys`` before are removed from it, the rest of the file
+    is left alone.
+
+    :license: GPL
+"""
+
+import base64
+import binascii
+import logging
+import os
+import sys
+
+from gitosis import app
+from gitosis import snapshot
+from gitosis import ssh
+from gitosis import sshkey
+
+log = logging.getLogger('gitosis.keydb')
+
+FILE = 'file'
+COMMAND = 'command'
+BOTH = 'both'
+
+#: Format marker, bump whenever the layout of the index changes.
+MAGIC = 'gitosis-keys 1'
+
+
+def mode(config):
+    """Returns how ``sshd`` learns about the keys: :data:`FILE`,
+    :data:`COMMAND` or :data:`BOTH`."""
+    value = config.get('gitosis', 'authorized-keys', default=FILE)
+    if value not in (FILE, COMMAND, BOTH):
+        log.warning('Unknown authorized-keys %r, using %r', value, FILE)
+        return FILE
+    return value
+
+
+def path_for(config):
+    """Returns the location of the index for `config`."""
+    path = config.get('gitosis', 'authorized-keys-db')
+    if path is None:
+        path = os.path.join(config.generated_files_dir,
+                            'authorized-keys.db')
+    return os.path.expanduser(path)
+
+
+def fingerprint(blob):
+    """Returns the fingerprint of the base64 key `blob`, as ``sshd``
+    gives it for ``%f``, or ``None`` if it is not valid base64."""
+    import hashlib
+
+    try:
+        data = base64.b64decode(blob)
+    except (TypeError, binascii.Error):
+        return None
+    digest = base64.b64encode(hashlib.sha256(data).digest())
+    return 'SHA256:' + digest.rstrip('=')
+
+
+def write(path, keys):
+    """Store the ``authorized_keys`` lines of `keys`, ``(user, key)`` as
+    :func:`gitosis.ssh.readKeys` generates them, in the index at `path`.
+    """
+    import sqlite3
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    if os.path.exists(tmp):
+        os.unlink(tmp)
+    count = 0
+    db = sqlite3.connect(tmp)
+    # lines are bytes, as read from keydir
+    db.text_factory = str
+    try:
+        db.execute('CREATE TABLE magic (value TEXT)')
+        db.execute('INSERT INTO magic VALUES (?)', (MAGIC, ))
+        db.execute('CREATE TABLE keys (fingerprint TEXT, line TEXT)')
+        rows = []
+        for (user, key) in keys:
+            if not isinstance(key, sshkey.SSH2PublicKey):
+                # sshd dropped protocol 1 long ago
+                continue
+            fpr = fingerprint(key.key.split(' ', 1)[1])
+            if fpr is None:
+                log.warning('Malformed SSH key of %r', user)
+                continue
+            rows.append((fpr, ssh.authorizedKeysLine(user, key)))
+        db.executemany('INSERT INTO keys VALUES (?, ?)', rows)
+        # the rows were inserted in keydir order, which the index keeps
+        db.execute('CREATE INDEX keys_fingerprint ON keys (fingerprint)')
+        db.commit()
+        count = len(rows)
+    except:
+        db.close()
+        os.unlink(tmp)
+        raise
+    db.close()
+    os.chmod(tmp, 0644)
+    os.rename(tmp, path)
+    log.debug('Wrote %d keys to %r', count, path)
+
+
+def lookup(path, fpr):
+    """Returns the ``authorized_keys`` lines for the key of fingerprint
+    `fpr` in the index at `path`, in ``keydir`` order."""
+    import sqlite3
+
+    if not os.path.exists(path):
+        # sqlite would create it
+        return []
+    db = sqlite3.connect(path)
+    db.text_factory = str
+    try:
+        try:
+            (magic, ) = db.execute('SELECT value FROM magic').fetchone()
+            if magic != MAGIC:
+                log.warning('Ignoring index %r of another version', path)
+                return []
+            return [line for (line, ) in db.execute(
+                    'SELECT line FROM keys WHERE fingerprint = ?'
+                    ' ORDER BY rowid', (fpr, ))]
+        except (sqlite3.Error, TypeError):
+            log.warning('Ignoring unreadable key index %r', path)
+            return []
+    finally:
+        db.close()
+
+
+class Main(app.App):
+    """gitosis-keys-lookup program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] FINGERPRINT | TYPE KEY')
+        parser.set_description(
+            'Print the authorized_keys lines of a key, for sshd'
+            ' AuthorizedKeysCommand')
+        return parser
+
+    def read_config(self, options, cfg):
+        """Restore the config from its snapshot, parse it if there's none."""
+        if not snapshot.restore(cfg, options.config):
+            super(Main, self).read_config(options, cfg)
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        if len(args) == 1:
+            fpr = args[0]
+        elif len(args) == 2:
+            fpr = fingerprint(args[1])
+        else:
+            parser.error('Expected FINGERPRINT, or TYPE and KEY.')
+        if fpr is not None:
+            for line in lookup(path_for(cfg), fpr):
+                print line
+        sys.exit(0)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.matrix
+    ~~~~~~~~~~~~~~
+
+    This module implements the access matrix: who may read and who may
+    write every repository, and which repositories every user may read
+    and write, computed in one pass over the ``[group ...]`` sections
+    instead of calling :func:`gitosis.access.allowed` per user and
+    repository.
+
+    Repository names are the ones users refer to, so the visible name of
+    a ``map`` entry is listed, not the physical repository. Wildcards in
+    ``writable`` and ``readonly`` lines are matched against all known
+    repositories, see :func:`repository_names`.
+
+    Groups everybody is member of (through ``@all``, or ``[group all]``)
+    grant their access to ``@all``, which stands for every user,
+    including those not listed in any ``members`` line. Its entry in the
+    per-user lists is what everybody may access.
+
+    The post-update hook stores the matrix as ``access.json`` next to
+    ``projects.list``, for web frontends deciding what to show whom::
+
+        {"repositories": {"foo": {"readers": ["@all", "jdoe"],
+                                  "writers": ["jdoe"]}},
+         "users": {"jdoe": {"readable": ["foo"], "writable": ["foo"]}}}
+
+    Writers are always readers, too.
+
+    :license: GPL
+"""
+
+import json
+import logging
+import os
+
+from gitosis import access
+from gitosis import group as _group
+from gitosis import pattern as _pattern
+from gitosis import util
+
+log = logging.getLogger("gitosis.matrix")
+
+#: Stands for every user in reader and writer lists.
+EVERYBODY = "@all"
+
+
+def path_for(config):
+    """Returns the location of ``access.json`` for `config`."""
+    return os.path.join(config.generated_files_dir, "access.json")
+
+
+def repository_names(config):
+    """Returns the names of all repositories found in the repository
+    directory or named in `config`, wildcards aside.
+    """
+    names = set()
+    base_dir = config.repository_dir
+    for dirpath, dirnames, _ in util.walk(base_dir):
+        reldir = os.path.relpath(dirpath, base_dir)
+        reldir = reldir if reldir != "." else ""
+        for dirname in dirnames[:]:
+            if dirname.endswith(".git"):
+                dirnames.remove(dirname)
+                names.add(os.path.join(reldir, dirname[:-len(".git")]))
+
+    for section in config.sections():
+        kind, _, name = section.partition(" ")
+        if kind == "repo":
+            names.add(name)
+        elif kind == "group":
+            for mode in access.MODES:
+                names.update(
+                    name for name in config.get(section, mode,
+                                                default="").split()
+                    if not _pattern.is_pattern(name))
+            for option in config.options(section):
+                mapped = _mapped(option)
+                if mapped is not None:
+                    names.add(mapped[1])
+    return names
+
+
+def _mapped(option):
+    """Returns ``(mode, name)`` if `option` is a ``map`` entry."""
+    words = option.split(None, 2)
+    if len(words) == 3 and words[0] == "map" and words[1] in access.MODES:
+        return words[1], words[2]
+
+
+def build(config, repositories=None, users=()):
+    """Compute the access matrix for `config`.
+
+    :param repositories: names to match wildcards against, all of
+                         :func:`repository_names` by default
+    :param users: users to list besides those in ``members`` lines and
+                  repository owners, e.g. everybody with a key
+    """
+    if repositories is None:
+        repositories = repository_names(config)
+    repositories = set(repositories)
+
+    owners = {}
+    users = set(users)
+    for section in config.sections():
+        kind, _, name = section.partition(" ")
+        if kind == "repo":
+            owner = config.get(section, "owner")
+            if owner:
+                owners[name] = owner
+                users.add(owner)
+        elif kind == "group":
+            users.update(member for member
+                         in config.get(section, "members", "").split()
+                         if not member.startswith("@"))
+
+    # invert the membership: who is in which group
+    members = {}
+    for user in users:
+        for name in _group.getMembership(config=config, user=user):
+            members.setdefault(name, set()).add(user)
+    for name in _group.getMembership(config=config, user=None):
+        members.setdefault(name, set()).add(EVERYBODY)
+
+    readers = {}
+    writers = {}
+    def grant(name, grantees, write):
+        readers.setdefault(name, set()).update(grantees)
+        if write:
+            writers.setdefault(name, set()).update(grantees)
+
+    for section in config.sections():
+        kind, _, group = section.partition(" ")
+        if kind != "group":
+            continue
+        grantees = members.get(group)
+        if not grantees:
+            continue
+        for mode in access.MODES:
+            write = mode != "readonly"
+            patterns = []
+            for name in config.get(section, mode, default="").split():
+                if _pattern.is_pattern(name):
+                    patterns.append(name)
+                elif name in repositories:
+                    grant(name, grantees, write)
+            if patterns:
+                patterns = _pattern.PatternSet(patterns)
+                for name in repositories:
+                    if name in patterns:
+                        grant(name, grantees, write)
+        for option in config.options(section):
+            mapped = _mapped(option)
+            if mapped is not None and mapped[1] in repositories:
+                grant(mapped[1], grantees, mapped[0] != "readonly")
+
+    for name, owner in owners.iteritems():
+        if name in repositories:
+            grant(name, [owner], True)
+
+    matrix = dict(repositories={}, users={})
+    for name in sorted(readers):
+        matrix["repositories"][name] = dict(
+            readers=sorted(readers[name]),
+            writers=sorted(writers.get(name, ())),
+            )
+        for (user_key, names) in (("readable", readers[name]),
+                                  ("writable", writers.get(name, ()))):
+            for user in names:
+                entry = matrix["users"].setdefault(
+                    user, dict(readable=[], writable=[]))
+                entry[user_key].append(name)
+    return matrix
+
+
+def _write(path, matrix):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    fp = file(tmp, "w")
+    try:
+        json.dump(matrix, fp, sort_keys=True)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+
+
+def generate(config, path=None, users=()):
+    """Write the access matrix of `config` to `path`, ``access.json`` in
+    the generated files directory by default.
+    """
+    if path is None:
+        path = path_for(config)
+    matrix = build(config, users=users)
+    _write(path, matrix)
+    log.debug("Wrote access matrix of {0} repositories to {1!r}"
+              .format(len(matrix["repositories"]), path))
+
+
+def update(config, name, path=None, users=()):
+    """Add the single repository `name` to the matrix at `path`, such as
+    a repository just created for a wildcard, recomputing nothing else.
+    """
+    if path is None:
+        path = path_for(config)
+    try:
+        fp = file(path)
+    except IOError:
+        # nothing to update, make the whole thing
+        generate(config, path, users=users)
+        return
+    try:
+        matrix = json.load(fp)
+    finally:
+        fp.close()
+    name = unicode(name)
+    for entry in matrix["users"].itervalues():
+        for names in entry.itervalues():
+            if name in names:
+                names.remove(name)
+    matrix["repositories"].pop(name, None)
+
+    single = build(config, repositories=[name], users=users)
+    matrix["repositories"].update(single["repositories"])
+    for user, entry in single["users"].iteritems():
+        current = matrix["users"].setdefault(
+            user, dict(readable=[], writable=[]))
+        for key, names in entry.iteritems():
+            current[key] = sorted(current[key] + names)
+    _write(path, matrix)
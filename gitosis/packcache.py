@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.packcache
+    ~~~~~~~~~~~~~~~~~
+
+    This module implements a cache of the packs sent by fetches, so that
+    CI clones of the same commit don't each run ``git pack-objects`` at
+    full CPU cost::
+
+        [gitosis]
+        pack-cache = yes
+        ## MiB, the least recently used packs are evicted beyond that
+        pack-cache-size = 1024
+
+        [repo secret]
+        pack-cache = no
+
+    It is ``gitosis-pack-objects``, set as ``uploadpack.packObjectsHook``
+    for the fetches of the repositories it is enabled for. Git ignores
+    that key in a repository's own config, so ``gitosis-serve`` passes it
+    to git in ``GIT_CONFIG_COUNT`` and friends, see :func:`install`.
+
+    A pack is keyed on the repository, the ``pack-objects`` arguments and
+    what upload-pack asks for on its standard input. A miss runs
+    ``git pack-objects``, streaming the pack to upload-pack and to a
+    temporary file at the same time, and moves that into the cache when
+    it is complete; concurrent misses for the same pack each write their
+    own file, and the last one wins. A hit streams the cached pack.
+    Packs live in ``pack-cache`` under
+    :attr:`~gitosis.config.GitosisRawConfigParser.generated_files_dir`;
+    hits and misses are counted in its ``stats`` file::
+
+        gitosis-pack-objects --cache=DIR --stats
+
+    :license: GPL
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import sys
+
+from gitosis import app
+
+log = logging.getLogger('gitosis.packcache')
+
+#: How git runs the hook, the options are added by :func:`hook`.
+COMMAND = 'gitosis-pack-objects'
+
+#: Default for ``pack-cache-size``, in MiB.
+MAX_SIZE = 1024
+
+FETCH_VERBS = ('git-upload-pack', 'git upload-pack')
+
+# only change what goes to stderr
+_NOT_IN_KEY = frozenset(['--progress', '-q', '--quiet', '--all-progress',
+                         '--all-progress-implied'])
+
+_CHUNK = 65536
+
+# temporary files left behind by killed hooks are removed after this
+# many seconds
+_STALE = 3600
+
+
+def cache_dir(config):
+    """Returns where the packs of `config` are cached."""
+    return os.path.join(config.generated_files_dir, 'pack-cache')
+
+
+def _quote(value):
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+def hook(config, request):
+    """Returns the ``uploadpack.packObjectsHook`` for a request, as noted
+    by :func:`gitosis.serve.serve`, or ``None`` if it is not cached.
+    """
+    if request.get('verb') not in FETCH_VERBS:
+        return None
+    enabled = config.getboolean('gitosis', 'pack-cache', default=False)
+    if not config.getboolean('repo %s' % request['repo'], 'pack-cache',
+                             default=enabled):
+        return None
+    try:
+        size = int(config.get('gitosis', 'pack-cache-size',
+                              default=MAX_SIZE))
+    except ValueError:
+        size = MAX_SIZE
+    return '%s --cache=%s --max-size=%d' % (
+        COMMAND, _quote(cache_dir(config)), size * 1024 * 1024)
+
+
+def install(command, environ):
+    """Make git use `command` as ``uploadpack.packObjectsHook``, by
+    adding it to the configuration passed in `environ`."""
+    if command is None:
+        return
+    try:
+        count = int(environ.get('GIT_CONFIG_COUNT', 0))
+    except ValueError:
+        count = 0
+    environ['GIT_CONFIG_KEY_%d' % count] = 'uploadpack.packObjectsHook'
+    environ['GIT_CONFIG_VALUE_%d' % count] = command
+    environ['GIT_CONFIG_COUNT'] = str(count + 1)
+
+
+def cache_key(repository, args, data):
+    """Returns the key of the pack for `args` and standard input `data`
+    in `repository`."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    digest.update(os.path.realpath(repository))
+    for arg in args:
+        if arg not in _NOT_IN_KEY:
+            digest.update('\0' + arg)
+    digest.update('\0\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def _path(cache, key):
+    return os.path.join(cache, key[:2], key[2:] + '.pack')
+
+
+def _locked(path, flags=fcntl.LOCK_EX):
+    """Returns a descriptor of `path` locked with `flags`, or ``None`` if
+    it is locked already and `flags` don't wait."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0640)
+    try:
+        fcntl.flock(fd, flags)
+    except IOError, e:
+        os.close(fd)
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return None
+    return fd
+
+
+def stats(cache):
+    """Returns the counters of `cache`, a dict of ``hits`` and
+    ``misses``."""
+    counters = dict(hits=0, misses=0)
+    try:
+        fp = file(os.path.join(cache, 'stats'))
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return counters
+    try:
+        for line in fp:
+            words = line.split()
+            if len(words) == 2 and words[0] in counters:
+                counters[words[0]] = int(words[1])
+    finally:
+        fp.close()
+    return counters
+
+
+def count(cache, counter):
+    """Add one to `counter` of `cache`. Never fails."""
+    path = os.path.join(cache, 'stats')
+    try:
+        fd = _locked(path)
+        try:
+            counters = stats(cache)
+            counters[counter] += 1
+            data = ''.join('%s %d\n' % item
+                           for item in sorted(counters.items()))
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    except (IOError, OSError):
+        pass
+
+
+def evict(cache, max_size, now=None, suffix='.pack'):
+    """Remove the least recently used packs until those left take at
+    most `max_size` bytes. Does nothing if another process is at it.
+
+    :param suffix: of the files in `cache` holding what is cached
+    """
+    import time
+
+    if now is None:
+        now = time.time()
+    fd = _locked(os.path.join(cache, '.lock'),
+                 fcntl.LOCK_EX | fcntl.LOCK_NB)
+    if fd is None:
+        return
+    try:
+        packs = []
+        total = 0
+        for subdir in os.listdir(cache):
+            subdir = os.path.join(cache, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(suffix):
+                    packs.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+                elif name.startswith('.tmp-') and st.st_mtime < now - _STALE:
+                    os.unlink(path)
+        packs.sort()
+        for (_, size, path) in packs:
+            if total <= max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            log.debug('Evicted %r', path)
+    finally:
+        os.close(fd)
+
+
+def _copy(src, dst):
+    while True:
+        chunk = src.read(_CHUNK)
+        if not chunk:
+            break
+        dst.write(chunk)
+
+
+def pack_objects(cache, max_size, args, stdin, stdout, repository='.'):
+    """Write the pack ``git pack-objects`` writes given `args` and
+    `stdin` to `stdout`, from `cache` if it is there.
+
+    `args` start with the command to run, as git passes them to the hook.
+    Returns the exit status.
+    """
+    import subprocess
+    import tempfile
+
+    data = stdin.read()
+    key = cache_key(repository, args, data)
+    path = _path(cache, key)
+    try:
+        fp = file(path, 'rb')
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+    else:
+        try:
+            # the mtime tells the least recently used, atime is often
+            # not kept up to date
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            _copy(fp, stdout)
+        finally:
+            fp.close()
+        stdout.flush()
+        count(cache, 'hits')
+        return 0
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0750)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    count(cache, 'misses')
+
+    request = tempfile.TemporaryFile()
+    request.write(data)
+    request.seek(0)
+    child = subprocess.Popen(args, stdin=request, stdout=subprocess.PIPE,
+                             close_fds=True)
+    request.close()
+    tmp = os.path.join(directory, '.tmp-%d-%s' % (os.getpid(), key[:16]))
+    out = file(tmp, 'wb')
+    size = 0
+    try:
+        while True:
+            chunk = child.stdout.read(_CHUNK)
+            if not chunk:
+                break
+            stdout.write(chunk)
+            if out is not None:
+                size += len(chunk)
+                if size > max_size:
+                    # too big to keep
+                    out.close()
+                    out = None
+                    os.unlink(tmp)
+                else:
+                    out.write(chunk)
+        stdout.flush()
+    except:
+        child.kill()
+        child.wait()
+        if out is not None:
+            out.close()
+            os.unlink(tmp)
+        raise
+    status = child.wait()
+    if out is not None:
+        out.close()
+        if status == 0:
+            os.rename(tmp, path)
+            evict(cache, max_size)
+        else:
+            os.unlink(tmp)
+    return status
+
+
+class Main(app.App):
+    """gitosis-pack-objects program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog --cache=DIR [OPTS] git pack-objects ARGS...')
+        parser.set_description(
+            'Run git pack-objects as uploadpack.packObjectsHook, caching'
+            ' the packs')
+        parser.set_defaults(
+            max_size=MAX_SIZE * 1024 * 1024,
+            )
+        parser.add_option('--cache', metavar='DIR',
+                          help='cache packs in DIR')
+        parser.add_option('--max-size', metavar='BYTES', type='int',
+                          help='keep at most BYTES of packs')
+        parser.add_option('--stats', action='store_true',
+                          help='print the hit and miss counters and exit')
+        # the arguments of git pack-objects are not ours
+        parser.disable_interspersed_args()
+        return parser
+
+    def read_config(self, options, cfg):
+        """The hook gets all it needs on the command line."""
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        if options.cache is None:
+            parser.error('Missing option --cache.')
+        if options.stats:
+            counters = stats(options.cache)
+            for name in ('hits', 'misses'):
+                print '%s %d' % (name, counters[name])
+            return
+        if not args:
+            parser.error('Missing the git pack-objects command.')
+        try:
+            status = pack_objects(
+                cache=options.cache,
+                max_size=options.max_size,
+                args=args,
+                stdin=sys.stdin,
+                stdout=sys.stdout,
+                repository=os.environ.get('GIT_DIR', '.'),
+                )
+        except IOError, e:
+            # upload-pack hung up
+            if e.errno != errno.EPIPE:
+                raise
+            status = 1
+        sys.exit(status)
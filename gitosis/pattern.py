@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.pattern
+    ~~~~~~~~~~~~~~~
+
+    This module implements matching of repository names against the
+    patterns listed in ``writable`` and ``readonly`` lines.
+
+    A pattern is matched path component by path component:
+
+    - ``*`` matches any part of a single component, so ``team/*``
+      matches ``team/foo`` but not ``team/foo/bar``, and ``proj-*``
+      matches ``proj-foo``,
+    - ``?`` matches exactly one character of a component,
+    - a component that is just ``**`` matches any number of components:
+      ``team/**`` matches everything below ``team`` and ``a/**/b``
+      matches ``a/b`` as well as ``a/x/y/b``,
+    - everything else must match literally.
+
+    All patterns of a list are compiled into one trie keyed by path
+    component, so looking up a repository costs a dictionary lookup per
+    component plus the wildcard components along the way, no matter how
+    many plain names are listed.
+
+    :license: GPL
+"""
+
+import re
+
+# Layout of a trie node. Nodes are plain lists so compiled patterns can
+# be stored with :mod:`marshal` (see :mod:`gitosis.snapshot`).
+#
+# Wildcard components are indexed by the literal text in front of the
+# first wildcard, and every node remembers which lengths those prefixes
+# have, so ``proj-*`` is only tried for components starting ``proj-``.
+_EXACT, _GLOBS, _PREFIX_LENGTHS, _DEEP, _PATTERN = range(5)
+
+_compiled_globs = {}
+_WILDCARD_RE = re.compile(r'[*?]')
+
+
+def _node():
+    return [{}, {}, [], None, None]
+
+
+def is_pattern(name):
+    """Returns whether `name` contains any wildcards."""
+    return '*' in name or '?' in name
+
+
+def _glob_match(glob, component):
+    try:
+        regex = _compiled_globs[glob]
+    except KeyError:
+        regex = '.*'.join('.'.join(re.escape(literal)
+                                   for literal in part.split('?'))
+                          for part in glob.split('*'))
+        regex = _compiled_globs[glob] = re.compile(regex + r'\Z')
+    return regex.match(component) is not None
+
+
+class PatternSet(object):
+    """A compiled list of repository names and patterns."""
+
+    def __init__(self, patterns=(), state=None):
+        if state is None:
+            state = _node()
+        self.state = state
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        """Add a single name or pattern."""
+        node = self.state
+        for component in pattern.split('/'):
+            if component == '**':
+                if node[_DEEP] is None:
+                    node[_DEEP] = _node()
+                node = node[_DEEP]
+            elif is_pattern(component):
+                prefix = component[:_WILDCARD_RE.search(component).start()]
+                globs = node[_GLOBS].setdefault(prefix, [])
+                for (glob, child) in globs:
+                    if glob == component:
+                        node = child
+                        break
+                else:
+                    child = _node()
+                    globs.append([component, child])
+                    if len(prefix) not in node[_PREFIX_LENGTHS]:
+                        node[_PREFIX_LENGTHS].append(len(prefix))
+                        node[_PREFIX_LENGTHS].sort()
+                    node = child
+            else:
+                node = node[_EXACT].setdefault(component, _node())
+        if node[_PATTERN] is None:
+            node[_PATTERN] = pattern
+
+    def match(self, path):
+        """Returns a pattern matching `path`, or ``None``.
+
+        Plain names are preferred over wildcards, so if `path` itself is
+        listed, it is what's returned.
+        """
+        return _match(self.state, path.split('/'), 0)
+
+    def __contains__(self, path):
+        return self.match(path) is not None
+
+
+def _match(node, components, index):
+    if index == len(components):
+        return node[_PATTERN]
+
+    # exact names first, they are the common case
+    child = node[_EXACT].get(components[index])
+    if child is not None:
+        found = _match(child, components, index + 1)
+        if found is not None:
+            return found
+
+    component = components[index]
+    for length in node[_PREFIX_LENGTHS]:
+        if length > len(component):
+            break
+        for (glob, child) in node[_GLOBS].get(component[:length], ()):
+            if _glob_match(glob, component):
+                found = _match(child, components, index + 1)
+                if found is not None:
+                    return found
+
+    deep = node[_DEEP]
+    if deep is not None:
+        # a trailing ``**`` swallows everything that is left, one or
+        # more components; otherwise try every possible split.
+        if deep[_PATTERN] is not None:
+            return deep[_PATTERN]
+        for rest in xrange(index, len(components)):
+            found = _match(deep, components, rest)
+            if found is not None:
+                return found
+    return None
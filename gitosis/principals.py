@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.principals
+    ~~~~~~~~~~~~~~~~~~
+
+    This module implements ``gitosis-principals``, an
+    ``AuthorizedPrincipalsCommand`` for ``sshd``, so users can log in
+    with a certificate signed by a local CA instead of a key listed in
+    ``keydir``. Sign the key of each user with their user name as
+    principal::
+
+        ssh-keygen -s ca -I jdoe -n jdoe jdoe.pub
+
+    and in ``/etc/ssh/sshd_config``::
+
+        TrustedUserCAKeys /etc/ssh/gitosis-ca.pub
+        Match User git
+            AuthorizedPrincipalsCommand /usr/bin/gitosis-principals
+            AuthorizedPrincipalsCommandUser git
+
+    It prints a line for every user named in the ``members`` of a group,
+    with the options of ``authorized_keys``, so ``sshd`` runs
+    ``gitosis-serve`` for the principal of the certificate it accepted.
+    The users come from the access snapshot ``post-update`` compiled (see
+    :mod:`gitosis.snapshot`), ``gitosis.conf`` is only parsed without
+    one. Given ``%i``, the key id of the certificate, it prints the line
+    of that user only, for CAs using the user name as key id too.
+
+    Users only let in through ``@all`` or a ``[group all]`` have to be
+    named in some ``members`` to log in with a certificate.
+
+    :license: GPL
+"""
+
+import sys
+
+from gitosis import app
+from gitosis import snapshot
+from gitosis import ssh
+from gitosis import sshkey
+
+
+def users(config):
+    """Returns the users that may log in with a certificate, sorted."""
+    if config.snapshot is not None:
+        names = config.snapshot.users()
+    else:
+        names = snapshot.members(config)
+    return sorted(name for name in names if sshkey.isSafeUsername(name))
+
+
+def authorizedPrincipalsLine(user):
+    """Returns the ``authorized_principals`` line letting ``user`` in."""
+    return '%s %s' % (ssh.SERVE_OPTIONS % dict(user=user), user)
+
+
+def generate(config, names=None):
+    """Generate the lines for the principals `names`, or all users."""
+    known = users(config)
+    if names is not None:
+        wanted = set(names)
+        known = [user for user in known if user in wanted]
+    for user in known:
+        yield authorizedPrincipalsLine(user)
+
+
+class Main(app.App):
+    """gitosis-principals program."""
+    # W0613 - They also might ignore arguments here, where the descendant
+    # methods won't.
+    # pylint: disable-msg=W0613
+
+    def create_parser(self):
+        """Declare the input for this program."""
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] [PRINCIPAL..]')
+        parser.set_description(
+            'Print the authorized_principals lines of the gitosis users,'
+            ' for sshd AuthorizedPrincipalsCommand')
+        return parser
+
+    def read_config(self, options, cfg):
+        """Restore the config from its snapshot, parse it if there's none."""
+        if not snapshot.restore(cfg, options.config):
+            super(Main, self).read_config(options, cfg)
+
+    def handle_args(self, parser, cfg, options, args): #pragma: no cover
+        """Parse the input for this program."""
+        for line in generate(cfg, names=args or None):
+            print line
+        sys.exit(0)
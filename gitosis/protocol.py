@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.protocol
+    ~~~~~~~~~~~~~~~~
+
+    This module implements the git protocol version policy. Clients ask
+    for protocol v2 in the ``GIT_PROTOCOL`` environment variable, which
+    sshd passes on with::
+
+        AcceptEnv GIT_PROTOCOL
+
+    in ``sshd_config``. ``gitosis-serve`` passes it on to git in turn,
+    unless a policy says otherwise::
+
+        [gitosis]
+        ## prefer-v2, the default, serves whatever the client asks for,
+        ## v2 or v0; force-v2 turns away fetches not asking for v2;
+        ## force-v0 serves v0 even to clients asking for v2
+        protocol = prefer-v2
+
+        [repo huge]
+        protocol = force-v2
+
+    With protocol v2, a fetch lists only the refs it asks for, instead of
+    git advertising all of them first, which makes a difference for
+    repositories with many refs. There is no v2 for pushes, so the policy
+    only applies to fetches. Clients still speaking v0 are served v0
+    unless ``force-v2`` is set; ``force-v0`` downgrades clients asking
+    for v2, for repositories whose hosting breaks with v2.
+
+    :license: GPL
+"""
+
+import logging
+
+log = logging.getLogger('gitosis.protocol')
+
+PREFER_V2 = 'prefer-v2'
+FORCE_V2 = 'force-v2'
+FORCE_V0 = 'force-v0'
+POLICIES = (PREFER_V2, FORCE_V2, FORCE_V0)
+
+#: Verbs the policy applies to.
+FETCH_VERBS = ('git-upload-pack', 'git upload-pack')
+
+
+class VersionRequired(Exception):
+    """Protocol v2 required"""
+
+    def __str__(self):
+        return '%s, %s' % (self.__doc__, ': '.join(self.args))
+
+
+def policy(config, request):
+    """Returns the policy for a request, as noted by
+    :func:`gitosis.serve.serve`, or ``None`` if whatever the client asks
+    for is fine.
+    """
+    if request.get('verb') not in FETCH_VERBS:
+        return None
+    value = config.get('repo %s' % request['repo'], 'protocol')
+    if value is None:
+        value = config.get('gitosis', 'protocol')
+    if value is None or value == PREFER_V2:
+        return None
+    if value not in POLICIES:
+        log.warning('Ignoring unknown protocol policy %r', value)
+        return None
+    return value
+
+
+def version(value):
+    """Returns the protocol version asked for in a ``GIT_PROTOCOL``
+    `value`, 0 if none."""
+    wanted = 0
+    for item in (value or '').split(':'):
+        if item.startswith('version='):
+            try:
+                wanted = max(wanted, int(item[len('version='):]))
+            except ValueError:
+                pass
+    return wanted
+
+
+def apply(policy, environ):
+    """Apply `policy`, as returned by :func:`policy`, to the ``environ``
+    git runs with.
+
+    Raises :exc:`VersionRequired` if the client must ask for v2.
+    """
+    if policy is None:
+        return
+    value = environ.get('GIT_PROTOCOL')
+    if policy == FORCE_V2:
+        if version(value) < 2:
+            raise VersionRequired(
+                'use git 2.18 or later and set protocol.version=2')
+    elif policy == FORCE_V0 and value is not None:
+        items = [item for item in value.split(':')
+                 if item and not item.startswith('version=')]
+        if items:
+            environ['GIT_PROTOCOL'] = ':'.join(items)
+        else:
+            del environ['GIT_PROTOCOL']
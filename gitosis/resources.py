@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.resources
+    ~~~~~~~~~~~~~~~~~
+
+    This module implements resource classes: the CPU and I/O priority and
+    the limits ``git`` runs with, so that batch mirrors and CI clones
+    can't starve developers working on the same host::
+
+        [resources batch]
+        ## nice level, only ever raised
+        nice = 10
+        ## I/O scheduling class: idle, or best-effort with a level
+        ## from 0 (highest) to 7 (lowest)
+        ionice = best-effort 7
+        ## RLIMIT_AS, in MiB
+        max-memory = 2048
+        ## RLIMIT_CPU, in seconds
+        max-cpu = 3600
+
+        [group ci]
+        members = bot1 bot2
+        resources = batch
+
+        [repo mirrors/linux]
+        resources = batch
+
+    The class of a request comes from the ``[repo ...]`` section of the
+    repository, the first group of the user setting one, or the
+    ``[gitosis]`` section, in that order. ``gitosis-serve`` applies it to
+    itself right before it ``exec``\\s ``git``, which inherits it along
+    with everything git runs in turn.
+
+    :license: GPL
+"""
+
+import logging
+import os
+
+from gitosis import access
+
+log = logging.getLogger('gitosis.resources')
+
+# see linux/ioprio.h
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {
+    'best-effort': 2,
+    'idle': 3,
+    }
+
+# ioprio_set has no wrapper in the C library, nor in Python
+_SYS_IOPRIO_SET = {
+    'x86_64': 251,
+    'i386': 289,
+    'i486': 289,
+    'i586': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'armv6l': 314,
+    'ppc64': 273,
+    'ppc64le': 273,
+    's390x': 282,
+    }
+
+#: Limits set by the options of a resource class, and their unit.
+RLIMITS = [
+    ('max-memory', 'RLIMIT_AS', 1024 * 1024),
+    ('max-cpu', 'RLIMIT_CPU', 1),
+    ]
+
+
+def _int(config, section, option):
+    value = config.get(section, option)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        log.warning('Ignoring %s = %r in [%s], not a number',
+                    option, value, section)
+        return None
+
+
+def parse_ionice(value):
+    """Returns ``(class, level)`` for an ``ionice`` setting.
+
+    Raises :exc:`ValueError` if `value` is not understood.
+    """
+    words = value.split()
+    if not words or words[0] not in IOPRIO_CLASSES:
+        raise ValueError('unknown I/O scheduling class: %r' % value)
+    if words[0] == 'idle':
+        if len(words) != 1:
+            raise ValueError('idle takes no level: %r' % value)
+        return (IOPRIO_CLASSES['idle'], 0)
+    if len(words) == 1:
+        return (IOPRIO_CLASSES['best-effort'], 4)
+    level = int(words[1])
+    if len(words) != 2 or not 0 <= level <= 7:
+        raise ValueError('level must be 0 to 7: %r' % value)
+    return (IOPRIO_CLASSES['best-effort'], level)
+
+
+def class_name(config, user, request):
+    """Returns the name of the resource class of a request, as noted by
+    :func:`gitosis.serve.serve`, or ``None``.
+    """
+    name = config.get('repo %s' % request['repo'], 'resources')
+    if name is not None:
+        return name
+    for group in access.get_acl(config).membership(user):
+        name = config.get('group %s' % group, 'resources')
+        if name is not None:
+            return name
+    return config.get('gitosis', 'resources')
+
+
+def parameters(config, user, request):
+    """Returns the keyword arguments for :func:`apply` for a request, or
+    ``None`` if it runs with no particular resources.
+    """
+    name = class_name(config, user, request)
+    if name is None:
+        return None
+    section = 'resources %s' % name
+    if not config.has_section(section):
+        log.warning('Resource class %r is not defined', name)
+        return None
+
+    params = {}
+    nice = _int(config, section, 'nice')
+    if nice is not None:
+        params['nice'] = nice
+    value = config.get(section, 'ionice')
+    if value is not None:
+        try:
+            params['ionice'] = parse_ionice(value)
+        except ValueError, e:
+            log.warning('Ignoring ionice in [%s], %s', section, e)
+    limits = []
+    for (option, limit, unit) in RLIMITS:
+        value = _int(config, section, option)
+        if value is not None:
+            limits.append((limit, value * unit))
+    if limits:
+        params['rlimits'] = limits
+    if not params:
+        return None
+    return params
+
+
+def set_nice(nice):
+    """Raise the nice level of this process to `nice`."""
+    current = os.nice(0)
+    if nice > current:
+        os.nice(nice - current)
+
+
+def set_ionice(ioclass, level):
+    """Set the I/O scheduling class and level of this process."""
+    import ctypes
+
+    number = _SYS_IOPRIO_SET.get(os.uname()[4])
+    if number is None:
+        raise OSError('ioprio_set is not known on %s' % os.uname()[4])
+    libc = ctypes.CDLL(None, use_errno=True)
+    ioprio = ioclass << _IOPRIO_CLASS_SHIFT | level
+    if libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def set_rlimit(limit, value):
+    """Lower both the soft and hard `limit`, a name from :mod:`resource`,
+    to `value`."""
+    import resource
+
+    kind = getattr(resource, limit)
+    (_, hard) = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    try:
+        resource.setrlimit(kind, (value, value))
+    except resource.error, e:
+        raise OSError(*e.args)
+
+
+def apply(nice=None, ionice=None, rlimits=()):
+    """Apply a resource class to this process.
+
+    What can't be applied is logged and left as it is; it never keeps
+    the request from being served.
+    """
+    if nice is not None:
+        try:
+            set_nice(nice)
+        except OSError, e:
+            log.warning('Cannot set nice level %d: %s', nice, e)
+    if ionice is not None:
+        try:
+            set_ionice(*ionice)
+        except OSError, e:
+            log.warning('Cannot set I/O priority %r: %s', ionice, e)
+    for (limit, value) in rlimits:
+        try:
+            set_rlimit(limit, value)
+        except (ValueError, OSError), e:
+            log.warning('Cannot set %s to %d: %s', limit, value, e)
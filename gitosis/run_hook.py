@@ -7,22 +7,46 @@ import os
 import sys
 
 from gitosis import repository, ssh, gitweb, cgit, gitdaemon, app, util
+from gitosis import gitconfig, identity, keydb, matrix, snapshot
 
 
 def build_reposistory_data(config):
     """
     Using the ``config`` data, perform all actions that affect files in the .git
-    repositories, such as the description, owner, and export marker. Also
-    update the projects.list file as needed to list relevant repositories.
+    repositories, such as the description, owner, export marker and git
+    config. Also update the projects.list file as needed to list relevant
+    repositories, and the access matrix in access.json.
 
     :type config: RawConfigParser
     """
     gitdaemon.export(config)
+    gitconfig.apply(config)
     gitweb.set_descriptions(config)
     gitweb.generate_project_list(config,
         os.path.join(config.generated_files_dir, "projects.list"))
     cgit.generate_project_list(config,
         os.path.join(config.generated_files_dir, "repos.list"))
+    matrix.generate(config)
+
+
+def build_repository_data_for(config, name):
+    """
+    Like :func:`build_reposistory_data`, but only for the single
+    repository ``name``, such as one that has just been created. The
+    lists of projects are updated in place instead of being regenerated
+    from scratch.
+
+    :type config: RawConfigParser
+    :type name: str
+    """
+    gitdaemon.export_repository(config, name)
+    gitconfig.apply_repository(config, name)
+    gitweb.set_description(config, name)
+    gitweb.update_project_list(config,
+        os.path.join(config.generated_files_dir, "projects.list"), name)
+    cgit.update_project_list(config,
+        os.path.join(config.generated_files_dir, "repos.list"), name)
+    matrix.update(config, name)
 
 
 def post_update(cfg, git_dir): #pragma: no cover
@@ -34,23 +58,39 @@ def post_update(cfg, git_dir): #pragma: no cover
     3. Update the repository descriptions.
     4. Update the projects.list file.
     5. Update the repository export markers.
-    6. Update the Gitosis SSH keys.
+    6. Update the Gitosis SSH keys, in ``authorized_keys`` or the key
+       index of ``gitosis-keys-lookup``, and the user identity index.
+    7. Compile the access snapshot used by ``gitosis-serve``.
     """
     export = os.path.join(git_dir, 'gitosis-export')
     util.rmtree(export)
     repository.export(git_dir=git_dir, path=export)
+    config_path = os.path.join(export, '..', 'gitosis.conf')
     os.rename(
         os.path.join(export, 'gitosis.conf'),
-        os.path.join(export, '..', 'gitosis.conf'),
+        config_path,
         )
     # re-read config to get up-to-date settings
-    cfg.read(os.path.join(export, '..', 'gitosis.conf'))
+    cfg.read(config_path)
     build_reposistory_data(cfg)
     authorized_keys = cfg.ssh_authorized_keys_path
+    identities = {}
+    keys = list(ssh.readKeys(
+            os.path.join(export, 'keydir'),
+            identities,
+            cache=os.path.join(cfg.generated_files_dir, 'keys-cache'),
+            ))
+    keys_mode = keydb.mode(cfg)
+    if keys_mode != keydb.FILE:
+        keydb.write(keydb.path_for(cfg), keys)
     ssh.writeAuthorizedKeys(
         path=authorized_keys,
         keydir=os.path.join(export, 'keydir'),
+        # only removes the keys written before
+        keys=keys if keys_mode != keydb.COMMAND else [],
         )
+    identity.write(cfg, identities)
+    snapshot.write(cfg, config_path)
 
 class Main(app.App):
     """gitosis-run-hook program."""
@@ -5,14 +5,29 @@ prefix. Repository names are forced to match ALLOW_RE.
 """
 
 import logging
+import marshal
 
 import sys, os, re
 
+# Not :mod:`socket`, which loads the SSL library on import; talking to
+# gitosis-authd only needs a UNIX socket.
+import _socket
+
+# Keep this list short: gitosis-serve runs for every SSH connection.
+# Modules only needed to create repositories on the fly are imported
+# where that happens.
 from gitosis import access
-from gitosis import repository
+from gitosis import admission
 from gitosis import app
-from gitosis import util
-from gitosis import run_hook
+from gitosis import archive
+from gitosis import audit
+from gitosis import identity
+from gitosis import packcache
+from gitosis import protocol
+from gitosis import resources
+from gitosis import shedding
+from gitosis import snapshot
+from gitosis import timing
 
 log = logging.getLogger('gitosis.serve')
 
@@ -21,6 +36,8 @@ ALLOW_RE = re.compile("^'/*(?P<path>[a-zA-Z0-9][a-zA-Z0-9@._-]*(/[a-zA-Z0-9][a-z
 COMMANDS_READONLY = [
     'git-upload-pack',
     'git upload-pack',
+    'git-upload-archive',
+    'git upload-archive',
     ]
 
 COMMANDS_WRITE = [
@@ -52,8 +69,38 @@ class WriteAccessDenied(AccessDenied):
 class ReadAccessDenied(AccessDenied):
     """Repository read access denied"""
 
-def serve(cfg, user, command):
-    """Check the git command for sanity, and then run the git command."""
+class ServerOverloaded(ServingError):
+    """Server too busy for low priority fetches"""
+
+    def __str__(self):
+        return '%s, retry after %d seconds' % (self.__doc__, self.args[0])
+
+def serve(cfg, user, command, timer=None, request=None):
+    """Check the git command for sanity, and then run the git command.
+
+    If a :class:`gitosis.timing.Timer` is given, the phases of the
+    decision are marked on it. If a `request` dict is given, what was
+    asked for is noted in it: ``verb``, ``repo``, the granted ``mode``,
+    the full ``path`` of the repository and whether it was ``created``.
+    Denials are recorded in the audit log, see :mod:`gitosis.audit`;
+    whoever runs git records the grant, once the request got through
+    :mod:`gitosis.protocol` and :mod:`gitosis.admission`, see
+    :func:`gitosis.audit.record_request`.
+    """
+    if timer is None:
+        timer = timing.Timer()
+    if request is None:
+        request = {}
+    try:
+        return _serve(cfg, user, command, timer, request)
+    except ServingError, e:
+        if 'repo' not in request:
+            request['command'] = command
+        audit.record(cfg, user, audit.DENIED, reason=str(e), **request)
+        raise
+
+def _serve(cfg, user, command, timer, request):
+    """Decide on `command`, noting what it asks for in `request`."""
 
     log = logging.getLogger('gitosis.serve.serve')
 
@@ -84,6 +131,9 @@ def serve(cfg, user, command):
                 cmd=verb,
                 args=args,
                 ))
+    timer.note('verb', verb)
+    request['verb'] = verb
+    timer.mark('command')
 
     if args.startswith("'/") and args.endswith("'"):
         args = args[1:-1]
@@ -96,59 +146,50 @@ def serve(cfg, user, command):
         else:
             args = args[1:]
         args = "'%s'" % (args, )
+        timer.mark('realpath')
 
     match = ALLOW_RE.match(args)
     if match is None:
         raise UnsafeArgumentsError()
 
     path = match.group('path')
+    timer.note('repo', path)
+    request['repo'] = path
+
+    grant = access.resolve(config=cfg, user=user, path=path)
+    timer.mark('access')
+    if grant is None:
+        raise ReadAccessDenied()
+
+    (mode, topdir, relpath) = grant
+    request['mode'] = mode
+    if mode == 'writeable':
+        log.warning('Repository %r config has typo "writeable", '
+            +'should be "writable"',
+            path,
+            )
+    elif mode == 'readonly' and verb in COMMANDS_WRITE:
+        # didn't have write access and tried to write
+        raise WriteAccessDenied()
+
+    if verb in COMMANDS_READONLY and shedding.enabled(cfg):
+        retry_after = shedding.check(cfg, user)
+        timer.mark('shedding')
+        if retry_after is not None:
+            raise ServerOverloaded(retry_after)
 
-    # write access is always sufficient
-    newpath = access.allowed(
-        config=cfg,
-        user=user,
-        mode='writable',
-        path=path)
-
-    if newpath is None:
-        # didn't have write access; try once more with the popular
-        # misspelling
-        newpath = access.allowed(
-            config=cfg,
-            user=user,
-            mode='writeable',
-            path=path)
-        if newpath is not None:
-            log.warning('Repository %r config has typo "writeable", '
-                +'should be "writable"',
-                path,
-                )
-
-    if newpath is None:
-        # didn't have write access
-
-        newpath = access.allowed(
-            config=cfg,
-            user=user,
-            mode='readonly',
-            path=path)
-
-        if newpath is None:
-            raise ReadAccessDenied()
-
-        if verb in COMMANDS_WRITE:
-            # didn't have write access and tried to write
-            raise WriteAccessDenied()
-
-    (topdir, relpath) = newpath
     assert not relpath.endswith('.git'), \
            'git extension should have been stripped: %r' % relpath
     repopath = '%s.git' % relpath
     fullpath = os.path.join(topdir, repopath)
-    if not os.path.exists(fullpath):
+    request['path'] = fullpath
+    exists = os.path.exists(fullpath)
+    timer.mark('exists')
+    if not exists:
         # it doesn't exist on the filesystem, but the configuration
         # refers to it, we're serving a write request, and the user is
         # authorized to do that: create the repository on the fly
+        from gitosis import repository, run_hook, util
 
         # create leading directories
         path = topdir
@@ -164,7 +205,14 @@ def serve(cfg, user, command):
             util.mkdir(path, newdirmode)
 
         repository.init(path=fullpath, mode=newdirmode)
-        run_hook.build_reposistory_data(cfg)
+        # the generated files name repositories by their path below
+        # [gitosis] repositories, which is not relpath for a group
+        # with repositories of its own
+        listed = os.path.relpath(fullpath, cfg.repository_dir)
+        if not listed.startswith(os.pardir + os.sep):
+            run_hook.build_repository_data_for(cfg, listed[:-len('.git')])
+        timer.mark('autocreate')
+        request['created'] = True
 
     # put the verb back together with the new path
     newcmd = "%(verb)s '%(path)s'" % dict(
@@ -173,6 +221,66 @@ def serve(cfg, user, command):
         )
     return newcmd
 
+def command_argv(cfg, request, newcmd):
+    """Returns the command line to ``exec`` for `newcmd`, as returned by
+    :func:`serve` along with `request`.
+
+    That is ``git shell -c newcmd``, unless ``direct-exec`` is set in
+    the ``[gitosis]`` section: then git is told to run the command
+    itself, with the path :func:`serve` already checked and made
+    absolute, saving ``git shell`` parsing it once more, and a process.
+    Either way, the environment, ``GIT_PROTOCOL`` included, is passed
+    on unchanged. Archives are served by ``gitosis-upload-archive``
+    where they are cached, see :mod:`gitosis.archive`.
+    """
+    argv = archive.command_argv(cfg, request)
+    if argv is not None:
+        return argv
+    if cfg.getboolean('gitosis', 'direct-exec', default=False):
+        # "git upload-pack" or "git-upload-pack"; the latter is not in
+        # PATH everywhere
+        subverb = request['verb'][len('git')+1:]
+        return ['git', subverb, request['path']]
+    return ['git', 'shell', '-c', newcmd]
+
+#: Where gitosis-authd listens unless told otherwise.
+AUTHD_SOCKET = '~/.gitosis-authd.sock'
+
+#: Seconds to wait for gitosis-authd before deciding in-process.
+AUTHD_TIMEOUT = 10.0
+
+def ask_authd(path, user, command):
+    """Ask the gitosis-authd listening on `path` to decide on `command`.
+
+    Returns the reply, a dict with either ``error`` or ``command``,
+    ``argv`` and ``env``, or ``None`` if the daemon could not be asked,
+    in which case the caller has to decide by itself.
+    """
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    chunks = []
+    try:
+        try:
+            sock.settimeout(AUTHD_TIMEOUT)
+            sock.connect(path)
+            sock.sendall(marshal.dumps((user, command)))
+            sock.shutdown(_socket.SHUT_WR)
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except _socket.error:
+            return None
+    finally:
+        sock.close()
+    try:
+        reply = marshal.loads(''.join(chunks))
+    except (EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(reply, dict):
+        return None
+    return reply
+
 class Main(app.App):
     """gitosis-serve program."""
     # W0613 - They also might ignore arguments here, where the descendant
@@ -185,8 +293,77 @@ class Main(app.App):
         parser.set_usage('%prog [OPTS] USER')
         parser.set_description(
             'Allow restricted git operations under DIR')
+        parser.set_defaults(
+            authd_socket=AUTHD_SOCKET,
+            )
+        parser.add_option('--authd-socket',
+                          metavar='PATH',
+                          help='ask gitosis-authd listening on PATH first,'
+                          +' empty to always decide in-process',
+                          )
         return parser
 
+    def main(self):
+        """Let gitosis-authd decide if it is running, otherwise load
+        the config and decide in this process."""
+        self.timer = timing.Timer()
+        self.audit = None
+        self.setup_basic_logging()
+        parser = self.create_parser()
+        (options, args) = parser.parse_args()
+        self.timer.mark('options')
+        cmd = os.environ.get('SSH_ORIGINAL_COMMAND')
+        if len(args) == 1 and cmd is not None and options.authd_socket:
+            reply = ask_authd(
+                path=os.path.expanduser(options.authd_socket),
+                user=args[0],
+                command=cmd,
+                )
+            self.timer.mark('authd')
+            if reply is not None:
+                self.handle_reply(args[0], reply)
+        super(Main, self).main()
+
+    def handle_reply(self, user, reply): #pragma: no cover
+        """Act on the decision gitosis-authd made for `user`."""
+        main_log = logging.getLogger('gitosis.serve.main')
+        if 'timing-log' in reply:
+            # the daemon's phases happened during our round trip, what
+            # is left of it is the cost of asking
+            (phase, roundtrip) = self.timer.phases.pop()
+            self.timer.phases.extend(reply['phases'])
+            spent = sum(us for (_, us) in reply['phases'])
+            self.timer.phases.append((phase, max(0, roundtrip - spent)))
+            self.timer.fields.update(reply['fields'])
+        timing_log = reply.get('timing-log')
+        if timing_log is not None:
+            self.timer.use(timing.monotonic())
+        if 'error' in reply:
+            timing.record(timing_log, self.timer)
+            main_log.error('%s', reply['error'])
+            sys.exit(1)
+        if 'audit' in reply:
+            self.audit = (reply['audit'], user, reply['request'])
+        self.negotiate(reply.get('protocol'), timing_log)
+        self.admit(reply.get('admission'), timing_log)
+        self.record_audit()
+        self.limit(reply.get('resources'))
+        packcache.install(reply.get('pack-cache'), os.environ)
+        timing.record(timing_log, self.timer)
+        os.umask(0022)
+        os.environ['GITOSIS_USER'] = user
+        os.environ.update(reply['env'])
+        os.chdir(os.path.expanduser('~'))
+        self.execute(reply['argv'])
+
+    def read_config(self, options, cfg):
+        """Restore the config from its snapshot, parse it if there's none."""
+        if not snapshot.restore(cfg, options.config):
+            super(Main, self).read_config(options, cfg)
+        if timing.log_path(cfg) is not None:
+            self.timer.use(timing.monotonic())
+        self.timer.mark('config')
+
     def handle_args(self, parser, cfg, options, args): #pragma: no cover
         """Parse the input for this program."""
         try:
@@ -198,26 +375,9 @@ class Main(app.App):
         os.umask(0022)
 
         os.environ['GITOSIS_USER'] = user
-
-        userfile=os.path.join(cfg.repository_dir,'gitosis-admin.git','gitosis-export','keydir',user+'.pub')
-        try:
-            userdata=open(userfile, 'r').readline()
-        except:
-            # don't fail if file is not found
-            userdata=""
-
-        if len(userdata) > 0:
-            m=re.search("^# gitosis-identity: *([^\<]+)? *(?:\<([^\>, ]*)\>)?",userdata)
-            if m:
-                os.environ['GITOSIS_NAME'] = m.group(1).strip()
-                os.environ['GITOSIS_EMAIL'] = m.group(2)
-            else:
-                m=re.search("^# gitosis-name: *(.*)$", userdata)
-                if m:
-                    os.environ['GITOSIS_NAME'] = m.group(1).strip()
-                m=re.search("^# gitosis-email: *<?(.*)>?$", userdata)
-                if m:
-                    os.environ['GITOSIS_EMAIL'] = m.group(1).strip()
+        os.environ.update(identity.lookup(cfg, user))
+        self.timer.note('user', user)
+        self.timer.mark('identity')
 
         cmd = os.environ.get('SSH_ORIGINAL_COMMAND', None)
         if cmd is None:
@@ -230,17 +390,86 @@ class Main(app.App):
 
         os.chdir(os.path.expanduser('~'))
 
+        request = {}
         try:
             newcmd = serve(
                 cfg=cfg,
                 user=user,
                 command=cmd,
+                timer=self.timer,
+                request=request,
                 )
         except ServingError, e:
+            self.timer.note('decision', 'deny: %s' % e)
+            timing.record(timing.log_path(cfg), self.timer)
             main_log.error('%s', e)
             sys.exit(1)
 
-        main_log.debug('Serving %s', newcmd)
-        os.execvp('git', ['git', 'shell', '-c', newcmd])
-        main_log.error('Cannot execute git-shell.')
+        self.timer.note('decision', 'allow')
+        self.audit = (audit.settings(cfg), user, request)
+        self.negotiate(protocol.policy(cfg, request), timing.log_path(cfg))
+        self.admit(admission.parameters(cfg, user, request),
+                   timing.log_path(cfg))
+        self.record_audit()
+        self.limit(resources.parameters(cfg, user, request))
+        packcache.install(packcache.hook(cfg, request), os.environ)
+        timing.record(timing.log_path(cfg), self.timer)
+        self.execute(command_argv(cfg, request, newcmd))
+
+    def negotiate(self, policy, timing_log): #pragma: no cover
+        """Apply the protocol `policy` to the environment git runs with,
+        see :func:`gitosis.protocol.apply`, or give up."""
+        try:
+            protocol.apply(policy, os.environ)
+        except protocol.VersionRequired, e:
+            self.timer.note('decision', 'deny: %s' % e)
+            self.record_audit(audit.DENIED, reason=str(e))
+            timing.record(timing_log, self.timer)
+            main_log = logging.getLogger('gitosis.serve.main')
+            main_log.error('%s', e)
+            sys.exit(1)
+
+    def admit(self, params, timing_log): #pragma: no cover
+        """Wait for the concurrency limits in `params`, see
+        :func:`gitosis.admission.admit`, or give up."""
+        if params is None:
+            return
+        try:
+            admission.admit(**params)
+        except admission.Busy, e:
+            self.timer.mark('admission')
+            self.timer.note('decision', 'busy: %s' % e)
+            self.record_audit(audit.BUSY, reason=str(e))
+            timing.record(timing_log, self.timer)
+            main_log = logging.getLogger('gitosis.serve.main')
+            main_log.error('%s', e)
+            sys.exit(1)
+        self.timer.mark('admission')
+
+    def record_audit(self, decision=None, **fields): #pragma: no cover
+        """Log `decision` on the request in the audit log, or that it
+        was let through, see :func:`gitosis.audit.record_request`."""
+        if self.audit is None:
+            return
+        (settings, user, request) = self.audit
+        audit.record_request(settings, user, request, decision, **fields)
+
+    def limit(self, params): #pragma: no cover
+        """Apply the resource class in `params` to this process, and
+        so to git, see :func:`gitosis.resources.apply`."""
+        if params is None:
+            return
+        resources.apply(**params)
+        self.timer.mark('resources')
+
+    def execute(self, argv): #pragma: no cover
+        """Replace this process with git running `argv`, see
+        :func:`command_argv`."""
+        main_log = logging.getLogger('gitosis.serve.main')
+        main_log.debug('Serving %r', argv)
+        try:
+            os.execvp(argv[0], argv)
+        except OSError:
+            pass
+        main_log.error('Cannot execute %s.', ' '.join(argv[:2]))
         sys.exit(1)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.shedding
+    ~~~~~~~~~~~~~~~~
+
+    This module implements load shedding: turning away fetches of low
+    priority users, such as CI bots, while the host is overloaded, so
+    pushes and everybody else still get through::
+
+        [gitosis]
+        ## overloaded above this 1 minute load average
+        shed-loadavg = 16
+        ## or below this many MiB of available memory
+        shed-min-memory = 512
+        ## wait up to this many seconds for the load to go down
+        ## before turning requests away, 0 by default
+        shed-delay = 10
+        ## and tell them to come back after this many seconds
+        shed-retry-after = 60
+
+        [group ci]
+        members = bot1 bot2
+        priority = low
+
+    Like other group settings, the first group of a user setting a
+    ``priority`` decides. The load average and available memory are read
+    from ``/proc`` only for low priority fetches, a couple of
+    microseconds each.
+
+    :license: GPL
+"""
+
+import os
+import time
+
+from gitosis import access
+
+#: Where the kernel tells about the load of the host.
+PROC = '/proc'
+
+#: Default for ``shed-retry-after``.
+RETRY_AFTER = 60
+
+
+def _float(config, option):
+    value = config.get('gitosis', option)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _read(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 65536)
+    finally:
+        os.close(fd)
+
+
+def loadavg(proc=PROC):
+    """Returns the 1 minute load average."""
+    return float(_read(os.path.join(proc, 'loadavg')).split(None, 1)[0])
+
+
+def available_memory(proc=PROC):
+    """Returns the memory available for new processes, in kiB."""
+    data = _read(os.path.join(proc, 'meminfo'))
+    # kernels before 3.14 don't estimate it themselves
+    fields = ('MemAvailable',)
+    if '\nMemAvailable:' not in data:
+        fields = ('MemFree', 'Buffers', 'Cached')
+    total = 0
+    for name in fields:
+        start = data.find('\n%s:' % name)
+        if start >= 0:
+            start += len(name) + 2
+            total += int(data[start:data.index('\n', start)].split()[0])
+    return total
+
+
+def low_priority(config, user):
+    """Returns whether requests of `user` are shed first."""
+    for group in access.get_acl(config).membership(user):
+        priority = config.get('group %s' % group, 'priority')
+        if priority is not None:
+            return priority == 'low'
+    return False
+
+
+def overloaded(config, proc=PROC):
+    """Returns whether the host is over the thresholds of `config`."""
+    max_load = _float(config, 'shed-loadavg')
+    if max_load is not None and loadavg(proc) > max_load:
+        return True
+    min_memory = _float(config, 'shed-min-memory')
+    if min_memory is not None \
+            and available_memory(proc) < min_memory * 1024:
+        return True
+    return False
+
+
+def enabled(config):
+    """Returns whether `config` sets any threshold."""
+    return config.get('gitosis', 'shed-loadavg') is not None \
+        or config.get('gitosis', 'shed-min-memory') is not None
+
+
+def check(config, user, proc=None, clock=time.time, sleep=time.sleep):
+    """Decide on a fetch of `user`.
+
+    Returns ``None`` to let it through, or the seconds after which to
+    retry if it is turned away.
+    """
+    if not low_priority(config, user):
+        return None
+    if proc is None:
+        proc = PROC
+    try:
+        if not overloaded(config, proc):
+            return None
+        delay = _float(config, 'shed-delay') or 0
+        deadline = clock() + delay
+        while clock() < deadline:
+            sleep(min(1.0, deadline - clock()))
+            if not overloaded(config, proc):
+                return None
+    except (IOError, OSError, ValueError, IndexError):
+        # can't tell, so don't get in the way
+        return None
+    retry_after = _float(config, 'shed-retry-after')
+    if retry_after is None:
+        retry_after = RETRY_AFTER
+    return int(retry_after)
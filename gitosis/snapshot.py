@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.snapshot
+    ~~~~~~~~~~~~~~~~
+
+    This module implements a precompiled snapshot of ``gitosis.conf``,
+    written by the ``post-update`` hook and read by ``gitosis-serve``.
+
+    Besides the raw config sections, a snapshot holds everything
+    :func:`gitosis.access.allowed` needs as ready-made lookup tables:
+    the transitive group membership of every user, the repository
+    patterns granted to every group per mode as compiled tries (see
+    :mod:`gitosis.pattern`), ``map`` entries and repository prefixes.
+    Restoring it is a single :mod:`marshal` load instead of parsing the
+    config and walking group sections on every connection.
+
+    A snapshot is tied to the config file it was compiled from and is
+    ignored as soon as that file is replaced or modified.
+
+    :license: GPL
+"""
+
+import logging
+import marshal
+import os
+
+from gitosis import access
+from gitosis import group as _group
+from gitosis import pattern as _pattern
+
+log = logging.getLogger("gitosis.snapshot")
+
+#: Format marker, bump whenever the layout of the snapshot changes.
+MAGIC = "gitosis-snapshot 2"
+
+
+def path_for(config_path):
+    """Returns the snapshot location for the config at `config_path`."""
+    return os.path.realpath(config_path) + ".snapshot"
+
+
+def stamp(config_path):
+    """Returns a value that changes whenever `config_path` does."""
+    st = os.stat(config_path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+
+def members(config):
+    """Returns the users named in the ``members`` of any group."""
+    users = set()
+    for section in config.sections():
+        if section.startswith("group "):
+            users.update(member for member
+                         in config.get(section, "members", "").split()
+                         if not member.startswith("@"))
+    return users
+
+
+def build_tables(config):
+    """Compile the access tables for `config` into marshallable data."""
+    grants = {}
+    maps = {}
+    prefixes = {}
+    owners = {}
+
+    for section in config.sections():
+        kind, _, name = section.partition(" ")
+        if kind == "repo":
+            owner = config.get(section, "owner")
+            if owner:
+                owners[name] = owner
+        elif kind == "group":
+            for mode in access.MODES:
+                repos = config.get(section, mode, default="").split()
+                if repos:
+                    grants[name, mode] = _pattern.PatternSet(repos).state
+            for option in config.options(section):
+                if option.startswith("map "):
+                    maps[name, option] = config.get(section, option)
+            prefixes[name] = access.get_repository_prefix(config, name)
+
+    membership = dict(
+        (user, tuple(_group.getMembership(config=config, user=user)))
+        for user in members(config))
+    # membership of anybody not listed explicitly only depends on @all
+    default = tuple(_group.getMembership(config=config, user=None))
+
+    return dict(
+        membership=membership,
+        default=default,
+        grants=grants,
+        maps=maps,
+        prefixes=prefixes,
+        prefix=access.get_repository_prefix(config),
+        owners=owners,
+        )
+
+
+class Snapshot(object):
+    """Precompiled access data, see :class:`gitosis.access.ConfigACL`."""
+
+    def __init__(self, tables, frozen=None):
+        self._membership = tables["membership"]
+        self._default = tables["default"]
+        self._grants = tables["grants"]
+        self._maps = tables["maps"]
+        self._prefixes = tables["prefixes"]
+        self._prefix = tables["prefix"]
+        self._owners = tables["owners"]
+        #: Config contents, see :meth:`GitosisRawConfigParser.freeze`
+        self.frozen = frozen
+
+    def owner(self, path):
+        return self._owners.get(path)
+
+    def users(self):
+        """Returns the users named in the ``members`` of any group."""
+        return self._membership.keys()
+
+    def membership(self, user):
+        return self._membership.get(user, self._default)
+
+    def patterns(self, group, mode):
+        return _pattern.PatternSet(state=self._grants.get((group, mode)))
+
+    def mapping(self, group, mode, path):
+        # option names are stored lowercased, like ConfigParser does
+        key = "map {0} {1}".format(mode, path).lower()
+        return self._maps.get((group, key))
+
+    def prefix(self, group=None):
+        if group is None:
+            return self._prefix
+        return self._prefixes.get(group, self._prefix)
+
+
+def write(config, config_path):
+    """Compile `config`, read from `config_path`, and store the result
+    next to it.
+    """
+    path = path_for(config_path)
+    data = marshal.dumps((MAGIC, stamp(config_path), config.freeze(),
+                          build_tables(config)))
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    fp = file(tmp, "wb")
+    try:
+        fp.write(data)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+    log.debug("Wrote snapshot of {0!r} to {1!r}".format(config_path, path))
+
+
+def load(config_path):
+    """Returns the :class:`Snapshot` for the config at `config_path`, or
+    ``None`` if it is missing, unreadable or stale.
+    """
+    try:
+        current = stamp(config_path)
+        fp = file(path_for(config_path), "rb")
+    except (IOError, OSError):
+        return None
+    try:
+        try:
+            magic, source, frozen, tables = marshal.loads(fp.read())
+        except (EOFError, ValueError, TypeError):
+            log.warning("Ignoring corrupt snapshot for {0!r}"
+                        .format(config_path))
+            return None
+    finally:
+        fp.close()
+
+    if magic != MAGIC or source != current:
+        log.debug("Snapshot for {0!r} is stale".format(config_path))
+        return None
+    return Snapshot(tables, frozen=frozen)
+
+
+def restore(config, config_path):
+    """Fill `config` from the snapshot of `config_path`.
+
+    Returns ``False`` if there is no usable snapshot, in which case the
+    config file has to be parsed the usual way.
+    """
+    snapshot = load(config_path)
+    if snapshot is None:
+        return False
+    config.thaw(snapshot.frozen)
+    config.snapshot = snapshot
+    return True
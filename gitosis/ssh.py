@@ -3,59 +3,183 @@ Gitosis code to handle SSH authorized_keys files
 """
 import os, errno, re
 import logging
+import marshal
+from cStringIO import StringIO
+from gitosis import identity
 from gitosis import sshkey
 
 # C0103 - 'log' is a special name
 # pylint: disable-msg=C0103
 log = logging.getLogger('gitosis.ssh')
 
-def readKeys(keydir):
+#: Format marker of the parsed key cache, bump whenever its layout or
+#: what :func:`gitosis.sshkey.explode_ssh_key` returns changes.
+CACHE_MAGIC = 'gitosis-keys-cache 1'
+
+# with fewer key files to parse, starting the processes takes longer
+_MIN_POOL = 64
+
+def _parseKeyFile(data):
+    """
+    Parse the contents ``data`` of a key file.
+
+    Returns the environment its first line sets, see
+    :func:`gitosis.identity.parse`, and for each key, whether it parsed
+    and the parts of the key, or the arguments of the
+    :class:`~gitosis.sshkey.MalformedSSHKey` raised.
+    """
+    env = {}
+    entries = []
+    first = True
+    for line in StringIO(data):
+        if first:
+            env = identity.parse(line)
+        first = False
+        line = line.rstrip('\n')
+        if line.startswith('#'):
+            continue
+        line = line.strip()
+        if len(line) > 0:
+            try:
+                entries.append((True, sshkey.explode_ssh_key(line)))
+            except sshkey.MalformedSSHKey as e:
+                entries.append((False, e.args))
+    return (env, entries)
+
+def _parseKeyFiles(contents, jobs=None):
+    """
+    Parse all ``contents`` with :func:`_parseKeyFile`, in a pool of
+    ``jobs`` processes if there are many.
+    """
+    import multiprocessing
+
+    if len(contents) < _MIN_POOL:
+        jobs = 1
+    elif jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1:
+        return [_parseKeyFile(data) for data in contents]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(_parseKeyFile, contents)
+    finally:
+        pool.close()
+        pool.join()
+
+def _readKeyCache(path):
+    try:
+        fp = file(path, 'rb')
+    except IOError:
+        return {}
+    try:
+        try:
+            (magic, parsed) = marshal.load(fp)
+        except (EOFError, ValueError, TypeError):
+            log.warning('Ignoring unreadable key cache %r', path)
+            return {}
+    finally:
+        fp.close()
+    if magic != CACHE_MAGIC:
+        return {}
+    return parsed
+
+def _writeKeyCache(path, parsed):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = file(tmp, 'wb')
+    try:
+        marshal.dump((CACHE_MAGIC, parsed), fp)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+
+def readKeys(keydir, identities=None, cache=None, jobs=None):
     """
     Read SSH public keys from ``keydir/*.pub``
+
+    If ``identities`` is given, the identity found in each key file is
+    stored there under the user name, see :func:`gitosis.identity.parse`.
+
+    If ``cache`` is given, the keys parsed are kept in that file, by name,
+    size and hash of the key file, and only the key files changed since
+    are parsed again, in a pool of ``jobs`` processes, one per CPU by
+    default, if there are many.
     """
+    import hashlib
+
+    files = []
     for filename in os.listdir(keydir):
         if filename.startswith('.'):
             continue
         basename, ext = os.path.splitext(filename)
         if ext != '.pub':
             continue
+        files.append((filename, basename))
 
+    stored = {}
+    if cache is not None:
+        stored = _readKeyCache(cache)
+    parsed = {}
+    changed = []
+    for (filename, basename) in files:
         if not sshkey.isSafeUsername(basename):
-            log.warn('Unsafe SSH username in keyfile: %r', filename)
             continue
+        fp = file(os.path.join(keydir, filename))
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        stamp = (len(data), hashlib.sha1(data).hexdigest())
+        entry = stored.get(filename)
+        if entry is not None and entry[0] == stamp:
+            parsed[filename] = entry
+        else:
+            changed.append((filename, stamp, data))
+    results = _parseKeyFiles([data for (_, _, data) in changed], jobs)
+    for ((filename, stamp, _), (env, entries)) in zip(changed, results):
+        parsed[filename] = (stamp, env, entries)
+    if cache is not None and (changed or len(parsed) != len(stored)):
+        _writeKeyCache(cache, parsed)
 
-        path = os.path.join(keydir, filename)
-        fp = file(path)
-        for line in fp:
-            line = line.rstrip('\n')
-            if line.startswith('#'):
-                continue
-            line = line.strip()
-            if len(line) > 0:
-                try:
-                    yield (basename, sshkey.get_ssh_pubkey(line))
-                except sshkey.MalformedSSHKey as e:
-                    log.warn('Malformed SSH key in %r: %r', filename, e);
-        fp.close()
+    # warn in the same order as when reading the files one by one
+    for (filename, basename) in files:
+        if not sshkey.isSafeUsername(basename):
+            log.warn('Unsafe SSH username in keyfile: %r', filename)
+            continue
+        (_, env, entries) = parsed[filename]
+        if env and identities is not None:
+            identities[basename] = dict(env)
+        for (ok, parts) in entries:
+            if ok:
+                yield (basename, sshkey.make_ssh_pubkey(*parts))
+            else:
+                e = sshkey.MalformedSSHKey(*parts)
+                log.warn('Malformed SSH key in %r: %r', filename, e);
 
 COMMENT = '### autogenerated by gitosis, DO NOT EDIT'
 SSH_KEY_ACCEPTED_OPTIONS = ['from']
+SERVE_OPTIONS = ('command="gitosis-serve %(user)s",no-port-forwarding,'
+                 +'no-X11-forwarding,no-agent-forwarding,no-pty')
 
-def generateAuthorizedKeys(keys):
+def authorizedKeysLine(user, key):
     """
-    Genarate the lines for the Gitosis ~/.ssh/authorized_keys.
+    Generate the ~/.ssh/authorized_keys line letting ``user`` in with ``key``.
     """
     TEMPLATE = ('%(options)s %(key)s %(comment)s')
-    OPTIONS = ('command="gitosis-serve %(user)s",no-port-forwarding,'
-               +'no-X11-forwarding,no-agent-forwarding,no-pty')
 
+    options = SERVE_OPTIONS % dict(user=user, )
+    for k in SSH_KEY_ACCEPTED_OPTIONS:
+        if k in key.options:
+            options += (',%s="%s"' % (k, key.options[k]))
+    return TEMPLATE % dict(user=user, key=key.key, comment=key.comment, options=options)
+
+def generateAuthorizedKeys(keys):
+    """
+    Genarate the lines for the Gitosis ~/.ssh/authorized_keys.
+    """
     yield COMMENT
     for (user, key) in keys:
-        options = OPTIONS % dict(user=user, )
-        for k in SSH_KEY_ACCEPTED_OPTIONS:
-            if k in key.options:
-                options += (',%s="%s"' % (k, key.options[k]))
-        yield TEMPLATE % dict(user=user, key=key.key, comment=key.comment, options=options)
+        yield authorizedKeysLine(user, key)
 
 _GITOSIS_CMD_RE = '(/[^ "]+/)?gitosis-serve [^ "]+$'
 _COMMAND_RE = re.compile(_GITOSIS_CMD_RE)
@@ -80,9 +204,13 @@ def filterAuthorizedKeys(fp):
             pass
         yield line
 
-def writeAuthorizedKeys(path, keydir):
+def writeAuthorizedKeys(path, keydir, identities=None, keys=None):
     """
     Update the Gitosis ~/.ssh/authorized_keys for the new Gitosis SSH key data.
+
+    ``identities`` is passed on to :func:`readKeys`. If ``keys`` are
+    given, as :func:`readKeys` generates them, they are written instead
+    of those in ``keydir``.
     """
     tmp = '%s.%d.tmp' % (path, os.getpid())
     try:
@@ -100,7 +228,10 @@ def writeAuthorizedKeys(path, keydir):
                 for line in filterAuthorizedKeys(in_):
                     print >> out, line
 
-            keygen = readKeys(keydir)
+            if keys is None:
+                keygen = readKeys(keydir, identities)
+            else:
+                keygen = keys
             for line in generateAuthorizedKeys(keygen):
                 print >> out, line
 
@@ -2,8 +2,6 @@
 Gitosis code to intelligently handle SSH public keys.
 
 """
-from shlex import shlex
-from StringIO import StringIO
 import re
 
 # The 'ecc' and 'ecdh' types are speculative, based on the Internet Draft
@@ -12,7 +10,13 @@ SSH_KEY_PROTO2_TYPES = ['ssh-dsa',
                         'ssh-dss',
                         'ssh-ecc', 
                         'ssh-ecdh',
-                        'ssh-rsa']
+                        'ssh-rsa',
+                        'ssh-ed25519',
+                        'ecdsa-sha2-nistp256',
+                        'ecdsa-sha2-nistp384',
+                        'ecdsa-sha2-nistp521',
+                        'sk-ecdsa-sha2-nistp256@openssh.com',
+                        'sk-ssh-ed25519@openssh.com']
 
 # These options must not have arguments
 SSH_KEY_OPTS = ['no-agent-forwarding', 
@@ -26,7 +30,7 @@ SSH_KEY_OPTS_WITH_ARGS = ['command',
                           'permitopen', 
                           'tunnel' ]
 
-class MalformedSSHKey(Exception):
+class MalformedSSHKey(ValueError):
     """Malformed SSH public key"""
 
 class InsecureSSHKeyUsername(Exception):
@@ -34,8 +38,10 @@ class InsecureSSHKeyUsername(Exception):
     def __str__(self):
         return '%s: %s' % (self.__doc__, ': '.join(self.args))
 
-class SSHPublicKey:
+class SSHPublicKey(object):
     """Base class for representing an SSH public key"""
+    __slots__ = ('_options', '_comment', '_username')
+
     def __init__(self, opts, keydata, comment):
         """Create a new instance."""
         self._options = opts
@@ -95,6 +101,8 @@ class SSHPublicKey:
 
 class SSH1PublicKey(SSHPublicKey):
     """Class for representing an SSH public key, protocol version 1"""
+    __slots__ = ('_key_bits', '_key_exponent', '_key_modulus')
+
     def __init__(self, opts, keydata, comment):
         """Create a new instance."""
         SSHPublicKey.__init__(self, opts, keydata, comment)
@@ -110,6 +118,8 @@ class SSH1PublicKey(SSHPublicKey):
 
 class SSH2PublicKey(SSHPublicKey):
     """Class for representing an SSH public key, protocol version 2"""
+    __slots__ = ('_key_prefix', '_key_base64')
+
     def __init__(self, opts, keydata, comment):
         """Create a new instance."""
         SSHPublicKey.__init__(self, opts, keydata, comment)
@@ -121,13 +131,110 @@ class SSH2PublicKey(SSHPublicKey):
 
 def get_ssh_pubkey(line):
     """Take an SSH public key, and return an object representing it."""
-    (opts, keydata, comment) = _explode_ssh_key(line)
-    if keydata.startswith('ssh-'):
+    (opts, keydata, comment) = explode_ssh_key(line)
+    return make_ssh_pubkey(opts, keydata, comment)
+
+def make_ssh_pubkey(opts, keydata, comment):
+    """
+    Return an object representing the SSH public key of the parts
+    :func:`explode_ssh_key` returns.
+    """
+    if keydata[:1].isdigit():
+        return SSH1PublicKey(opts, keydata, comment)
+    else:
         return SSH2PublicKey(opts, keydata, comment)
+
+# Characters splitting the options and the fields of the key
+_SEPARATORS = ' \t\r\n,'
+# Runs of characters without any special meaning, outside quotes
+_PLAIN_RE = re.compile(r'''[^ \t\r\n,#'"\\]+''')
+# The same, in the comment, where nothing separates
+_PLAIN_COMMENT_RE = re.compile(r'''[^#'"\\]+''')
+# The same, within double quotes
+_DOUBLE_QUOTED_RE = re.compile(r'[^"\\]+')
+
+def _skip_comment(line, pos):
+    """Skip the ``#`` comment at ``pos``, up to the end of its line."""
+    newline = line.find('\n', pos)
+    if newline < 0:
+        return len(line)
+    return newline + 1
+
+def _double_quoted(line, pos, parts):
+    """
+    Add the contents of the double quotes opened before ``pos`` to
+    ``parts``, returning the position after the closing quote.
+    """
+    end = len(line)
+    while True:
+        if pos >= end:
+            raise MalformedSSHKey("No closing quotation")
+        char = line[pos]
+        if char == '"':
+            return pos + 1
+        if char == '\\':
+            if pos + 1 >= end:
+                raise MalformedSSHKey("No escaped character")
+            char = line[pos + 1]
+            # only the quote and the backslash itself are escaped
+            if char != '"' and char != '\\':
+                parts.append('\\')
+            parts.append(char)
+            pos += 2
+        else:
+            match = _DOUBLE_QUOTED_RE.match(line, pos)
+            parts.append(match.group())
+            pos = match.end()
+
+def _next_token(line, pos, separators, plain):
+    """
+    Read the token of ``line`` at ``pos``, split on ``separators``, the
+    way a POSIX ``shlex`` splitting on whitespace with ``#`` comments
+    does: quotes are removed, backslashes escape, and a ``#`` ends the
+    token and the line.
+
+    Returns the token, or ``None`` at the end, and the position after it.
+    """
+    end = len(line)
+    while pos < end:
+        char = line[pos]
+        if char in separators:
+            pos += 1
+        elif char == '#':
+            pos = _skip_comment(line, pos)
+        else:
+            break
     else:
-        return SSH1PublicKey(opts, keydata, comment)
+        return (None, pos)
+    parts = []
+    while pos < end:
+        char = line[pos]
+        if char in separators:
+            pos += 1
+            break
+        elif char == '#':
+            pos = _skip_comment(line, pos)
+            break
+        elif char == "'":
+            close = line.find("'", pos + 1)
+            if close < 0:
+                raise MalformedSSHKey("No closing quotation")
+            parts.append(line[pos + 1:close])
+            pos = close + 1
+        elif char == '"':
+            pos = _double_quoted(line, pos + 1, parts)
+        elif char == '\\':
+            if pos + 1 >= end:
+                raise MalformedSSHKey("No escaped character")
+            parts.append(line[pos + 1])
+            pos += 2
+        else:
+            match = plain.match(line, pos)
+            parts.append(match.group())
+            pos = match.end()
+    return (''.join(parts), pos)
 
-def _explode_ssh_key(line):
+def explode_ssh_key(line):
     """
     Break apart a public-key line correct.
     - Protocol 1 public keys consist of: 
@@ -141,28 +248,21 @@ def _explode_ssh_key(line):
     Seperately return the options, key data and comment.
     """
     opts = {}
-    shl = shlex(StringIO(line.strip()), None, True)
-    shl.wordchars += '-'
-    # Treat ',' as whitespace seperation the options
-    shl.whitespace += ','
-    shl.whitespace_split = 1
+    line = line.strip()
+    pos = 0
     # Handle the options first
-    keydata = None
-    def _check_eof(tok):
-        """See if the end was nigh."""
-        if tok == shl.eof:
-            raise MalformedSSHKey("Unexpected end of key")
     while True:
-        tok = shl.get_token()
-        _check_eof(tok)
+        (tok, pos) = _next_token(line, pos, _SEPARATORS, _PLAIN_RE)
+        if tok is None:
+            raise MalformedSSHKey("Unexpected end of key")
         # This is the start of the actual key, protocol 1
         if tok.isdigit():
-            keydata = tok
+            keydata = [tok]
             expected_key_args = 2
             break
         # This is the start of the actual key, protocol 2
         if tok in SSH_KEY_PROTO2_TYPES:
-            keydata = tok
+            keydata = [tok]
             expected_key_args = 1
             break
         if tok in SSH_KEY_OPTS:
@@ -177,21 +277,20 @@ def _explode_ssh_key(line):
     # Now handle the key
     # Protocol 2 keys have only 1 argument besides the type
     # Protocol 1 keys have 2 arguments after the bit-count.
-    shl.whitespace_split = 1
     while expected_key_args > 0:
-        _ = shl.get_token()
-        _check_eof(_)
-        keydata += ' '+_
+        (tok, pos) = _next_token(line, pos, _SEPARATORS, _PLAIN_RE)
+        if tok is None:
+            raise MalformedSSHKey("Unexpected end of key")
+        keydata.append(tok)
         expected_key_args -= 1
     # Everything that remains is a comment
-    comment = ''
-    shl.whitespace = ''
+    comment = []
     while True:
-        _ = shl.get_token()
-        if _ == shl.eof or _ == None:
+        (tok, pos) = _next_token(line, pos, '', _PLAIN_COMMENT_RE)
+        if tok is None:
             break
-        comment += _
-    return (opts, keydata, comment)
+        comment.append(tok)
+    return (opts, ' '.join(keydata), ''.join(comment))
 
 _ACCEPTABLE_USER_RE = re.compile(
         r'^[a-zA-Z][a-zA-Z0-9_.-]*(@[a-zA-Z][a-zA-Z0-9.-]*)?$'
@@ -0,0 +1,71 @@
+"""
+The ``shlex`` based parser :mod:`gitosis.sshkey` used before, kept as
+the reference its tokenizer is tested against.
+"""
+from shlex import shlex
+from StringIO import StringIO
+
+from gitosis.sshkey import MalformedSSHKey, SSH_KEY_OPTS, \
+    SSH_KEY_OPTS_WITH_ARGS
+
+# the types it knew
+SSH_KEY_PROTO2_TYPES = ['ssh-dsa',
+                        'ssh-dss',
+                        'ssh-ecc',
+                        'ssh-ecdh',
+                        'ssh-rsa']
+
+def explode_ssh_key(line):
+    """Like :func:`gitosis.sshkey.explode_ssh_key`."""
+    opts = {}
+    shl = shlex(StringIO(line.strip()), None, True)
+    shl.wordchars += '-'
+    # Treat ',' as whitespace seperation the options
+    shl.whitespace += ','
+    shl.whitespace_split = 1
+    # Handle the options first
+    keydata = None
+    def _check_eof(tok):
+        """See if the end was nigh."""
+        if tok == shl.eof:
+            raise MalformedSSHKey("Unexpected end of key")
+    while True:
+        tok = shl.get_token()
+        _check_eof(tok)
+        # This is the start of the actual key, protocol 1
+        if tok.isdigit():
+            keydata = tok
+            expected_key_args = 2
+            break
+        # This is the start of the actual key, protocol 2
+        if tok in SSH_KEY_PROTO2_TYPES:
+            keydata = tok
+            expected_key_args = 1
+            break
+        if tok in SSH_KEY_OPTS:
+            opts[tok] = None
+            continue
+        if '=' in tok:
+            (tok, _) = tok.split('=', 1)
+            if tok in SSH_KEY_OPTS_WITH_ARGS:
+                opts[tok] = _
+                continue
+        raise MalformedSSHKey("Unknown fragment %r" % (tok, ))
+    # Now handle the key
+    # Protocol 2 keys have only 1 argument besides the type
+    # Protocol 1 keys have 2 arguments after the bit-count.
+    shl.whitespace_split = 1
+    while expected_key_args > 0:
+        _ = shl.get_token()
+        _check_eof(_)
+        keydata += ' '+_
+        expected_key_args -= 1
+    # Everything that remains is a comment
+    comment = ''
+    shl.whitespace = ''
+    while True:
+        _ = shl.get_token()
+        if _ == shl.eof or _ == None:
+            break
+        comment += _
+    return (opts, keydata, comment)
@@ -186,3 +186,96 @@ def test_owner_full_access():
     assert access.allowed(cfg,
         user="jdoe", mode="readable", path="foo/bar") == ("repositories", "foo/bar")
 
+
+
+def test_resolve_none():
+    cfg = GitosisRawConfigParser()
+    assert access.resolve(cfg, user="jdoe", path="foo/bar") is None
+
+
+def test_resolve_strongest():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("group a-readers")
+    cfg.set("group a-readers", "members", "jdoe")
+    cfg.set("group a-readers", "readonly", "foo/bar")
+    cfg.add_section("group b-writers")
+    cfg.set("group b-writers", "members", "jdoe")
+    cfg.set("group b-writers", "repositories", "elsewhere")
+    cfg.set("group b-writers", "writable", "foo/bar")
+
+    assert access.resolve(cfg, user="jdoe", path="foo/bar.git") \
+        == ("writable", "elsewhere", "foo/bar")
+
+
+def test_resolve_first_group_wins():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("group a-readers")
+    cfg.set("group a-readers", "members", "jdoe")
+    cfg.set("group a-readers", "map readonly foo/bar", "quux/thud")
+    cfg.add_section("group b-readers")
+    cfg.set("group b-readers", "members", "jdoe")
+    cfg.set("group b-readers", "readonly", "foo/bar")
+
+    assert access.resolve(cfg, user="jdoe", path="foo/bar") \
+        == ("readonly", "repositories", "quux/thud")
+
+
+def test_resolve_typo():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "members", "jdoe")
+    cfg.set("group fooers", "writeable", "foo/*")
+
+    assert access.resolve(cfg, user="jdoe", path="foo/bar") \
+        == ("writeable", "repositories", "foo/bar")
+
+
+def test_resolve_owner():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("repo foo/bar")
+    cfg.set("repo foo/bar", "owner", "jdoe")
+
+    assert access.resolve(cfg, user="jdoe", path="foo/bar") \
+        == ("writable", "repositories", "foo/bar")
+
+
+def test_resolve_matches_allowed():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("group a")
+    cfg.set("group a", "members", "jdoe @b")
+    cfg.set("group a", "readonly", "foo/bar baz")
+    cfg.set("group a", "map writable quux", "thud")
+    cfg.add_section("group b")
+    cfg.set("group b", "members", "wsmith")
+    cfg.set("group b", "repositories", "elsewhere")
+    cfg.set("group b", "writeable", "baz foo/*")
+    cfg.add_section("group c")
+    cfg.set("group c", "members", "@all")
+    cfg.set("group c", "writable", "baz")
+
+    for user in ("jdoe", "wsmith", "nobody"):
+        for path in ("foo/bar", "foo/xyzzy", "baz", "quux", "missing"):
+            expected = None
+            for mode in access.MODES:
+                got = access.allowed(cfg, user=user, mode=mode, path=path)
+                if got is not None:
+                    expected = (mode,) + got
+                    break
+            assert access.resolve(cfg, user=user, path=path) == expected, \
+                (user, path)
+
+
+def test_write_yes_deep_wildcard():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "members", "jdoe")
+    cfg.set("group fooers", "writable", "team/** proj-?")
+
+    assert access.allowed(cfg,
+        user="jdoe", mode="writable", path="team/a/b") == ("repositories", "team/a/b")
+    assert access.allowed(cfg,
+        user="jdoe", mode="writable", path="proj-x.git") == ("repositories", "proj-x")
+    assert access.allowed(cfg,
+        user="jdoe", mode="writable", path="proj-xy") is None
+    assert access.allowed(cfg,
+        user="jdoe", mode="writable", path="team") is None
@@ -0,0 +1,171 @@
+from nose.tools import eq_ as eq
+from gitosis.test.util import assert_raises
+
+import os
+from cStringIO import StringIO
+
+from gitosis import admission
+from gitosis import serve
+from gitosis.test.util import makeConfig, maketemp
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+max-concurrent-push = 3
+max-concurrent-wait = 5
+max-concurrent-queue = 2
+
+[repo huge]
+max-concurrent-fetch = 4
+
+[group devs]
+members = jdoe bot
+writable = huge small
+
+[group ci]
+members = bot
+max-concurrent-fetch = 2
+"""
+
+def _parameters(cfg, user, command):
+    request = {}
+    serve.serve(cfg=cfg, user=user, command=command, request=request)
+    return admission.parameters(cfg, user, request)
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+    def time(self):
+        return self.now
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def _admit(lockdir, limits, **kwargs):
+    clock = _Clock()
+    kwargs.setdefault('stderr', StringIO())
+    admission.admit(lockdir, limits, clock=clock.time, sleep=clock.sleep,
+                    **kwargs)
+    return clock
+
+def teardown():
+    admission.release()
+
+def test_parameters_repo():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['huge', 'small'])
+    got = _parameters(cfg, 'jdoe', "git-upload-pack 'huge'")
+    path = os.path.join(tmp, 'repositories', 'huge.git')
+    eq(got, dict(
+            lockdir=os.path.join(tmp, 'locks'),
+            limits=[('repo-fetch-%s' % path.replace('/', '%2F'), 4)],
+            wait=5,
+            queue=2,
+            ))
+
+def test_parameters_default():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['huge', 'small'])
+    got = _parameters(cfg, 'jdoe', "git-receive-pack 'small'")
+    eq([(name.split('-')[:2], count) for (name, count) in got['limits']],
+       [(['repo', 'push'], 3)])
+
+def test_parameters_user():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['huge', 'small'])
+    got = _parameters(cfg, 'bot', "git-upload-pack 'small'")
+    eq(got['limits'], [('user-fetch-bot', 2)])
+    got = _parameters(cfg, 'bot', "git-upload-pack 'huge'")
+    eq([count for (_, count) in got['limits']], [4, 2])
+
+def test_parameters_unlimited():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['huge', 'small'])
+    eq(_parameters(cfg, 'jdoe', "git-upload-pack 'small'"), None)
+
+def test_admit():
+    tmp = maketemp()
+    lockdir = os.path.join(tmp, 'locks')
+    try:
+        _admit(lockdir, [('a', 2)])
+        _admit(lockdir, [('a', 2)])
+        e = assert_raises(admission.Busy, _admit, lockdir, [('a', 2)])
+        eq(str(e), 'Too many requests running, try again later')
+        admission.release()
+        _admit(lockdir, [('a', 2)])
+    finally:
+        admission.release()
+
+def test_admit_all_or_nothing():
+    tmp = maketemp()
+    lockdir = os.path.join(tmp, 'locks')
+    try:
+        _admit(lockdir, [('b', 1)])
+        assert_raises(admission.Busy, _admit, lockdir, [('a', 1), ('b', 1)])
+        # the slot of 'a' was given back
+        _admit(lockdir, [('a', 1)])
+    finally:
+        admission.release()
+
+def test_admit_timeout():
+    tmp = maketemp()
+    lockdir = os.path.join(tmp, 'locks')
+    try:
+        _admit(lockdir, [('a', 1)])
+        stderr = StringIO()
+        clock = _Clock()
+        e = assert_raises(admission.Busy, admission.admit, lockdir,
+                          [('a', 1)], wait=3, queue=1, stderr=stderr,
+                          clock=clock.time, sleep=clock.sleep)
+        eq(str(e), 'Too many requests running, gave up after 3 seconds')
+        eq(stderr.getvalue(), 'gitosis: too many requests running,'
+           ' waiting up to 3 seconds...\n')
+        eq(sum(clock.sleeps), 3)
+        eq(clock.sleeps[:3], [0.05, 0.1, 0.2])
+        assert max(clock.sleeps) <= 1.0
+    finally:
+        admission.release()
+
+def test_admit_queue_full():
+    tmp = maketemp()
+    lockdir = os.path.join(tmp, 'locks')
+    try:
+        _admit(lockdir, [('a', 1)])
+        # somebody else is waiting already
+        place = admission._lock_one(lockdir, 'queue-a', 1)
+        try:
+            e = assert_raises(admission.Busy, _admit, lockdir, [('a', 1)],
+                              wait=3, queue=1)
+            eq(str(e), 'Too many requests running, too many waiting,'
+               ' try again later')
+        finally:
+            os.close(place)
+    finally:
+        admission.release()
+
+def test_admit_after_wait():
+    tmp = maketemp()
+    lockdir = os.path.join(tmp, 'locks')
+    os.mkdir(lockdir)
+    fd = admission._lock_one(lockdir, 'a', 1)
+    def sleep(seconds):
+        # the running request finishes while we wait
+        os.close(fd)
+    try:
+        admission.admit(lockdir, [('a', 1)], wait=3, queue=1,
+                        stderr=StringIO(), sleep=sleep)
+        eq(len(admission._held), 1)
+    finally:
+        admission.release()
+
+def test_long_names():
+    tmp = maketemp()
+    lockdir = os.path.join(tmp, 'locks')
+    try:
+        _admit(lockdir, [('x' * 300, 1)])
+        _admit(lockdir, [('x' * 299 + 'y', 1)])
+    finally:
+        admission.release()
+    assert all(len(name) < 255 for name in os.listdir(lockdir))
@@ -0,0 +1,193 @@
+from nose.tools import eq_ as eq
+from gitosis.test.util import assert_raises
+
+import os
+import subprocess
+import sys
+from cStringIO import StringIO
+
+from gitosis import archive
+from gitosis import packcache
+from gitosis import repository
+from gitosis import serve
+from gitosis.test.test_protocol import FAKE_SSH
+from gitosis.test.util import makeConfig, maketemp, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+archive-cache = %(cache)s
+archive-cache-size = 2
+
+[group devs]
+members = jdoe
+readonly = foo secret
+
+[repo secret]
+archive-cache = no
+"""
+
+def _argv(cfg, command):
+    request = {}
+    newcmd = serve.serve(cfg=cfg, user='jdoe', command=command,
+                         request=request)
+    return serve.command_argv(cfg, request, newcmd)
+
+def test_command_argv():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'secret'], cache='yes')
+    eq(_argv(cfg, "git-upload-archive 'foo'"),
+       ['gitosis-upload-archive', '--cache=%s/archive-cache' % tmp,
+        '--max-size=2097152', '%s/repositories/foo.git' % tmp])
+    eq(_argv(cfg, "git-upload-pack 'foo'")[:2], ['git', 'shell'])
+    eq(_argv(cfg, "git upload-archive 'secret'")[:2], ['git', 'shell'])
+    cfg.set('gitosis', 'archive-cache', 'no')
+    eq(_argv(cfg, "git-upload-archive 'foo'")[:2], ['git', 'shell'])
+
+def test_read_arguments():
+    fp = StringIO(archive.pkt_line('argument --format=tar\n')
+                  + archive.pkt_line('argument HEAD')
+                  + archive.FLUSH + 'rest')
+    eq(archive.read_arguments(fp), ['--format=tar', 'HEAD'])
+    eq(fp.read(), 'rest')
+
+def test_read_arguments_bad():
+    for data in ['', '00', 'zzzz', '0003',
+                 archive.pkt_line('argument HEAD'),
+                 archive.pkt_line('HEAD') + archive.FLUSH,
+                 archive.pkt_line('argument x') * 64 + archive.FLUSH]:
+        assert_raises(archive.ProtocolError, archive.read_arguments,
+                      StringIO(data))
+
+def test_treeish_index():
+    eq(archive.treeish_index(['HEAD']), 0)
+    eq(archive.treeish_index(['--format=tar', '-9', 'v1.0', 'src']), 2)
+    eq(archive.treeish_index(['--format', 'zip', '--prefix', 'p/', 'v1']),
+       4)
+    eq(archive.treeish_index(['-v', '--', '-odd']), 2)
+    eq(archive.treeish_index(['--format=tar']), None)
+    eq(archive.treeish_index(['--list']), None)
+    eq(archive.treeish_index(['-l', 'HEAD']), None)
+
+def _repository(tmp):
+    git_dir = os.path.join(tmp, 'repositories', 'foo.git')
+    os.makedirs(os.path.dirname(git_dir))
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Reverse the polarity of the neutron flow.\n',
+        files=[('foo', 'content'), ('sub/bar', 'more content')],
+        )
+    subprocess.check_call(['git', '--git-dir=%s' % git_dir,
+                           '-c', 'user.name=John Doe',
+                           '-c', 'user.email=jdoe@example.com',
+                           'tag', '-a', '-m', 'Release', 'v1.0', 'master'],
+                          close_fds=True)
+    return git_dir
+
+def test_resolve():
+    tmp = maketemp()
+    git_dir = _repository(tmp)
+    def rev_parse(name):
+        return subprocess.Popen(
+            ['git', '--git-dir=%s' % git_dir, 'rev-parse', name],
+            stdout=subprocess.PIPE,
+            close_fds=True).communicate()[0].strip()
+    eq(archive.resolve(git_dir, 'v1.0'), rev_parse('master'))
+    eq(archive.resolve(git_dir, 'master:sub'), rev_parse('master:sub'))
+    eq(archive.resolve(git_dir, 'nosuch'), None)
+    eq(archive.resolve(git_dir, '--output=x'), None)
+
+def _setup(tmp, cache='yes'):
+    git_dir = _repository(tmp)
+    config = os.path.join(tmp, 'gitosis.conf')
+    writeFile(config, CONFIG % dict(tmp=tmp, cache=cache))
+    ssh = os.path.join(tmp, 'fake-ssh.py')
+    writeFile(ssh, FAKE_SSH)
+    # gitosis-upload-archive is not on the PATH of the tests
+    bindir = os.path.join(tmp, 'bin')
+    os.mkdir(bindir)
+    script = os.path.join(bindir, archive.COMMAND)
+    writeFile(script, '#!/bin/sh\nexec %s -c "from gitosis.archive'
+              ' import Main; Main.run()" "$@"\n' % sys.executable)
+    os.chmod(script, 0755)
+    env = dict(os.environ)
+    env.update(
+        PATH=os.pathsep.join([bindir, env.get('PATH', '')]),
+        PYTHONPATH=os.path.dirname(os.path.dirname(archive.__file__)),
+        HOME=tmp,
+        GIT_SSH_COMMAND='%s %s' % (sys.executable, ssh),
+        GIT_SSH_VARIANT='ssh',
+        FAKE_SSH_CONFIG=config,
+        )
+    return (git_dir, env)
+
+def _archive(tmp, env, *args):
+    """Returns the exit status, the archive and stderr of
+    ``git archive --remote``."""
+    child = subprocess.Popen(
+        args=['git', 'archive', '--remote=jdoe@server:foo'] + list(args),
+        cwd=tmp,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=True,
+        )
+    (out, err) = child.communicate()
+    return (child.returncode, out, err)
+
+def _local(git_dir, *args):
+    return subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir, 'archive'] + list(args),
+        stdout=subprocess.PIPE,
+        close_fds=True).communicate()[0]
+
+def test_upload_archive():
+    tmp = maketemp()
+    (git_dir, env) = _setup(tmp)
+    cache = os.path.join(tmp, 'archive-cache')
+    for args in [('--format=tar', 'v1.0'),
+                 ('--format=tar.gz', '--prefix=foo-1.0/', 'v1.0'),
+                 ('--format', 'zip', 'master', 'sub')]:
+        before = packcache.stats(cache)
+        for _ in range(2):
+            (status, out, err) = _archive(tmp, env, *args)
+            eq(status, 0, err)
+            eq(out, _local(git_dir, *args))
+        after = packcache.stats(cache)
+        eq((after['hits'] - before['hits'],
+            after['misses'] - before['misses']), (1, 1))
+
+def test_upload_archive_not_cached():
+    tmp = maketemp()
+    (git_dir, env) = _setup(tmp)
+    cache = os.path.join(tmp, 'archive-cache')
+    (status, out, err) = _archive(tmp, env, '--list')
+    eq((status, err), (0, ''))
+    assert 'tar\n' in out, out
+    (status, out, err) = _archive(tmp, env, '--format=tar', 'nosuch')
+    assert status != 0
+    assert 'no such ref' in err, err
+    eq(packcache.stats(cache), dict(hits=0, misses=0))
+
+def test_upload_archive_unreachable():
+    tmp = maketemp()
+    (git_dir, env) = _setup(tmp)
+    cache = os.path.join(tmp, 'archive-cache')
+    commit = archive.resolve(git_dir, 'master')
+    # git upload-archive only archives refs, the cache must not change
+    # that
+    for _ in range(2):
+        (status, out, err) = _archive(tmp, env, '--format=tar', commit)
+        assert status != 0
+    eq(packcache.stats(cache), dict(hits=0, misses=2))
+
+def test_upload_archive_disabled():
+    tmp = maketemp()
+    (git_dir, env) = _setup(tmp, cache='no')
+    (status, out, err) = _archive(tmp, env, '--format=tar', 'v1.0')
+    eq(status, 0, err)
+    eq(out, _local(git_dir, '--format=tar', 'v1.0'))
+    assert not os.path.exists(os.path.join(tmp, 'archive-cache'))
@@ -0,0 +1,192 @@
+from nose.tools import eq_ as eq
+
+import json
+import optparse
+import os
+
+from gitosis import audit
+from gitosis import serve
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import makeConfig, maketemp, readFile, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+audit-log = %(tmp)s/audit.log
+
+[group devs]
+members = jdoe
+writable = foo
+readonly = bar
+"""
+
+def _records(path):
+    return [json.loads(line) for line in readFile(path).splitlines()]
+
+def _options(**kwargs):
+    options = optparse.Values(dict(user=None, decision=None, verb=None,
+                                   repo=None, since=None, until=None))
+    options._update_loose(kwargs)
+    return options
+
+def test_format_record():
+    line = audit.format_record(dict(time=1.5, user='jdoe', pid=7,
+                                    reason='a "quoted"\n\\ \xe9'))
+    assert line.startswith('{"time": 1.500, ')
+    assert line.endswith('}\n')
+    eq(line.count('\n'), 1)
+    eq(json.loads(line), dict(time=1.5, user='jdoe', pid=7,
+                              reason=u'a "quoted"\n\\ \xe9'))
+
+def test_format_record_roundtrip():
+    record = dict(time=1.5, user='jdoe', reason='\xe9\x01')
+    line = audit.format_record(record)
+    eq(audit.format_record(json.loads(line)), line)
+
+def test_record_disabled():
+    cfg = RawConfigParser()
+    audit.record(cfg, 'jdoe', audit.GRANTED, verb='git-upload-pack')
+
+def test_serve_granted():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'bar'])
+    request = {}
+    serve.serve(cfg=cfg, user='jdoe', command="git-receive-pack 'foo'",
+                request=request)
+    # logged by whoever runs git, once it got through admission
+    assert not os.path.exists(os.path.join(tmp, 'audit.log'))
+    audit.record_request(audit.settings(cfg), 'jdoe', request)
+    (got,) = _records(os.path.join(tmp, 'audit.log'))
+    eq(got['decision'], 'granted')
+    eq(got['user'], 'jdoe')
+    eq(got['verb'], 'git-receive-pack')
+    eq(got['repo'], 'foo')
+    eq(got['mode'], 'writable')
+    eq(got['pid'], os.getpid())
+    assert 'command' not in got
+
+def test_record_request_busy():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'bar'])
+    request = {}
+    serve.serve(cfg=cfg, user='jdoe', command="git-upload-pack 'foo'",
+                request=request)
+    audit.record_request(audit.settings(cfg), 'jdoe', request, audit.BUSY,
+                         reason='Server busy')
+    (got,) = _records(os.path.join(tmp, 'audit.log'))
+    eq(got['decision'], 'busy')
+    eq(got['reason'], 'Server busy')
+    eq(got['repo'], 'foo')
+
+def test_settings():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'bar'])
+    eq(audit.settings(cfg),
+       dict(path=os.path.join(tmp, 'audit.log'), size=audit.ROTATE_SIZE,
+            interval=0))
+    cfg.set('gitosis', 'audit-rotate-size', 'lots')
+    eq(audit.settings(cfg), None)
+    eq(audit.settings(RawConfigParser()), None)
+
+def test_serve_denied():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'bar'])
+    for command in ["git-receive-pack 'bar'", "git-upload-pack 'nope'",
+                    "evil"]:
+        try:
+            serve.serve(cfg=cfg, user='jdoe', command=command)
+        except serve.ServingError:
+            pass
+        else:
+            raise AssertionError('%r should be denied' % command)
+    (write, read, unknown) = _records(os.path.join(tmp, 'audit.log'))
+    eq(write['decision'], 'denied')
+    eq(write['reason'], 'Repository write access denied')
+    eq(write['mode'], 'readonly')
+    eq(read['reason'], 'Repository read access denied')
+    eq(read['repo'], 'nope')
+    eq(unknown['reason'], 'Unknown command denied')
+    eq(unknown['command'], 'evil')
+    assert 'repo' not in unknown
+
+def test_serve_created():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'bar'])
+    cfg.set('group devs', 'writable', 'foo new')
+    request = {}
+    serve.serve(cfg=cfg, user='jdoe', command="git-receive-pack 'new'",
+                request=request)
+    audit.record_request(audit.settings(cfg), 'jdoe', request)
+    (got,) = _records(os.path.join(tmp, 'audit.log'))
+    eq(got['decision'], 'created')
+    eq(got['repo'], 'new')
+    assert 'created' not in got
+
+def test_rotate_size():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'audit.log')
+    audit.append(path, 'x' * 10 + '\n', size=20)
+    audit.append(path, 'y' * 10 + '\n', size=20)
+    eq(audit.log_files(path), [path])
+    audit.append(path, 'z\n', size=20)
+    files = audit.log_files(path)
+    eq(len(files), 2)
+    eq(readFile(files[0]), 'x' * 10 + '\n' + 'y' * 10 + '\n')
+    eq(readFile(files[1]), 'z\n')
+
+def test_rotate_interval():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'audit.log')
+    audit.append(path, 'a\n', interval=3600)
+    mtime = os.stat(path).st_mtime
+    audit.append(path, 'b\n', now=mtime, interval=3600)
+    eq(audit.log_files(path), [path])
+    audit.append(path, 'c\n', now=mtime + 3600, interval=3600)
+    files = audit.log_files(path)
+    eq([readFile(name) for name in files], ['a\nb\n', 'c\n'])
+
+def test_log_files_order():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'audit.log')
+    for name in ['audit.log', 'audit.log.20120102000000.5',
+                 'audit.log.20120101000000.9', 'audit.log.junk',
+                 'other.log.20120101000000.1']:
+        writeFile(os.path.join(tmp, name), '')
+    eq(audit.log_files(path),
+       [os.path.join(tmp, 'audit.log.20120101000000.9'),
+        os.path.join(tmp, 'audit.log.20120102000000.5'),
+        path])
+
+def test_read_since():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'audit.log')
+    # a rotated log that ended before --since is not even opened,
+    # whatever it contains
+    writeFile(os.path.join(tmp, 'audit.log.19700101000100.1'),
+              audit.format_record(dict(time=500.0, user='old')))
+    writeFile(path, ''.join([
+                audit.format_record(dict(time=50.0, user='a')),
+                audit.format_record(dict(time=150.0, user='b')),
+                'garbage\n',
+                ]))
+    got = list(audit.read(audit.log_files(path), since=100))
+    eq(got, [dict(time=150.0, user='b')])
+
+def test_parse_time():
+    eq(audit.parse_time('1350000000'), 1350000000.0)
+    eq(audit.parse_time('1970-01-02'), 86400.0)
+    eq(audit.parse_time('1970-01-01T01:00'), 3600.0)
+    eq(audit.parse_time('1970-01-01T00:00:30'), 30.0)
+
+def test_matches():
+    record = dict(time=10.0, user='jdoe', decision='denied',
+                  verb='git-upload-pack', repo='team/foo')
+    assert audit.matches(record, _options())
+    assert audit.matches(record, _options(user='jdoe', repo='team/*'))
+    assert not audit.matches(record, _options(user='wsmith'))
+    assert not audit.matches(record, _options(repo='other/*'))
+    assert not audit.matches(record, _options(decision='granted'))
+    assert not audit.matches(record, _options(until=10.0))
+    assert audit.matches(dict(time=1.0, user='x', command='evil'),
+                         _options(until=10.0))
@@ -0,0 +1,171 @@
+from nose.tools import eq_ as eq
+
+import os
+import socket
+import threading
+
+from gitosis import authd
+from gitosis import serve
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import maketemp, mkdir, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s
+generate-files-in = %(tmp)s
+
+[group devs]
+members = jdoe
+writable = foo
+"""
+
+def _setup(tmp, config=CONFIG):
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, config % dict(tmp=tmp))
+    mkdir(os.path.join(tmp, 'foo.git'))
+    mkdir(os.path.join(tmp, 'bar.git'))
+    def load():
+        cfg = RawConfigParser()
+        cfg.read(path)
+        return cfg
+    return path, authd.Authorizer(config_path=path, load=load)
+
+def _serving(authorizer, tmp):
+    path = os.path.join(tmp, 'authd.sock')
+    server = authd.Server(path, authorizer)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return path, server
+
+def _stop(server):
+    server.shutdown()
+    server.server_close()
+
+def test_decide_allowed():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    eq(authorizer.decide('jdoe', "git-upload-pack 'foo'"),
+       dict(command="git-upload-pack '%s/foo.git'" % tmp,
+            argv=['git', 'shell', '-c',
+                  "git-upload-pack '%s/foo.git'" % tmp],
+            env={}))
+
+def test_decide_denied():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    eq(authorizer.decide('jdoe', "git-upload-pack 'bar'"),
+       dict(error='Repository read access denied'))
+    eq(authorizer.decide('jdoe', "evil"),
+       dict(error='Unknown command denied'))
+
+def test_decide_identity():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    keydir = os.path.join(tmp, 'gitosis-admin.git', 'gitosis-export',
+                          'keydir')
+    os.makedirs(keydir)
+    writeFile(os.path.join(keydir, 'jdoe.pub'),
+              '# gitosis-identity: John Doe <jdoe@example.com>\n')
+    eq(authorizer.decide('jdoe', "git-upload-pack 'foo'")['env'],
+       dict(GITOSIS_NAME='John Doe', GITOSIS_EMAIL='jdoe@example.com'))
+
+def test_decide_resources():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp, CONFIG + '''\
+resources = batch
+
+[resources batch]
+nice = 10
+''')
+    eq(authorizer.decide('jdoe', "git-upload-pack 'foo'")['resources'],
+       dict(nice=10))
+
+def test_decide_protocol():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp, CONFIG + '''\
+[repo foo]
+protocol = force-v2
+''')
+    eq(authorizer.decide('jdoe', "git-upload-pack 'foo'")['protocol'],
+       'force-v2')
+
+def test_reload_on_change():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    first = authorizer.config()
+    assert authorizer.config() is first
+    writeFile(path, (CONFIG + 'readonly = bar\n') % dict(tmp=tmp))
+    assert authorizer.config() is not first
+    eq(authorizer.decide('jdoe', "git-upload-pack 'bar'")['command'],
+       "git-upload-pack '%s/bar.git'" % tmp)
+
+def test_ask_missing():
+    tmp = maketemp()
+    eq(serve.ask_authd(os.path.join(tmp, 'nothing.sock'),
+                       'jdoe', "git-upload-pack 'foo'"),
+       None)
+
+def test_ask():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    sock, server = _serving(authorizer, tmp)
+    try:
+        eq(serve.ask_authd(sock, 'jdoe', "git-upload-pack 'foo'"),
+           dict(command="git-upload-pack '%s/foo.git'" % tmp,
+            argv=['git', 'shell', '-c',
+                  "git-upload-pack '%s/foo.git'" % tmp],
+            env={}))
+        eq(serve.ask_authd(sock, 'jdoe', "git-receive-pack 'bar'"),
+           dict(error='Repository read access denied'))
+    finally:
+        _stop(server)
+
+def test_socket_private():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    sock, server = _serving(authorizer, tmp)
+    try:
+        eq(os.stat(sock).st_mode & 0077, 0)
+    finally:
+        _stop(server)
+
+def test_malformed_request():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp)
+    sock, server = _serving(authorizer, tmp)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(sock)
+        client.sendall('garbage')
+        client.shutdown(socket.SHUT_WR)
+        eq(client.recv(1024), '')
+        client.close()
+    finally:
+        _stop(server)
+
+def test_decide_timing():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp, CONFIG.replace(
+            '[gitosis]\n', '[gitosis]\ntiming-log = %(tmp)s/timing.log\n'))
+    got = authorizer.decide('jdoe', "git-upload-pack 'foo'")
+    eq(got['timing-log'], '%s/timing.log' % tmp)
+    eq(got['fields'], dict(user='jdoe', verb='git-upload-pack', repo='foo',
+                           decision='allow'))
+    eq([name for (name, _) in got['phases']],
+       ['command', 'access', 'exists', 'identity'])
+
+def test_decide_audit():
+    tmp = maketemp()
+    path, authorizer = _setup(tmp, CONFIG.replace(
+            '[gitosis]\n', '[gitosis]\naudit-log = %(tmp)s/audit.log\n'))
+    got = authorizer.decide('jdoe', "git-upload-pack 'foo'")
+    # gitosis-serve logs the grant, after admission
+    eq(got['audit'], dict(path='%s/audit.log' % tmp,
+                          size=104857600, interval=0))
+    eq(got['request'], dict(verb='git-upload-pack', repo='foo',
+                            mode='writable', path='%s/foo.git' % tmp))
+    assert not os.path.exists(os.path.join(tmp, 'audit.log'))
+    got = authorizer.decide('jdoe', "git-upload-pack 'bar'")
+    assert 'audit' not in got
+    assert os.path.exists(os.path.join(tmp, 'audit.log'))
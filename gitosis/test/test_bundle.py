@@ -0,0 +1,165 @@
+from nose.tools import eq_ as eq
+
+import os
+import subprocess
+
+from gitosis import bundle
+from gitosis import repository
+from gitosis.test.util import makeConfig, maketemp, readFile, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+bundle = yes
+
+[repo tiny]
+bundle = no
+"""
+
+def _commit(git_dir, content, parent=False):
+    if parent:
+        parent = subprocess.Popen(
+            ['git', '--git-dir=%s' % git_dir, 'rev-parse', 'master'],
+            stdout=subprocess.PIPE, close_fds=True).communicate()[0].strip()
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Reverse the polarity of the neutron flow.\n',
+        files=[('foo', content)],
+        parent=parent or None,
+        )
+
+def _repository(tmp, name):
+    git_dir = os.path.join(tmp, 'repositories', '%s.git' % name)
+    if not os.path.isdir(os.path.dirname(git_dir)):
+        os.makedirs(os.path.dirname(git_dir))
+    repository.init(path=git_dir)
+    _commit(git_dir, 'content')
+    return git_dir
+
+def _unbundle(tmp, path):
+    """Fetch the bundles of `path` into a new repository, as listed,
+    returning its refs."""
+    git_dir = os.path.join(tmp, 'unbundled.git')
+    repository.init(path=git_dir)
+    list_file = os.path.join(path, 'bundle-list')
+    uris = subprocess.Popen(
+        ['git', 'config', '--file=%s' % list_file, '--get-regexp',
+         r'^bundle\..*\.uri$'],
+        stdout=subprocess.PIPE, close_fds=True).communicate()[0]
+    for line in uris.splitlines():
+        uri = line.split(' ', 1)[1]
+        subprocess.check_call(
+            ['git', '--git-dir=%s' % git_dir, 'fetch', '-q',
+             os.path.join(path, uri), 'refs/*:refs/*'],
+            close_fds=True)
+    refs = bundle.read_refs(git_dir)
+    subprocess.check_call(['rm', '-rf', git_dir])
+    return refs
+
+def test_bundles():
+    tmp = maketemp()
+    eq(bundle.bundles(os.path.join(tmp, 'missing')), [])
+    for name in ['20-incremental.bundle', '10-full.bundle', 'refs',
+                 '30-full.bundle.tmp-1', 'x-full.bundle',
+                 '30-other.bundle']:
+        writeFile(os.path.join(tmp, name), '')
+    eq(bundle.bundles(tmp), [(10, 'full'), (20, 'incremental')])
+
+def test_bundle_list():
+    eq(bundle.bundle_list([(10, 'full'), (20, 'incremental')]), """\
+[bundle]
+\tversion = 1
+\tmode = all
+\theuristic = creationToken
+[bundle "10-full"]
+\turi = 10-full.bundle
+\tcreationToken = 10
+[bundle "20-incremental"]
+\turi = 20-incremental.bundle
+\tcreationToken = 20
+""")
+
+def test_refresh():
+    tmp = maketemp()
+    git_dir = _repository(tmp, 'foo')
+    path = os.path.join(tmp, 'bundles', 'foo')
+    eq(bundle.refresh(git_dir, path, now=100), 'full')
+    eq(bundle.bundles(path), [(100, 'full')])
+    eq(_unbundle(tmp, path), bundle.read_refs(git_dir))
+    # nothing changed
+    eq(bundle.refresh(git_dir, path, now=200), None)
+
+    [(_, first)] = bundle.read_refs(git_dir)
+    _commit(git_dir, 'more', parent=True)
+    # within the same second
+    eq(bundle.refresh(git_dir, path, now=100), 'incremental')
+    eq(bundle.bundles(path), [(100, 'full'), (101, 'incremental')])
+    eq(_unbundle(tmp, path), bundle.read_refs(git_dir))
+    # it needs what the full bundle has
+    header = readFile(os.path.join(path, '101-incremental.bundle'))
+    assert '\n-%s ' % first in header.split('\n\n', 1)[0]
+    eq(readFile(os.path.join(path, 'refs')),
+       ''.join('%s %s\n' % ref for ref in bundle.read_refs(git_dir)))
+
+def test_refresh_max_incremental():
+    tmp = maketemp()
+    git_dir = _repository(tmp, 'foo')
+    path = os.path.join(tmp, 'bundles', 'foo')
+    eq(bundle.refresh(git_dir, path, max_incremental=1, now=100), 'full')
+    _commit(git_dir, 'more', parent=True)
+    eq(bundle.refresh(git_dir, path, max_incremental=1, now=200),
+       'incremental')
+    _commit(git_dir, 'even more', parent=True)
+    eq(bundle.refresh(git_dir, path, max_incremental=1, now=300), 'full')
+    eq(sorted(name for name in os.listdir(path)
+              if name.endswith('.bundle')),
+       ['300-full.bundle'])
+    eq(_unbundle(tmp, path), bundle.read_refs(git_dir))
+
+def test_refresh_deleted_ref():
+    tmp = maketemp()
+    git_dir = _repository(tmp, 'foo')
+    subprocess.check_call(['git', '--git-dir=%s' % git_dir, 'branch',
+                           'topic', 'master'], close_fds=True)
+    path = os.path.join(tmp, 'bundles', 'foo')
+    eq(bundle.refresh(git_dir, path, now=100), 'full')
+    subprocess.check_call(['git', '--git-dir=%s' % git_dir, 'branch',
+                           '-D', 'topic'], stdout=subprocess.PIPE,
+                          close_fds=True)
+    # nothing new to bundle
+    eq(bundle.refresh(git_dir, path, now=200), None)
+    eq(bundle.bundles(path), [(100, 'full')])
+    eq(bundle.refresh(git_dir, path, now=300), None)
+
+def test_refresh_empty():
+    tmp = maketemp()
+    git_dir = os.path.join(tmp, 'foo.git')
+    repository.init(path=git_dir)
+    path = os.path.join(tmp, 'bundles', 'foo')
+    eq(bundle.refresh(git_dir, path), None)
+    assert not os.path.exists(path)
+
+def test_refresh_all():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    for name in ['foo', 'sub/bar', 'tiny']:
+        _repository(tmp, name)
+    eq(list(bundle.repositories(cfg)), ['foo', 'tiny', 'sub/bar'])
+    eq(bundle.refresh_all(cfg, jobs=2), 0)
+    store = os.path.join(tmp, 'bundles')
+    eq(sorted(os.listdir(store)), ['foo', 'sub'])
+    for name in ['foo', 'sub/bar']:
+        eq(len(bundle.bundles(os.path.join(store, name))), 1)
+    cfg.set('gitosis', 'bundle-dir', os.path.join(tmp, 'elsewhere'))
+    eq(bundle.refresh_all(cfg, names=['tiny']), 0)
+    eq(os.listdir(os.path.join(tmp, 'elsewhere')), ['tiny'])
+
+def test_refresh_all_failed():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    _repository(tmp, 'foo')
+    os.makedirs(os.path.join(tmp, 'repositories', 'broken.git'))
+    eq(bundle.refresh_all(cfg, jobs=1), 1)
+    eq(len(bundle.bundles(os.path.join(tmp, 'bundles', 'foo'))), 1)
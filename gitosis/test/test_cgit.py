@@ -0,0 +1,116 @@
+from nose.tools import eq_ as eq
+
+import os
+
+from gitosis import cgit
+from gitosis.test.util import makeConfig, mkdir, maketemp, readFile, \
+    writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+cgit = yes
+
+[repo bar]
+readme = README
+
+[repo foo]
+readme = README
+
+[repo quux]
+readme = README
+"""
+
+def test_update_missing():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repos.list')
+    repositories = os.path.join(tmp, 'repositories')
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    cgit.update_project_list(cfg, path, 'foo')
+    eq(readFile(path), '''\
+repo.url=foo.git
+repo.name=foo
+repo.path=%(repositories)s/foo.git
+repo.readme=README
+
+''' % dict(repositories=repositories))
+
+def test_update():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repos.list')
+    repositories = os.path.join(tmp, 'repositories')
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    # other blocks are kept as they are, without checking the disk
+    writeFile(path, '''\
+repo.url=bar.git
+repo.name=bar
+repo.desc=kept verbatim
+
+repo.url=quux.git
+repo.name=quux
+
+''')
+    cgit.update_project_list(cfg, path, 'foo')
+    eq(readFile(path), '''\
+repo.url=bar.git
+repo.name=bar
+repo.desc=kept verbatim
+
+repo.url=foo.git
+repo.name=foo
+repo.path=%(repositories)s/foo.git
+repo.readme=README
+
+repo.url=quux.git
+repo.name=quux
+
+''' % dict(repositories=repositories))
+
+def test_update_same_as_generate():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repos.list')
+    repositories = os.path.join(tmp, 'repositories')
+    cfg = makeConfig(tmp, CONFIG, ['bar', 'quux'])
+    cfg.set('repo bar', 'cgit_group', 'Group')
+    cfg.set('repo quux', 'cgit_group', 'Group')
+    cgit.generate_project_list(cfg, path)
+    mkdir(os.path.join(repositories, 'foo.git'))
+    cgit.update_project_list(cfg, path, 'foo')
+    updated = readFile(path)
+    cgit.generate_project_list(cfg, path)
+    eq(updated, readFile(path))
+
+def test_update_grouped():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repos.list')
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    cfg.set('repo bar', 'cgit_group', 'Group')
+    cfg.set('repo quux', 'cgit_group', 'Group')
+    # bar and quux are not on disk, they can only be kept as they are;
+    # the section header may start the block of the first one
+    writeFile(path, '''\
+section=Group
+repo.url=bar.git
+repo.name=bar
+repo.desc=kept verbatim
+
+repo.url=quux.git
+repo.name=quux
+
+''')
+    cgit.update_project_list(cfg, path, 'foo')
+    updated = readFile(path)
+    assert '''\
+section=Group
+
+repo.url=bar.git
+repo.name=bar
+repo.desc=kept verbatim
+
+repo.url=quux.git
+repo.name=quux
+
+''' in updated, updated
+    assert 'repo.url=foo.git\n' in updated, updated
+    cgit.update_project_list(cfg, path, 'foo')
+    eq(readFile(path), updated)
@@ -53,3 +53,15 @@ def test_generated_files_dir_cfg_set():
     cfg.set("gitosis", "generate-files-in", "foobar")
 
     assert cfg.generated_files_dir == "foobar"
+
+
+def test_sections_order_follows_changes():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("repo foo")
+    cfg.add_section("group b")
+    assert cfg.sections() == ["group b", "repo foo"]
+    cfg.add_section("gitosis")
+    cfg.add_section("group a")
+    assert cfg.sections() == ["gitosis", "group a", "group b", "repo foo"]
+    cfg.remove_section("group b")
+    assert cfg.sections() == ["gitosis", "group a", "repo foo"]
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+
+from nose.tools import eq_ as eq
+
+from gitosis import gitconfig
+from gitosis import repository
+from gitosis.config import GitosisRawConfigParser
+from gitosis.test.util import assert_raises, makeConfig, maketemp, readFile, \
+    writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s
+gitconfig.uploadpack.allowFilter = true
+hide-refs = refs/pipelines
+
+[group ci]
+writable = huge team/*
+gitconfig.pack.threads = 2
+hide-refs = refs/changes
+
+[group devs]
+writable = small
+gitconfig.pack.threads = 4
+
+[repo huge]
+gitconfig.core.bigFileThreshold = 16m
+gitconfig.uploadpack.allowFilter = false
+"""
+
+SAMPLE = """\
+# a comment
+[core]
+\trepositoryformatversion = 0
+\tbare = true ; trailing comment
+\tflag
+[remote "Origin"]
+\turl = "/some where" # comment
+\tfetch = +refs/heads/*:refs/remotes/origin/*
+[Section.Sub] key = va"lu"e
+[multi]
+\tlong = a\\
+b \\"c\\" \\t\\\\
+\tspaced = x   y
+"""
+
+
+def _git_get_all(path, key):
+    child = subprocess.Popen(
+        args=["git", "config", "--file", path, "--get-all", key],
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    return child.communicate()[0].splitlines()
+
+
+def test_split_key():
+    eq(gitconfig.split_key("core.bigFileThreshold"),
+       ("core", None, "bigfilethreshold"))
+    eq(gitconfig.split_key("Remote.Origin.URL"), ("remote", "Origin", "url"))
+    eq(gitconfig.split_key("url.a.b.insteadOf"), ("url", "a.b", "insteadof"))
+    assert_raises(gitconfig.ConfigError, gitconfig.split_key, "core")
+
+
+def test_parse():
+    got = gitconfig.ConfigFile(SAMPLE)
+    eq(got.text(), SAMPLE)
+    eq(got.get_all("core.bare"), ["true"])
+    eq(got.get_all("core.flag"), [None])
+    eq(got.get_all("remote.Origin.url"), ["/some where"])
+    eq(got.get_all("remote.origin.url"), [])
+    eq(got.get_all("section.sub.key"), ["value"])
+    eq(got.get_all("multi.long"), ['ab "c" \t\\'])
+    eq(got.get_all("multi.spaced"), ["x   y"])
+
+
+def test_parse_like_git():
+    tmp = maketemp()
+    path = os.path.join(tmp, "config")
+    writeFile(path, SAMPLE)
+    got = gitconfig.read(path)
+    for key in ["core.bare", "remote.Origin.url", "remote.Origin.fetch",
+                "section.sub.key", "multi.spaced"]:
+        eq(got.get_all(key), _git_get_all(path, key))
+
+
+def test_parse_invalid():
+    for text in ["key = value\n", "[core\n", '[remote "x]\n',
+                 "[core]\n\tkey = \"open\n", "[core]\n\t-key = x\n",
+                 "[core]\n\tkey = \\q\n"]:
+        assert_raises(gitconfig.ConfigError, gitconfig.ConfigFile, text)
+
+
+def test_read_missing():
+    tmp = maketemp()
+    eq(gitconfig.read(os.path.join(tmp, "config")).text(), "")
+
+
+def test_set_all_keeps_the_rest():
+    got = gitconfig.ConfigFile(SAMPLE)
+    got.set_all("core.bare", ["false"])
+    eq(got.text(), SAMPLE.replace(
+            "\tbare = true ; trailing comment\n", "\tbare = false\n"))
+
+
+def test_set_all_new_section():
+    got = gitconfig.ConfigFile("[core]\n\tbare = true")
+    got.set_all("uploadpack.hideRefs", ["refs/a", "!refs/a/b"])
+    got.set_all('remote.we"ird.url', ["x"])
+    got.set_all("core.flag", ["yes"])
+    eq(got.text(), """\
+[core]
+\tbare = true
+\tflag = yes
+[uploadpack]
+\thideRefs = refs/a
+\thideRefs = !refs/a/b
+[remote "we\\"ird"]
+\turl = x
+""")
+
+
+def test_set_all_remove():
+    got = gitconfig.ConfigFile(SAMPLE)
+    got.set_all("remote.Origin.fetch", [])
+    got.set_all("nothing.here", [])
+    got.set_all("section.sub.key", [])
+    eq(got.text(), SAMPLE.replace(
+            "\tfetch = +refs/heads/*:refs/remotes/origin/*\n", "").replace(
+            '[Section.Sub] key = va"lu"e\n', ''))
+
+
+def test_set_all_remove_keeps_comments():
+    got = gitconfig.ConfigFile(
+        "[pack]\n\tthreads = 2\n[core]\n\tbare = true\n"
+        "[pack]\n\tthreads = 4\n[gc]\n# why\n\tauto = 0\n")
+    got.set_all("pack.threads", [])
+    got.set_all("gc.auto", [])
+    eq(got.text(), "[core]\n\tbare = true\n[gc]\n# why\n")
+
+
+def test_quote_like_git():
+    tmp = maketemp()
+    path = os.path.join(tmp, "config")
+    values = [" leading", "trailing ", "a;b", "a#b", 'say "hi"',
+              "back\\slash", "tab\there", ""]
+    got = gitconfig.ConfigFile()
+    got.set_all("test.value", values)
+    writeFile(path, got.text())
+    eq(_git_get_all(path, "test.value"), values)
+    eq(gitconfig.read(path).get_all("test.value"), values)
+
+
+def test_wanted():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    eq(gitconfig.wanted(cfg, "huge"), {
+            "uploadpack.allowfilter": ["false"],
+            "pack.threads": ["2"],
+            "core.bigfilethreshold": ["16m"],
+            "uploadpack.hideRefs": ["refs/pipelines", "refs/changes"],
+            })
+    eq(gitconfig.wanted(cfg, "small"), {
+            "uploadpack.allowfilter": ["true"],
+            "pack.threads": ["4"],
+            "uploadpack.hideRefs": ["refs/pipelines"],
+            })
+
+
+def test_update():
+    tmp = maketemp()
+    path = os.path.join(tmp, "foo.git")
+    repository.init(path)
+    config = os.path.join(path, "config")
+    writeFile(config, readFile(config) + "[pack]\n\tthreads = 8\n")
+    writeFile(config, readFile(config) + "[gc]\n\tauto = 0\n")
+    values = {"pack.threads": ["2"], "uploadpack.hideRefs": ["refs/a"],
+              "gc.auto": []}
+    assert gitconfig.update(path, values)
+    eq(_git_get_all(config, "pack.threads"), ["2"])
+    eq(_git_get_all(config, "uploadpack.hideRefs"), ["refs/a"])
+    eq(_git_get_all(config, "core.bare"), ["true"])
+    # not written by gitosis
+    eq(_git_get_all(config, "gc.auto"), ["0"])
+    eq(_git_get_all(config, gitconfig.MANAGED),
+       ["pack.threads", "uploadpack.hideRefs"])
+    os.utime(config, (0, 0))
+    assert not gitconfig.update(path, values)
+    eq(os.stat(config).st_mtime, 0)
+    # written by gitosis, and not wanted any more
+    assert gitconfig.update(path, {"pack.threads": ["2"]})
+    eq(_git_get_all(config, "uploadpack.hideRefs"), [])
+    eq(_git_get_all(config, gitconfig.MANAGED), ["pack.threads"])
+    assert gitconfig.update(path, {})
+    eq(_git_get_all(config, "pack.threads"), [])
+    text = readFile(config)
+    for header in ["[pack]", "[uploadpack]", "[gitosis]"]:
+        assert header not in text, text
+
+
+def test_update_locked():
+    tmp = maketemp()
+    path = os.path.join(tmp, "foo.git")
+    repository.init(path)
+    config = os.path.join(path, "config")
+    before = readFile(config)
+    writeFile(config + ".lock", "")
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", tmp)
+    cfg.set("gitosis", "gitconfig.pack.threads", "2")
+    # logged, not raised
+    gitconfig.apply(cfg)
+    eq(readFile(config), before)
+
+
+def test_apply():
+    tmp = maketemp()
+    os.mkdir(os.path.join(tmp, "team"))
+    for name in ["huge", "small", "team/foo", "other"]:
+        repository.init(os.path.join(tmp, name + ".git"))
+    writeFile(os.path.join(tmp, "other.git", "config"),
+              readFile(os.path.join(tmp, "other.git", "config"))
+              + "[core]\n\tbigFileThreshold = 1m\n")
+    cfg = makeConfig(tmp, CONFIG)
+    gitconfig.apply(cfg)
+    def get(name, key):
+        return _git_get_all(os.path.join(tmp, name + ".git", "config"), key)
+    eq(get("huge", "uploadpack.hideRefs"),
+       ["refs/pipelines", "refs/changes"])
+    eq(get("huge", "core.bigFileThreshold"), ["16m"])
+    eq(get("team/foo", "pack.threads"), ["2"])
+    eq(get("small", "pack.threads"), ["4"])
+    eq(get("small", "uploadpack.hideRefs"), ["refs/pipelines"])
+    eq(get("other", "uploadpack.allowFilter"), ["true"])
+    # set by hand, not by gitosis
+    eq(get("other", "core.bigFileThreshold"), ["1m"])
+    eq(get("other", "pack.threads"), [])
+
+
+def test_apply_other_repository():
+    tmp = maketemp()
+    for name in ["foo", "bar"]:
+        repository.init(os.path.join(tmp, name + ".git"))
+    config = os.path.join(tmp, "foo.git", "config")
+    before = readFile(config) + "[pack]\n\tthreads = 8\n"
+    writeFile(config, before)
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", tmp)
+    cfg.add_section("repo bar")
+    cfg.set("repo bar", "gitconfig.pack.threads", "2")
+    gitconfig.apply(cfg)
+    eq(readFile(config), before)
+    eq(_git_get_all(os.path.join(tmp, "bar.git", "config"),
+                    "pack.threads"), ["2"])
+    cfg.remove_option("repo bar", "gitconfig.pack.threads")
+    gitconfig.apply(cfg)
+    eq(readFile(config), before)
+    text = readFile(os.path.join(tmp, "bar.git", "config"))
+    assert "[pack]" not in text, text
+    assert "[gitosis]" not in text, text
+
+
+def test_apply_repository():
+    tmp = maketemp()
+    repository.init(os.path.join(tmp, "small.git"))
+    cfg = makeConfig(tmp, CONFIG)
+    gitconfig.apply_repository(cfg, "small")
+    gitconfig.apply_repository(cfg, "missing")
+    eq(_git_get_all(os.path.join(tmp, "small.git", "config"),
+                    "pack.threads"), ["4"])
+    assert not os.path.exists(os.path.join(tmp, "missing.git"))
+
+
+def test_apply_hand_set_hide_refs():
+    tmp = maketemp()
+    for name in ["foo", "bar"]:
+        repository.init(os.path.join(tmp, name + ".git"))
+    config = os.path.join(tmp, "foo.git", "config")
+    before = (readFile(config)
+              + "[uploadpack]\n\thideRefs = refs/private\n")
+    writeFile(config, before)
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", tmp)
+    gitconfig.apply(cfg)
+    eq(readFile(config), before)
+    cfg.add_section("repo bar")
+    cfg.set("repo bar", "hide-refs", "refs/changes")
+    gitconfig.apply(cfg)
+    eq(readFile(config), before)
+    eq(_git_get_all(os.path.join(tmp, "bar.git", "config"),
+                    "uploadpack.hideRefs"), ["refs/changes"])
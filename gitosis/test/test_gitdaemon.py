@@ -171,3 +171,48 @@ def test_git_daemon_export_ok_allowed_global():
     assert exported(os.path.join(tmp, "foo.git"))
     assert exported(os.path.join(tmp, "quux.git"))
     assert not exported(os.path.join(tmp, "thud.git"))
+
+
+def test_git_daemon_export_repository_allowed():
+    tmp = maketemp()
+    path = os.path.join(tmp, "foo.git")
+    os.mkdir(path)
+    other = os.path.join(tmp, "bar.git")
+    os.mkdir(other)
+
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", tmp)
+    cfg.set("gitosis", "daemon", "yes")
+
+    gitdaemon.export_repository(cfg, "foo")
+    assert exported(path)
+    # nothing else is touched
+    assert not exported(other)
+
+
+def test_git_daemon_export_repository_denied():
+    tmp = maketemp()
+    path = os.path.join(tmp, "foo.git")
+    os.mkdir(path)
+    writeFile(gitdaemon.export_path(path), "")
+
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", tmp)
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "daemon", "no")
+
+    gitdaemon.export_repository(cfg, "foo")
+    assert not exported(path)
+
+
+def test_git_daemon_export_repository_missing():
+    tmp = maketemp()
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", tmp)
+    cfg.set("gitosis", "daemon", "yes")
+
+    gitdaemon.export_repository(cfg, "foo")
+    assert not os.path.exists(os.path.join(tmp, "foo.git"))
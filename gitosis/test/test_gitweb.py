@@ -242,3 +242,62 @@ def test_escape_filename_dollar():
 def test_escape_filename_quote():
     i = 'abc"'
     eq(gitweb._escape_filename(i), 'abc\\"')
+
+def test_projectsList_update_missing():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'projects.list')
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'gitweb', 'yes')
+    mkdir(os.path.join(tmp, 'foo.git'))
+    gitweb.update_project_list(config=cfg, path=path, name='foo')
+    eq(readFile(path), '''\
+foo.git
+''')
+
+def test_projectsList_update():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'projects.list')
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.set('gitosis', 'gitweb', 'yes')
+    cfg.add_section('repo bar')
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'owner', 'John Doe')
+    cfg.add_section('repo quux')
+    cfg.add_section('repo thud')
+    cfg.set('repo thud', 'gitweb', 'no')
+    mkdir(os.path.join(tmp, 'foo.git'))
+    # lines of other repositories are kept as they are, even if the
+    # repository does not exist on disk
+    writeFile(path, '''\
+bar.git Kept+Verbatim
+foo
+quux.git
+''')
+    gitweb.update_project_list(config=cfg, path=path, name='foo')
+    eq(readFile(path), '''\
+bar.git Kept+Verbatim
+foo.git John+Doe
+quux.git
+''')
+
+def test_description_single():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'foo.git')
+    mkdir(path)
+    other = os.path.join(tmp, 'bar.git')
+    mkdir(other)
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'description', 'foodesc')
+    cfg.add_section('repo bar')
+    cfg.set('repo bar', 'description', 'bardesc')
+    gitweb.set_description(config=cfg, name='foo')
+    eq(readFile(os.path.join(path, 'description')), 'foodesc\n')
+    assert not os.path.exists(os.path.join(other, 'description'))
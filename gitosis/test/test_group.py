@@ -136,3 +136,59 @@ def test_no_recurse_loop():
     gen = group.getMembership(config=cfg, user='jdoe')
     eq(gen.next(), 'all')
     assert_raises(StopIteration, gen.next)
+
+def test_yes_recurse_deep():
+    # deeper than the recursion limit would allow a recursive walk
+    cfg = RawConfigParser()
+    depth = 2000
+    for i in xrange(depth):
+        cfg.add_section('group g%04d' % i)
+        cfg.set('group g%04d' % i, 'members', '@g%04d' % (i + 1))
+    cfg.set('group g%04d' % (depth - 1), 'members', 'jdoe')
+    got = list(group.getMembership(config=cfg, user='jdoe'))
+    eq(got, ['g%04d' % i for i in reversed(xrange(depth))] + ['all'])
+
+def test_cache_invalidated():
+    cfg = RawConfigParser()
+    cfg.add_section('group hackers')
+    cfg.set('group hackers', 'members', 'wsmith')
+    eq(list(group.getMembership(config=cfg, user='jdoe')), ['all'])
+    cfg.set('group hackers', 'members', 'jdoe')
+    eq(list(group.getMembership(config=cfg, user='jdoe')), ['hackers', 'all'])
+
+def _reference(config, user, seen):
+    """The original recursive walk over all group sections."""
+    for section in config.sections():
+        if not section.startswith('group '):
+            continue
+        name = section[len('group '):]
+        if name in seen:
+            continue
+        members = config.get(section, 'members', "").split()
+        if user in members or '@all' in members:
+            seen.add(name)
+            yield name
+            for member_of in _reference(config, '@%s' % name, seen):
+                yield member_of
+            for member_of in _reference(config, '@all', seen):
+                yield member_of
+
+def test_same_as_recursive_walk():
+    import random
+    rand = random.Random(42)
+    users = ['u%d' % i for i in xrange(8)]
+    for _ in xrange(50):
+        cfg = RawConfigParser()
+        groups = ['g%d' % i for i in xrange(12)]
+        for name in groups:
+            cfg.add_section('group %s' % name)
+            tokens = rand.sample(users, rand.randint(0, 3))
+            tokens += ['@%s' % g for g in rand.sample(groups,
+                                                      rand.randint(0, 3))]
+            if rand.random() < 0.1:
+                tokens.append('@all')
+            rand.shuffle(tokens)
+            cfg.set('group %s' % name, 'members', ' '.join(tokens))
+        for user in users + ['nobody']:
+            eq(list(group.getMembership(config=cfg, user=user)),
+               list(_reference(cfg, user, set())) + ['all'])
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import eq_ as eq
+
+from gitosis import hiderefs
+from gitosis.config import GitosisRawConfigParser
+from gitosis.test.util import makeConfig, maketemp
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s
+hide-refs = refs/pipelines
+
+[group ci]
+writable = huge team/*
+map readonly visible = physical
+hide-refs = refs/changes refs/pipelines
+
+[group devs]
+writable = small
+
+[repo huge]
+hide-refs = refs/keep-around !refs/keep-around/release
+"""
+
+
+def test_hidden_refs():
+    cfg = makeConfig(maketemp(), CONFIG)
+    eq(hiderefs.hidden_refs(cfg, "huge"),
+       ["refs/pipelines", "refs/changes", "refs/keep-around",
+        "!refs/keep-around/release"])
+    eq(hiderefs.hidden_refs(cfg, "small"), ["refs/pipelines"])
+    eq(hiderefs.hidden_refs(cfg, "team/foo"),
+       ["refs/pipelines", "refs/changes"])
+    eq(hiderefs.hidden_refs(cfg, "physical"),
+       ["refs/pipelines", "refs/changes"])
+    eq(hiderefs.hidden_refs(cfg, "visible"), ["refs/pipelines"])
+
+
+def test_hidden_refs_none():
+    cfg = GitosisRawConfigParser()
+    eq(hiderefs.hidden_refs(cfg, "foo"), [])
+
+
+def test_configured():
+    cfg = GitosisRawConfigParser()
+    cfg.add_section("group devs")
+    cfg.set("group devs", "writable", "foo")
+    assert not hiderefs.configured(cfg)
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "hide-refs", "refs/changes")
+    assert hiderefs.configured(cfg)
@@ -0,0 +1,69 @@
+from nose.tools import eq_ as eq
+
+import os
+
+from gitosis import identity
+from gitosis.test.util import makeConfig, maketemp, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+"""
+
+def _keyfile(tmp, user, content):
+    keydir = os.path.join(tmp, 'repositories', 'gitosis-admin.git',
+                          'gitosis-export', 'keydir')
+    if not os.path.isdir(keydir):
+        os.makedirs(keydir)
+    writeFile(os.path.join(keydir, '%s.pub' % user), content)
+
+def test_parse_identity():
+    eq(identity.parse('# gitosis-identity: John Doe <jdoe@example.com>\n'),
+       dict(GITOSIS_NAME='John Doe', GITOSIS_EMAIL='jdoe@example.com'))
+
+def test_parse_identity_name_only():
+    eq(identity.parse('# gitosis-identity: John Doe\n'),
+       dict(GITOSIS_NAME='John Doe'))
+
+def test_parse_name():
+    eq(identity.parse('# gitosis-name: John Doe \n'),
+       dict(GITOSIS_NAME='John Doe'))
+
+def test_parse_email():
+    eq(identity.parse('# gitosis-email: jdoe@example.com\n'),
+       dict(GITOSIS_EMAIL='jdoe@example.com'))
+
+def test_parse_none():
+    eq(identity.parse('ssh-rsa AAAA jdoe@host\n'), {})
+
+def test_lookup_index():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    identity.write(cfg, {'jdoe': dict(GITOSIS_NAME='John Doe')})
+    # the index wins over the key files
+    _keyfile(tmp, 'jdoe', '# gitosis-name: Someone Else\n')
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='John Doe'))
+    eq(identity.lookup(cfg, 'wsmith'), {})
+
+def test_lookup_index_rewritten():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    identity.write(cfg, {'jdoe': dict(GITOSIS_NAME='John Doe')})
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='John Doe'))
+    identity.write(cfg, {'jdoe': dict(GITOSIS_NAME='Jane Doe Jr.')})
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='Jane Doe Jr.'))
+
+def test_lookup_without_index():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    _keyfile(tmp, 'jdoe', '# gitosis-name: John Doe\nssh-rsa AAAA\n')
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='John Doe'))
+    eq(identity.lookup(cfg, 'wsmith'), {})
+
+def test_lookup_corrupt_index():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    writeFile(identity.path_for(cfg), 'garbage')
+    _keyfile(tmp, 'jdoe', '# gitosis-name: John Doe\n')
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='John Doe'))
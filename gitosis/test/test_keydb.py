@@ -0,0 +1,136 @@
+from nose.tools import eq_ as eq
+
+import os
+import subprocess
+import sys
+
+from gitosis import keydb
+from gitosis import snapshot
+from gitosis import ssh
+from gitosis import sshkey
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import makeConfig, maketemp, mkdir, writeFile
+
+# made with ssh-keygen, which gives its fingerprint as FINGERPRINT
+KEY = ('ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQDhgN3hnQ+4VXvjNfBhx+VAjENAv'
+       'iPvzH0dHsAi7vOeEQr9JQEet/ldcTsXTwn275TN4bp2vUuQNNkDb+kE79ai+0GcG'
+       'oTsXcXEl0lFmfNwzZXA7tb1UmWxHV1LuEinbuLLH76RralTIjxku6j1FeUinBhESuR'
+       '9y77FIv4EMjRAvw== jdoe@host')
+FINGERPRINT = 'SHA256:hAzODoXWZsFRm+4y6ME3PWx69o4O3Nne2zfHmb9YPCA'
+
+OTHER_KEY = ('ssh-rsa 0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
+             'BBBBBBBBBBBBBBBBBBBB= wsmith@host')
+
+def test_fingerprint():
+    eq(keydb.fingerprint(KEY.split()[1]), FINGERPRINT)
+    eq(keydb.fingerprint('abc'), None)
+
+def test_mode():
+    cfg = RawConfigParser()
+    eq(keydb.mode(cfg), 'file')
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'authorized-keys', 'command')
+    eq(keydb.mode(cfg), 'command')
+    cfg.set('gitosis', 'authorized-keys', 'bogus')
+    eq(keydb.mode(cfg), 'file')
+
+def test_path_for():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', '/gen')
+    eq(keydb.path_for(cfg), '/gen/authorized-keys.db')
+    cfg.set('gitosis', 'authorized-keys-db', '/var/keys.db')
+    eq(keydb.path_for(cfg), '/var/keys.db')
+
+def _keys(tmp):
+    keydir = os.path.join(tmp, 'keydir')
+    mkdir(keydir)
+    writeFile(os.path.join(keydir, 'jdoe.pub'), KEY + '\n')
+    writeFile(os.path.join(keydir, 'wsmith.pub'),
+              OTHER_KEY + '\nfrom="10.0.0.1" %s\n' % KEY)
+    return sorted(ssh.readKeys(keydir))
+
+def test_write_lookup():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'keys.db')
+    keys = _keys(tmp)
+    keydb.write(path, keys)
+    eq(keydb.lookup(path, FINGERPRINT),
+       [ssh.authorizedKeysLine(user, key) for (user, key) in keys
+        if key.key == ' '.join(KEY.split()[:2])])
+    (jdoe, wsmith) = keydb.lookup(path, FINGERPRINT)
+    assert jdoe.startswith('command="gitosis-serve jdoe",'), jdoe
+    assert wsmith.startswith('command="gitosis-serve wsmith",'), wsmith
+    assert ',from="10.0.0.1" ' in wsmith, wsmith
+    other = keydb.fingerprint(OTHER_KEY.split()[1])
+    eq(len(keydb.lookup(path, other)), 1)
+    eq(keydb.lookup(path, 'SHA256:nosuchkey'), [])
+    # written again, in place
+    keydb.write(path, keys[:1])
+    eq(len(keydb.lookup(path, FINGERPRINT)), 1)
+    eq(sorted(os.listdir(tmp)), ['keydir', 'keys.db'])
+
+def test_write_non_ascii():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'keys.db')
+    key = sshkey.get_ssh_pubkey(KEY.replace('jdoe@host', 'J\xc3\xb6rg'))
+    keydb.write(path, [('jdoe', key)])
+    (line,) = keydb.lookup(path, FINGERPRINT)
+    assert line.endswith(' J\xc3\xb6rg'), repr(line)
+
+def test_lookup_missing():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'keys.db')
+    eq(keydb.lookup(path, FINGERPRINT), [])
+    assert not os.path.exists(path)
+    writeFile(path, 'garbage')
+    eq(keydb.lookup(path, FINGERPRINT), [])
+
+def test_keys_lookup():
+    tmp = maketemp()
+    generated = os.path.join(tmp, 'generated')
+    mkdir(generated)
+    config = os.path.join(tmp, 'gitosis.conf')
+    writeFile(config, '[gitosis]\ngenerate-files-in = %s\n' % generated)
+    keydb.write(os.path.join(generated, 'authorized-keys.db'),
+                _keys(tmp)[:1])
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(keydb.__file__))
+    def lookup(*args):
+        child = subprocess.Popen(
+            [sys.executable, '-c',
+             'from gitosis.keydb import Main; Main.run()',
+             '--config=%s' % config] + list(args),
+            env=env,
+            stdout=subprocess.PIPE,
+            close_fds=True,
+            )
+        out = child.communicate()[0]
+        return (child.returncode, out)
+    (status, out) = lookup(FINGERPRINT)
+    eq(status, 0)
+    assert out.startswith('command="gitosis-serve jdoe",'), out
+    eq(lookup(*KEY.split()[:2]), (status, out))
+    eq(lookup('SHA256:nosuchkey'), (0, ''))
+    # the same from the snapshot
+    cfg = RawConfigParser()
+    cfg.read(config)
+    snapshot.write(cfg, config)
+    eq(lookup(FINGERPRINT), (status, out))
+
+def test_read_config_snapshot():
+    tmp = maketemp()
+    config = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, '[gitosis]\ngenerate-files-in = %(tmp)s\n',
+                     path=config)
+    main = keydb.Main()
+    (options, args) = main.create_parser().parse_args(
+        ['--config=%s' % config])
+    parsed = main.create_config(options)
+    main.read_config(options, parsed)
+    eq(parsed.snapshot, None)
+    snapshot.write(cfg, config)
+    restored = main.create_config(options)
+    main.read_config(options, restored)
+    assert restored.snapshot is not None
+    eq(keydb.path_for(restored), os.path.join(tmp, 'authorized-keys.db'))
@@ -0,0 +1,118 @@
+from nose.tools import eq_ as eq
+
+import json
+import os
+
+from gitosis import access
+from gitosis import matrix
+from gitosis.test.util import makeConfig, maketemp, readFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s
+generate-files-in = %(tmp)s
+
+[group devs]
+members = jdoe @admins
+writable = foo baz/*
+readonly = xyzzy
+map readonly visible = actual
+
+[group admins]
+members = wsmith
+writeable = typo
+
+[group everybody]
+members = @all
+readonly = public
+
+[group nested]
+members = @devs
+readonly = deep/**
+
+[repo owned]
+owner = alice
+"""
+
+def test_repository_names():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    os.makedirs(os.path.join(tmp, 'baz', 'quux.git'))
+    os.makedirs(os.path.join(tmp, 'deep', 'er', 'thud.git', 'sub.git'))
+    eq(sorted(matrix.repository_names(cfg)),
+       ['baz/quux', 'deep/er/thud', 'foo', 'owned', 'public', 'typo',
+        'visible', 'xyzzy'])
+
+def test_build():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    got = matrix.build(cfg, repositories=['foo', 'baz/quux', 'baz/a/b',
+                                          'public', 'owned', 'visible'])
+    eq(got['repositories'], {
+        'foo': dict(readers=['jdoe', 'wsmith'], writers=['jdoe', 'wsmith']),
+        'baz/quux': dict(readers=['jdoe', 'wsmith'],
+                         writers=['jdoe', 'wsmith']),
+        'public': dict(readers=['@all', 'alice', 'jdoe', 'wsmith'],
+                       writers=[]),
+        'owned': dict(readers=['alice'], writers=['alice']),
+        'visible': dict(readers=['jdoe', 'wsmith'], writers=[]),
+        })
+    eq(got['users']['@all'], dict(readable=['public'], writable=[]))
+    eq(got['users']['alice'],
+       dict(readable=['owned', 'public'], writable=['owned']))
+
+def test_extra_users():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    got = matrix.build(cfg, repositories=['public'], users=['keyonly'])
+    eq(got['users']['keyonly'], dict(readable=['public'], writable=[]))
+
+def test_same_answers():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    repositories = ['foo', 'baz/quux', 'baz/quux/thud', 'xyzzy', 'visible',
+                    'actual', 'typo', 'public', 'owned', 'deep/x',
+                    'deep/x/y', 'missing']
+    users = ['jdoe', 'wsmith', 'alice', 'nobody']
+    got = matrix.build(cfg, repositories=repositories, users=users)
+    for repo in repositories:
+        entry = got['repositories'].get(repo, dict(readers=[], writers=[]))
+        for user in users:
+            grant = access.resolve(cfg, user=user, path=repo)
+            eq(user in entry['readers'], grant is not None,
+               'read mismatch for %r on %r' % (user, repo))
+            eq(user in entry['writers'],
+               grant is not None and grant[0] != 'readonly',
+               'write mismatch for %r on %r' % (user, repo))
+            eq(repo in got['users'].get(user, {}).get('readable', []),
+               grant is not None)
+
+def test_generate():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    os.mkdir(os.path.join(tmp, 'foo.git'))
+    matrix.generate(cfg)
+    got = json.loads(readFile(os.path.join(tmp, 'access.json')))
+    eq(got['repositories']['foo'],
+       dict(readers=['jdoe', 'wsmith'], writers=['jdoe', 'wsmith']))
+    eq(got['users']['jdoe']['writable'], ['foo'])
+
+def test_update():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    matrix.generate(cfg)
+    os.makedirs(os.path.join(tmp, 'baz', 'new.git'))
+    matrix.update(cfg, 'baz/new')
+    got = json.loads(readFile(matrix.path_for(cfg)))
+    want = matrix.build(cfg)
+    eq(got, json.loads(json.dumps(want)))
+    # again, nothing gets listed twice
+    matrix.update(cfg, 'baz/new')
+    eq(json.loads(readFile(matrix.path_for(cfg))), got)
+
+def test_update_missing():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG)
+    matrix.update(cfg, 'foo')
+    got = json.loads(readFile(matrix.path_for(cfg)))
+    eq(got['users']['jdoe']['writable'], ['foo'])
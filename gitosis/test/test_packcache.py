@@ -0,0 +1,169 @@
+from nose.tools import eq_ as eq
+
+import os
+import subprocess
+import sys
+from cStringIO import StringIO
+
+from gitosis import packcache
+from gitosis import repository
+from gitosis import serve
+from gitosis.test.test_protocol import FAKE_SSH
+from gitosis.test.util import makeConfig, maketemp, readFile, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+pack-cache = yes
+pack-cache-size = 2
+
+[group devs]
+members = jdoe
+writable = foo secret
+
+[repo secret]
+pack-cache = no
+"""
+
+def _hook(cfg, command):
+    request = {}
+    serve.serve(cfg=cfg, user='jdoe', command=command, request=request)
+    return packcache.hook(cfg, request)
+
+def test_hook():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo', 'secret'])
+    eq(_hook(cfg, "git-upload-pack 'foo'"),
+       "gitosis-pack-objects --cache='%s/pack-cache' --max-size=2097152"
+       % tmp)
+    eq(_hook(cfg, "git-receive-pack 'foo'"), None)
+    eq(_hook(cfg, "git-upload-pack 'secret'"), None)
+    cfg.set('gitosis', 'pack-cache', 'no')
+    eq(_hook(cfg, "git-upload-pack 'foo'"), None)
+
+def test_install():
+    environ = {}
+    packcache.install(None, environ)
+    eq(environ, {})
+    packcache.install('hook', environ)
+    eq(environ, dict(GIT_CONFIG_COUNT='1',
+                     GIT_CONFIG_KEY_0='uploadpack.packObjectsHook',
+                     GIT_CONFIG_VALUE_0='hook'))
+    environ = dict(GIT_CONFIG_COUNT='1')
+    packcache.install('hook', environ)
+    eq(environ['GIT_CONFIG_COUNT'], '2')
+    eq(environ['GIT_CONFIG_VALUE_1'], 'hook')
+
+def test_cache_key():
+    key = packcache.cache_key('/r', ['git', 'pack-objects', '--thin'], 'a')
+    eq(packcache.cache_key('/r', ['git', 'pack-objects', '--thin',
+                                  '--progress'], 'a'), key)
+    assert packcache.cache_key('/r', ['git', 'pack-objects'], 'a') != key
+    assert packcache.cache_key('/r', ['git', 'pack-objects', '--thin'],
+                               'b') != key
+    assert packcache.cache_key('/s', ['git', 'pack-objects', '--thin'],
+                               'a') != key
+
+def _pack(cache, data, command='printf packed; cat'):
+    """Returns the exit status, the output, and whether `command` ran."""
+    marker = os.path.join(cache, 'ran')
+    if os.path.exists(marker):
+        os.unlink(marker)
+    out = StringIO()
+    status = packcache.pack_objects(
+        cache, 1024, ['sh', '-c', '%s; s=$?; touch %s; exit $s'
+                      % (command, marker)],
+        StringIO(data), out)
+    return status, out.getvalue(), os.path.exists(marker)
+
+def test_pack_objects():
+    tmp = maketemp()
+    cache = os.path.join(tmp, 'cache')
+    os.mkdir(cache)
+    eq(_pack(cache, 'want 1'), (0, 'packedwant 1', True))
+    eq(packcache.stats(cache), dict(hits=0, misses=1))
+    eq(_pack(cache, 'want 1'), (0, 'packedwant 1', False))
+    eq(_pack(cache, 'want 2'), (0, 'packedwant 2', True))
+    eq(packcache.stats(cache), dict(hits=1, misses=2))
+
+def test_pack_objects_failed():
+    tmp = maketemp()
+    cache = os.path.join(tmp, 'cache')
+    os.mkdir(cache)
+    eq(_pack(cache, 'want 1', 'printf partial; false'), (1, 'partial', True))
+    eq(_pack(cache, 'want 1', 'printf partial; false'), (1, 'partial', True))
+    eq(packcache.stats(cache), dict(hits=0, misses=2))
+
+def test_pack_objects_too_big():
+    tmp = maketemp()
+    cache = os.path.join(tmp, 'cache')
+    os.mkdir(cache)
+    data = 'x' * 2000
+    eq(_pack(cache, data), (0, 'packed' + data, True))
+    eq(_pack(cache, data), (0, 'packed' + data, True))
+    eq(packcache.stats(cache), dict(hits=0, misses=2))
+
+def test_evict():
+    tmp = maketemp()
+    cache = os.path.join(tmp, 'cache')
+    os.makedirs(os.path.join(cache, 'ab'))
+    for (name, mtime) in [('old', 100), ('new', 300), ('mid', 200)]:
+        path = os.path.join(cache, 'ab', name + '.pack')
+        writeFile(path, 'x' * 10)
+        os.utime(path, (mtime, mtime))
+    stale = os.path.join(cache, 'ab', '.tmp-1-x')
+    writeFile(stale, '')
+    os.utime(stale, (0, 0))
+    packcache.evict(cache, 25, now=10000)
+    eq(sorted(os.listdir(os.path.join(cache, 'ab'))),
+       ['mid.pack', 'new.pack'])
+    packcache.evict(cache, 10, now=10000)
+    eq(os.listdir(os.path.join(cache, 'ab')), ['new.pack'])
+
+def _clone(tmp, env, name):
+    path = os.path.join(tmp, name)
+    subprocess.check_call(
+        args=['git', 'clone', '-q', 'jdoe@server:foo', path],
+        cwd=tmp,
+        env=env,
+        close_fds=True,
+        )
+    return readFile(os.path.join(path, 'foo'))
+
+def test_clone():
+    tmp = maketemp()
+    git_dir = os.path.join(tmp, 'repositories', 'foo.git')
+    os.makedirs(os.path.dirname(git_dir))
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Reverse the polarity of the neutron flow.\n',
+        files=[('foo', 'content')],
+        )
+    config = os.path.join(tmp, 'gitosis.conf')
+    writeFile(config, CONFIG % dict(tmp=tmp))
+    ssh = os.path.join(tmp, 'fake-ssh.py')
+    writeFile(ssh, FAKE_SSH)
+    # gitosis-pack-objects is not on the PATH of the tests
+    bindir = os.path.join(tmp, 'bin')
+    os.mkdir(bindir)
+    script = os.path.join(bindir, packcache.COMMAND)
+    writeFile(script, '#!/bin/sh\nexec %s -c "from gitosis.packcache'
+              ' import Main; Main.run()" "$@"\n' % sys.executable)
+    os.chmod(script, 0755)
+    env = dict(os.environ)
+    env.update(
+        PATH=os.pathsep.join([bindir, env.get('PATH', '')]),
+        PYTHONPATH=os.path.dirname(os.path.dirname(packcache.__file__)),
+        HOME=tmp,
+        GIT_SSH_COMMAND='%s %s' % (sys.executable, ssh),
+        GIT_SSH_VARIANT='ssh',
+        FAKE_SSH_CONFIG=config,
+        )
+    cache = os.path.join(tmp, 'pack-cache')
+    eq(_clone(tmp, env, 'first'), 'content')
+    eq(packcache.stats(cache), dict(hits=0, misses=1))
+    eq(_clone(tmp, env, 'second'), 'content')
+    eq(packcache.stats(cache), dict(hits=1, misses=1))
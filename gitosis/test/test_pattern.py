@@ -0,0 +1,83 @@
+from nose.tools import eq_ as eq
+
+import marshal
+
+from gitosis import pattern
+
+def test_empty():
+    eq(pattern.PatternSet().match('foo'), None)
+
+def test_exact():
+    patterns = pattern.PatternSet(['foo', 'bar/baz'])
+    eq(patterns.match('foo'), 'foo')
+    eq(patterns.match('bar/baz'), 'bar/baz')
+    eq(patterns.match('bar'), None)
+    eq(patterns.match('foo/baz'), None)
+    eq(patterns.match('fo'), None)
+
+def test_star_one_component():
+    patterns = pattern.PatternSet(['team/*'])
+    eq(patterns.match('team/foo'), 'team/*')
+    eq(patterns.match('team'), None)
+    eq(patterns.match('team/foo/bar'), None)
+    eq(patterns.match('other/foo'), None)
+
+def test_star_toplevel():
+    patterns = pattern.PatternSet(['*'])
+    eq(patterns.match('foo'), '*')
+    eq(patterns.match('foo/bar'), None)
+
+def test_star_partial():
+    patterns = pattern.PatternSet(['proj-*', 'x*y*z'])
+    eq(patterns.match('proj-foo'), 'proj-*')
+    eq(patterns.match('proj-'), 'proj-*')
+    eq(patterns.match('proj'), None)
+    eq(patterns.match('xaybz'), 'x*y*z')
+    eq(patterns.match('xyz'), 'x*y*z')
+    eq(patterns.match('xyza'), None)
+
+def test_question_mark():
+    patterns = pattern.PatternSet(['v?.git-mirror'])
+    eq(patterns.match('v1.git-mirror'), 'v?.git-mirror')
+    eq(patterns.match('v.git-mirror'), None)
+    eq(patterns.match('v12.git-mirror'), None)
+    eq(patterns.match('v1xgit-mirror'), None)
+
+def test_deep_trailing():
+    patterns = pattern.PatternSet(['team/**'])
+    eq(patterns.match('team/foo'), 'team/**')
+    eq(patterns.match('team/foo/bar/baz'), 'team/**')
+    eq(patterns.match('team'), None)
+    eq(patterns.match('other/foo'), None)
+
+def test_deep_middle():
+    patterns = pattern.PatternSet(['a/**/b'])
+    eq(patterns.match('a/b'), 'a/**/b')
+    eq(patterns.match('a/x/b'), 'a/**/b')
+    eq(patterns.match('a/x/y/b'), 'a/**/b')
+    eq(patterns.match('a/x/y/c'), None)
+    eq(patterns.match('a/b/c'), None)
+
+def test_exact_preferred():
+    patterns = pattern.PatternSet(['team/*', 'team/foo'])
+    eq(patterns.match('team/foo'), 'team/foo')
+    eq(patterns.match('team/bar'), 'team/*')
+
+def test_backtracking():
+    patterns = pattern.PatternSet(['a/b/c', 'a/*/d'])
+    eq(patterns.match('a/b/d'), 'a/*/d')
+
+def test_contains():
+    patterns = pattern.PatternSet(['foo', 'bar/*'])
+    assert 'foo' in patterns
+    assert 'bar/baz' in patterns
+    assert 'baz' not in patterns
+
+def test_marshal_roundtrip():
+    patterns = pattern.PatternSet(['foo', 'team/**', 'proj-*/x'])
+    state = marshal.loads(marshal.dumps(patterns.state))
+    restored = pattern.PatternSet(state=state)
+    eq(restored.match('team/foo/bar'), 'team/**')
+    eq(restored.match('proj-a/x'), 'proj-*/x')
+    eq(restored.match('foo'), 'foo')
+    eq(restored.match('bar'), None)
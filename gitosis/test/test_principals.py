@@ -0,0 +1,114 @@
+from nose.tools import eq_ as eq
+
+import os
+import subprocess
+import sys
+
+from gitosis import principals
+from gitosis import snapshot
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import makeConfig, maketemp, writeFile
+
+CONFIG = """\
+[gitosis]
+
+[group devs]
+members = jdoe @admins bad"name
+writable = foo
+
+[group admins]
+members = wsmith
+readonly = bar
+
+[group everybody]
+members = @all
+readonly = public
+"""
+
+def test_users():
+    cfg = makeConfig(maketemp(), CONFIG)
+    eq(principals.users(cfg), ['jdoe', 'wsmith'])
+
+def test_users_snapshot():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    snapshot.write(cfg, path)
+    restored = RawConfigParser()
+    assert snapshot.restore(restored, path)
+    eq(principals.users(restored), ['jdoe', 'wsmith'])
+
+def test_generate():
+    cfg = makeConfig(maketemp(), CONFIG)
+    eq(list(principals.generate(cfg, names=['wsmith', 'nosuch'])),
+       ['command="gitosis-serve wsmith",no-port-forwarding,'
+        'no-X11-forwarding,no-agent-forwarding,no-pty wsmith'])
+    eq(len(list(principals.generate(cfg))), 2)
+
+def _certificate(tmp, principal_list):
+    """Returns the principals of a new certificate signed by a new CA,
+    as ``ssh-keygen`` reads them back."""
+    ca = os.path.join(tmp, 'ca')
+    key = os.path.join(tmp, 'user')
+    for path in [ca, key]:
+        for name in [path, path + '.pub', path + '-cert.pub']:
+            if os.path.exists(name):
+                os.unlink(name)
+        subprocess.check_call(['ssh-keygen', '-q', '-t', 'ed25519',
+                               '-N', '', '-f', path], close_fds=True)
+    subprocess.check_call(['ssh-keygen', '-q', '-s', ca, '-I', 'test',
+                           '-n', ','.join(principal_list), key + '.pub'],
+                          stderr=subprocess.PIPE, close_fds=True)
+    out = subprocess.Popen(['ssh-keygen', '-L', '-f', key + '-cert.pub'],
+                           stdout=subprocess.PIPE,
+                           close_fds=True).communicate()[0]
+    found = []
+    lines = iter(out.splitlines())
+    for line in lines:
+        if line.strip() == 'Principals:':
+            break
+    for line in lines:
+        if ':' in line:
+            break
+        found.append(line.strip())
+    return found
+
+def _accepted(lines, cert_principals):
+    """Returns the options of the first line matching a principal of the
+    certificate, like sshd picks them, or ``None``."""
+    for line in lines.splitlines():
+        (options, principal) = line.rsplit(' ', 1)
+        if principal in cert_principals:
+            return options
+    return None
+
+def test_certificate():
+    tmp = maketemp()
+    config = os.path.join(tmp, 'gitosis.conf')
+    writeFile(config, CONFIG)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(principals.__file__))
+    def lookup(*args):
+        child = subprocess.Popen(
+            [sys.executable, '-c',
+             'from gitosis.principals import Main; Main.run()',
+             '--config=%s' % config] + list(args),
+            env=env,
+            stdout=subprocess.PIPE,
+            close_fds=True,
+            )
+        out = child.communicate()[0]
+        eq(child.returncode, 0)
+        return out
+    cert = _certificate(tmp, ['build', 'wsmith'])
+    eq(cert, ['build', 'wsmith'])
+    options = _accepted(lookup(), cert)
+    assert options.startswith('command="gitosis-serve wsmith",'), options
+    # the same from the snapshot
+    cfg = RawConfigParser()
+    cfg.read(config)
+    snapshot.write(cfg, config)
+    eq(_accepted(lookup(), cert), options)
+    eq(_accepted(lookup('wsmith'), cert), options)
+    eq(_accepted(lookup('jdoe'), cert), None)
+    eq(_accepted(lookup(), _certificate(tmp, ['build'])), None)
@@ -0,0 +1,179 @@
+from nose.tools import eq_ as eq
+from gitosis.test.util import assert_raises
+
+import os
+import subprocess
+import sys
+
+from gitosis import protocol
+from gitosis import repository
+from gitosis import serve
+from gitosis.test.util import makeConfig, maketemp, readFile, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+
+[group devs]
+members = jdoe
+writable = foo
+"""
+
+# Stands in for ssh, and sshd with "AcceptEnv GIT_PROTOCOL" on the other
+# end: runs gitosis-serve for the command git asks for, passing on
+# GIT_PROTOCOL only if git asked to send it.
+FAKE_SSH = """\
+import os, sys
+args = sys.argv[1:]
+send = []
+while args[0].startswith('-'):
+    option = args.pop(0)
+    if option in ('-o', '-p', '-i', '-l'):
+        value = args.pop(0)
+        if option == '-o' and value.startswith('SendEnv='):
+            send.extend(value[len('SendEnv='):].split())
+host = args.pop(0)
+env = dict(os.environ)
+if 'GIT_PROTOCOL' not in send:
+    env.pop('GIT_PROTOCOL', None)
+env['SSH_ORIGINAL_COMMAND'] = ' '.join(args)
+os.execve(sys.executable, [
+        sys.executable, '-c', 'from gitosis.serve import Main; Main.run()',
+        '--config=%s' % env['FAKE_SSH_CONFIG'], '--authd-socket=', 'jdoe',
+        ], env)
+"""
+
+def _policy(cfg, command):
+    request = {}
+    serve.serve(cfg=cfg, user='jdoe', command=command, request=request)
+    return protocol.policy(cfg, request)
+
+def test_policy_default():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    eq(_policy(cfg, "git-upload-pack 'foo'"), None)
+    cfg.set('gitosis', 'protocol', 'prefer-v2')
+    eq(_policy(cfg, "git-upload-pack 'foo'"), None)
+
+def test_policy_repo():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG + '[repo foo]\nprotocol = force-v2\n',
+                     ['foo'])
+    cfg.set('gitosis', 'protocol', 'force-v0')
+    eq(_policy(cfg, "git upload-pack 'foo'"), 'force-v2')
+    # there is no v2 for pushes
+    eq(_policy(cfg, "git-receive-pack 'foo'"), None)
+
+def test_policy_global():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    cfg.set('gitosis', 'protocol', 'force-v0')
+    eq(_policy(cfg, "git-upload-pack 'foo'"), 'force-v0')
+    cfg.set('gitosis', 'protocol', 'v3')
+    eq(_policy(cfg, "git-upload-pack 'foo'"), None)
+
+def test_version():
+    eq(protocol.version(None), 0)
+    eq(protocol.version(''), 0)
+    eq(protocol.version('version=2'), 2)
+    eq(protocol.version('foo=bar:version=1'), 1)
+    eq(protocol.version('version=x'), 0)
+
+def test_apply_force_v2():
+    environ = dict(GIT_PROTOCOL='version=2')
+    protocol.apply('force-v2', environ)
+    eq(environ, dict(GIT_PROTOCOL='version=2'))
+    for environ in [{}, dict(GIT_PROTOCOL='version=1')]:
+        e = assert_raises(protocol.VersionRequired,
+                          protocol.apply, 'force-v2', environ)
+        assert str(e).startswith('Protocol v2 required, ')
+
+def test_apply_force_v0():
+    environ = dict(GIT_PROTOCOL='version=2')
+    protocol.apply('force-v0', environ)
+    eq(environ, {})
+    environ = dict(GIT_PROTOCOL='version=2:foo=bar')
+    protocol.apply('force-v0', environ)
+    eq(environ, dict(GIT_PROTOCOL='foo=bar'))
+    environ = {}
+    protocol.apply('force-v0', environ)
+    eq(environ, {})
+
+def test_apply_none():
+    environ = dict(GIT_PROTOCOL='version=2')
+    protocol.apply(None, environ)
+    eq(environ, dict(GIT_PROTOCOL='version=2'))
+
+def _setup(tmp, extra=''):
+    git_dir = os.path.join(tmp, 'repositories', 'foo.git')
+    os.makedirs(os.path.dirname(git_dir))
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Reverse the polarity of the neutron flow.\n',
+        files=[('foo', 'content')],
+        )
+    config = os.path.join(tmp, 'gitosis.conf')
+    writeFile(config, (CONFIG + extra) % dict(tmp=tmp))
+    ssh = os.path.join(tmp, 'fake-ssh.py')
+    writeFile(ssh, FAKE_SSH)
+    env = dict(os.environ)
+    env.pop('GIT_PROTOCOL', None)
+    env.update(
+        PYTHONPATH=os.path.dirname(os.path.dirname(protocol.__file__)),
+        HOME=tmp,
+        GIT_SSH_COMMAND='%s %s' % (sys.executable, ssh),
+        GIT_SSH_VARIANT='ssh',
+        GIT_TRACE_PACKET=os.path.join(tmp, 'trace'),
+        FAKE_SSH_CONFIG=config,
+        )
+    return env
+
+def _git(tmp, env, version, *args):
+    """Returns the exit status, stderr and whether v2 was spoken."""
+    trace = env['GIT_TRACE_PACKET']
+    if os.path.exists(trace):
+        os.unlink(trace)
+    child = subprocess.Popen(
+        args=['git', '-c', 'protocol.version=%d' % version] + list(args),
+        cwd=tmp,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=True,
+        )
+    (out, err) = child.communicate()
+    v2 = os.path.exists(trace) and '< version 2\n' in readFile(trace)
+    return (child.wait(), err, v2)
+
+def test_end_to_end_v2():
+    tmp = maketemp()
+    env = _setup(tmp)
+    (status, err, v2) = _git(tmp, env, 2, 'ls-remote', 'jdoe@server:foo')
+    eq((status, v2), (0, True), err)
+    (status, err, v2) = _git(tmp, env, 2, 'clone', '-q',
+                             'jdoe@server:foo', 'clone')
+    eq((status, v2), (0, True), err)
+    eq(readFile(os.path.join(tmp, 'clone', 'foo')), 'content')
+
+def test_end_to_end_client_v0():
+    tmp = maketemp()
+    env = _setup(tmp)
+    (status, err, v2) = _git(tmp, env, 0, 'ls-remote', 'jdoe@server:foo')
+    eq((status, v2), (0, False), err)
+
+def test_end_to_end_force_v0():
+    tmp = maketemp()
+    env = _setup(tmp, '[repo foo]\nprotocol = force-v0\n')
+    (status, err, v2) = _git(tmp, env, 2, 'ls-remote', 'jdoe@server:foo')
+    eq((status, v2), (0, False), err)
+
+def test_end_to_end_force_v2():
+    tmp = maketemp()
+    env = _setup(tmp, '[repo foo]\nprotocol = force-v2\n')
+    (status, err, v2) = _git(tmp, env, 2, 'ls-remote', 'jdoe@server:foo')
+    eq((status, v2), (0, True), err)
+    (status, err, v2) = _git(tmp, env, 0, 'ls-remote', 'jdoe@server:foo')
+    assert status != 0
+    assert 'Protocol v2 required' in err, err
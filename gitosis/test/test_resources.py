@@ -0,0 +1,144 @@
+from nose.tools import eq_ as eq
+from gitosis.test.util import assert_raises
+
+import marshal
+import os
+import resource
+import subprocess
+import sys
+
+from gitosis import resources
+from gitosis import serve
+from gitosis.test.util import makeConfig, maketemp
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+generate-files-in = %(tmp)s
+
+[resources batch]
+nice = 10
+ionice = idle
+max-memory = 2048
+max-cpu = 600
+
+[resources gentle]
+nice = 5
+
+[repo mirror]
+resources = batch
+
+[group devs]
+members = jdoe bot
+writable = mirror work
+
+[group ci]
+members = bot
+resources = gentle
+"""
+
+def _parameters(cfg, user, command):
+    request = {}
+    serve.serve(cfg=cfg, user=user, command=command, request=request)
+    return resources.parameters(cfg, user, request)
+
+def test_parse_ionice():
+    eq(resources.parse_ionice('idle'), (3, 0))
+    eq(resources.parse_ionice('best-effort'), (2, 4))
+    eq(resources.parse_ionice('best-effort 7'), (2, 7))
+    for value in ['', 'realtime 1', 'idle 3', 'best-effort 8',
+                  'best-effort x', 'best-effort 1 2']:
+        assert_raises(ValueError, resources.parse_ionice, value)
+
+def test_parameters_none():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['mirror', 'work'])
+    eq(_parameters(cfg, 'jdoe', "git-upload-pack 'work'"), None)
+
+def test_parameters_repo():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['mirror', 'work'])
+    eq(_parameters(cfg, 'jdoe', "git-upload-pack 'mirror'"),
+       dict(nice=10, ionice=(3, 0),
+            rlimits=[('RLIMIT_AS', 2048 * 1024 * 1024),
+                     ('RLIMIT_CPU', 600)]))
+
+def test_parameters_group():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['mirror', 'work'])
+    eq(_parameters(cfg, 'bot', "git-upload-pack 'work'"), dict(nice=5))
+    # the repository's class comes first
+    eq(_parameters(cfg, 'bot', "git-upload-pack 'mirror'")['nice'], 10)
+
+def test_parameters_default():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['mirror', 'work'])
+    cfg.set('gitosis', 'resources', 'gentle')
+    eq(_parameters(cfg, 'jdoe', "git-receive-pack 'work'"), dict(nice=5))
+
+def test_parameters_undefined():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['mirror', 'work'])
+    cfg.set('gitosis', 'resources', 'nope')
+    eq(_parameters(cfg, 'jdoe', "git-upload-pack 'work'"), None)
+
+def test_parameters_marshal():
+    # they are handed over by gitosis-authd
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['mirror', 'work'])
+    params = _parameters(cfg, 'jdoe', "git-upload-pack 'mirror'")
+    eq(marshal.loads(marshal.dumps(params)), params)
+
+def _applied(params):
+    """Apply `params` in a child, and return what it ended up with."""
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            resources.apply(**params)
+            got = dict(
+                nice=os.nice(0),
+                rlimits=[(name, resource.getrlimit(getattr(resource, name)))
+                         for name in ('RLIMIT_AS', 'RLIMIT_CPU')],
+                )
+            os.write(write_fd, marshal.dumps(got))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    data = os.read(read_fd, 65536)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return marshal.loads(data)
+
+def test_apply():
+    base = os.nice(0)
+    got = _applied(dict(nice=base + 3,
+                        rlimits=[('RLIMIT_AS', 1 << 32),
+                                 ('RLIMIT_CPU', 600)]))
+    eq(got['nice'], base + 3)
+    eq(got['rlimits'], [('RLIMIT_AS', (1 << 32, 1 << 32)),
+                        ('RLIMIT_CPU', (600, 600))])
+
+def test_apply_never_lowers_nice():
+    base = os.nice(0)
+    eq(_applied(dict(nice=base - 1))['nice'], base)
+
+def test_set_ionice():
+    if os.uname()[4] not in resources._SYS_IOPRIO_SET:
+        return
+    child = subprocess.Popen(
+        [sys.executable, '-c', 'import sys; sys.stdin.read()'],
+        stdin=subprocess.PIPE,
+        preexec_fn=lambda: resources.set_ionice(2, 6),
+        )
+    try:
+        try:
+            out = subprocess.Popen(['ionice', '-p', str(child.pid)],
+                                   stdout=subprocess.PIPE).communicate()[0]
+        except OSError:
+            # no ionice to check with
+            return
+    finally:
+        child.communicate('')
+    eq(out.strip(), 'best-effort: prio 6')
@@ -3,12 +3,20 @@ from nose.tools import eq_ as eq
 import os
 from cStringIO import StringIO
 
-from gitosis import init, repository, run_hook
+from gitosis import identity, init, keydb, repository, run_hook, snapshot
 from gitosis.config import GitosisRawConfigParser as RawConfigParser
 from gitosis.test.util import maketemp, readFile
 
-def test_post_update_simple():
-    tmp = maketemp()
+JDOE_KEY = (
+    'ssh-rsa '
+    +'0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
+    +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
+    +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
+    +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com')
+
+def _post_update(tmp, extra=''):
+    """Runs the hook for a new admin repository, returns the config and
+    the repositories, generated files and ssh directories."""
     repos = os.path.join(tmp, 'repositories')
     os.mkdir(repos)
     admin_repository = os.path.join(repos, 'gitosis-admin.git')
@@ -51,7 +59,7 @@ stuff
         files=[
             ('gitosis.conf', """\
 [gitosis]
-
+%s
 [group gitosis-admin]
 members = theadmin
 writable = gitosis-admin
@@ -63,24 +71,27 @@ daemon = yes
 gitweb = yes
 owner = John Doe
 description = blah blah
-"""),
+""" % extra),
             ('keydir/jdoe.pub',
-             'ssh-rsa '
-             +'0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
-             +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
-             +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
-             +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com'),
+             '# gitosis-name: John Doe\n' + JDOE_KEY),
             ],
         )
     run_hook.post_update(
         cfg=cfg,
         git_dir=admin_repository,
         )
+    return (cfg, repos, generated, ssh)
+
+def test_post_update_simple():
+    tmp = maketemp()
+    (cfg, repos, generated, ssh) = _post_update(tmp)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
     got = readFile(os.path.join(repos, 'forweb.git', 'description'))
     eq(got, 'blah blah\n')
     got = os.listdir(generated)
     got.sort()
-    eq(got, ['projects.list', 'repos.list'])
+    eq(got, ['access.json', 'identities', 'keys-cache', 'projects.list',
+             'repos.list'])
     got = readFile(os.path.join(generated, 'projects.list'))
     eq(
         got,
@@ -96,3 +107,32 @@ forweb.git John+Doe
     got = readFile(os.path.join(ssh, 'authorized_keys')).splitlines(True)
     assert 'command="gitosis-serve jdoe",no-port-forwarding,no-X11-forwarding,no-agent-forwarding,no-pty ssh-rsa 0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com\n' in got, \
         "SSH authorized_keys line for jdoe not found: %r" % got
+    got = snapshot.load(os.path.join(admin_repository, 'gitosis.conf'))
+    assert got is not None, "access snapshot not written"
+    eq(list(got.membership('theadmin')), ['gitosis-admin', 'all'])
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='John Doe'))
+    eq(identity.lookup(cfg, 'theadmin'), {})
+
+def test_post_update_keys_command():
+    tmp = maketemp()
+    (cfg, repos, generated, ssh) = _post_update(
+        tmp, 'authorized-keys = command\n')
+    eq(sorted(os.listdir(generated)),
+       ['access.json', 'authorized-keys.db', 'identities', 'keys-cache',
+        'projects.list', 'repos.list'])
+    # sshd asks gitosis-keys-lookup instead
+    eq(readFile(os.path.join(ssh, 'authorized_keys')),
+       '### autogenerated by gitosis, DO NOT EDIT\n')
+    fpr = keydb.fingerprint(JDOE_KEY.split()[1])
+    eq(keydb.lookup(keydb.path_for(cfg), fpr),
+       ['command="gitosis-serve jdoe",no-port-forwarding,no-X11-forwarding'
+        ',no-agent-forwarding,no-pty %s' % JDOE_KEY])
+    eq(identity.lookup(cfg, 'jdoe'), dict(GITOSIS_NAME='John Doe'))
+
+def test_post_update_keys_both():
+    tmp = maketemp()
+    (cfg, repos, generated, ssh) = _post_update(tmp,
+                                                'authorized-keys = both\n')
+    fpr = keydb.fingerprint(JDOE_KEY.split()[1])
+    (line,) = keydb.lookup(keydb.path_for(cfg), fpr)
+    assert line + '\n' in readFile(os.path.join(ssh, 'authorized_keys'))
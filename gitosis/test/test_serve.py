@@ -3,6 +3,8 @@ from gitosis.test.util import assert_raises
 
 import logging
 import os
+import subprocess
+import sys
 from cStringIO import StringIO
 
 from gitosis import serve
@@ -199,6 +201,34 @@ def test_simple_read_dash():
         )
     eq(got, "git-upload-pack '%s/foo.git'" % tmp)
 
+def test_simple_archive():
+    tmp = util.maketemp()
+    repository.init(os.path.join(tmp, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'readonly', 'foo')
+    for verb in ['git-upload-archive', 'git upload-archive']:
+        request = {}
+        got = serve.serve(
+            cfg=cfg,
+            user='jdoe',
+            command="%s 'foo'" % verb,
+            request=request,
+            )
+        eq(got, "%s '%s/foo.git'" % (verb, tmp))
+        eq(request['mode'], 'readonly')
+    e = assert_raises(
+        serve.ReadAccessDenied,
+        serve.serve,
+        cfg=cfg,
+        user='wsmith',
+        command="git-upload-archive 'foo'",
+        )
+    eq(str(e), 'Repository read access denied')
+
 def test_simple_read_absolute():
     tmp = util.maketemp()
     full_path = os.path.join(tmp, 'foo.git')
@@ -522,6 +552,32 @@ def test_push_inits_updates_projects_list():
     got = util.readFile(path)
     eq(got, 'foo.git\n')
 
+def test_push_inits_updates_projects_list_incrementally():
+    tmp = util.maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repositories = os.path.join(tmp, 'repositories')
+    os.mkdir(repositories)
+    cfg.set('gitosis', 'repositories', repositories)
+    cfg.set('gitosis', 'gitweb', 'yes')
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'writable', 'foo')
+    cfg.add_section('repo bar')
+    cfg.add_section('repo foo')
+    path = os.path.join(generated, 'projects.list')
+    util.writeFile(path, 'bar.git Not+Regenerated\nfoo\n')
+    serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-receive-pack 'foo'",
+        )
+    got = util.readFile(path)
+    eq(got, 'bar.git Not+Regenerated\nfoo.git\n')
+
 def test_push_inits_sets_export_ok():
     tmp = util.maketemp()
     cfg = RawConfigParser()
@@ -594,3 +650,193 @@ def test_typo_writeable():
         buf.getvalue(),
         """Repository 'foo' config has typo "writeable", should be "writable"
 """)
+
+def test_command_argv_shell():
+    cfg = RawConfigParser()
+    request = dict(verb='git-upload-pack', path='/r/foo.git')
+    eq(serve.command_argv(cfg, request, "git-upload-pack '/r/foo.git'"),
+       ['git', 'shell', '-c', "git-upload-pack '/r/foo.git'"])
+
+def test_command_argv_direct():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'direct-exec', 'yes')
+    for verb in ['git-upload-pack', 'git upload-pack']:
+        request = dict(verb=verb, path='/r/foo.git')
+        eq(serve.command_argv(cfg, request, "%s '/r/foo.git'" % verb),
+           ['git', 'upload-pack', '/r/foo.git'])
+    request = dict(verb='git receive-pack', path='/r/foo.git')
+    eq(serve.command_argv(cfg, request, "git receive-pack '/r/foo.git'"),
+       ['git', 'receive-pack', '/r/foo.git'])
+
+def _speak(tmp, command, protocol=None):
+    """Returns what git says, in both modes, when a client asks for
+    `command` and hangs up right after the ref advertisement."""
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'writable', 'foo')
+    env = dict(os.environ)
+    env.pop('GIT_PROTOCOL', None)
+    if protocol is not None:
+        env['GIT_PROTOCOL'] = protocol
+    said = []
+    for direct in ['no', 'yes']:
+        cfg.set('gitosis', 'direct-exec', direct)
+        request = {}
+        newcmd = serve.serve(cfg=cfg, user='jdoe', command=command,
+                             request=request)
+        child = subprocess.Popen(
+            args=serve.command_argv(cfg, request, newcmd),
+            env=env,
+            cwd=tmp,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            close_fds=True,
+            )
+        said.append(child.communicate('0000') + (child.returncode,))
+    return said
+
+def _repository(tmp):
+    git_dir = os.path.join(tmp, 'foo.git')
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Reverse the polarity of the neutron flow.\n',
+        files=[('foo', 'content')],
+        )
+
+def test_direct_exec_equivalent():
+    tmp = util.maketemp()
+    _repository(tmp)
+    for command in ["git-upload-pack 'foo'", "git upload-pack '/foo.git'",
+                    "git-receive-pack 'foo'", "git receive-pack 'foo'"]:
+        (shell, direct) = _speak(tmp, command)
+        eq(direct, shell)
+        # the refs really were advertised
+        assert 'refs/heads/master' in shell[0], shell
+
+def test_direct_exec_archive():
+    tmp = util.maketemp()
+    _repository(tmp)
+    (shell, direct) = _speak(tmp, "git-upload-archive 'foo'")
+    # how the usage message is split in side-band packets varies
+    eq(direct[1:], shell[1:])
+    for said in [shell, direct]:
+        assert said[0].startswith('0008ACK\n0000'), said
+        assert 'usage: git archive' in said[0], said
+
+def test_direct_exec_protocol_v2():
+    tmp = util.maketemp()
+    _repository(tmp)
+    (shell, direct) = _speak(tmp, "git-upload-pack 'foo'",
+                             protocol='version=2')
+    eq(direct, shell)
+    assert shell[0].startswith('000eversion 2\n'), shell
+
+# modules gitosis-serve must not load just to authorize a request
+_NOT_ON_SERVE_PATH = [
+    'SocketServer',
+    '_ssl',
+    'ctypes',
+    'gitosis.authd',
+    'gitosis.cgit',
+    'gitosis.gitdaemon',
+    'gitosis.gitweb',
+    'gitosis.repository',
+    'gitosis.run_hook',
+    'gitosis.ssh',
+    'gitosis.sshkey',
+    'gitosis.util',
+    'shlex',
+    'shutil',
+    'socket',
+    'subprocess',
+    'urllib',
+    ]
+
+def test_import_footprint():
+    topdir = os.path.dirname(os.path.dirname(serve.__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = topdir
+    child = subprocess.Popen(
+        args=[
+            sys.executable,
+            '-c',
+            'import sys, gitosis.serve; print "\\n".join(sys.modules)',
+            ],
+        env=env,
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read().split()
+    eq(child.wait(), 0)
+    loaded = [name for name in _NOT_ON_SERVE_PATH if name in got]
+    eq(loaded, [], 'gitosis.serve imports too much: %r' % loaded)
+
+def test_push_inits_mapped():
+    tmp = util.maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repositories = os.path.join(tmp, 'repositories')
+    os.mkdir(repositories)
+    cfg.set('gitosis', 'repositories', repositories)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    cfg.set('gitosis', 'cgit', 'yes')
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'map writable visible', 'actual')
+    cfg.add_section('repo actual')
+    cfg.set('repo actual', 'gitweb', 'yes')
+    cfg.set('repo actual', 'daemon', 'yes')
+    cfg.set('repo actual', 'description', 'the real one')
+    serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-receive-pack 'visible'",
+        )
+    eq(os.listdir(repositories), ['actual.git'])
+    # the metadata is keyed on the repository on disk
+    eq(util.readFile(os.path.join(generated, 'projects.list')),
+       'actual.git\n')
+    assert 'repo.url=actual.git\n' in util.readFile(
+        os.path.join(generated, 'repos.list'))
+    assert os.path.exists(os.path.join(repositories, 'actual.git',
+                                       'git-daemon-export-ok'))
+    eq(util.readFile(os.path.join(repositories, 'actual.git',
+                                  'description')), 'the real one\n')
+
+def test_push_inits_group_repositories():
+    tmp = util.maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repositories = os.path.join(tmp, 'repositories')
+    os.mkdir(repositories)
+    cfg.set('gitosis', 'repositories', repositories)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    other = os.path.join(tmp, 'other')
+    os.mkdir(other)
+    cfg.set('group foo', 'repositories', other)
+    cfg.set('group foo', 'writable', 'foo')
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'daemon', 'yes')
+    repository.init(os.path.join(repositories, 'foo.git'))
+    serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-receive-pack 'foo'",
+        )
+    eq(os.listdir(other), ['foo.git'])
+    # not the repository of the same name the generated files list
+    assert not os.path.exists(os.path.join(repositories, 'foo.git',
+                                           'git-daemon-export-ok'))
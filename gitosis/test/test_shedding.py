@@ -0,0 +1,151 @@
+from nose.tools import eq_ as eq
+from gitosis.test.util import assert_raises
+
+import os
+
+from gitosis import serve
+from gitosis import shedding
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import makeConfig, maketemp, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = %(tmp)s/repositories
+shed-loadavg = 8
+shed-min-memory = 100
+
+[group ci]
+members = bot
+priority = low
+
+[group humans]
+members = jdoe
+priority = normal
+
+[group devs]
+members = @ci @humans
+writable = foo
+"""
+
+MEMINFO = """\
+MemTotal:        8000000 kB
+MemFree:          %(free)d kB
+MemAvailable:     %(available)d kB
+Buffers:           10000 kB
+Cached:            20000 kB
+"""
+
+OLD_MEMINFO = """\
+MemTotal:        8000000 kB
+MemFree:          %(free)d kB
+Buffers:           10000 kB
+Cached:            20000 kB
+"""
+
+def _proc(tmp, load=0.5, available=4000000, meminfo=MEMINFO):
+    proc = os.path.join(tmp, 'proc')
+    if not os.path.isdir(proc):
+        os.mkdir(proc)
+    writeFile(os.path.join(proc, 'loadavg'),
+              '%.2f 1.00 1.00 2/345 6789\n' % load)
+    writeFile(os.path.join(proc, 'meminfo'),
+              meminfo % dict(free=available // 2, available=available))
+    return proc
+
+class _Clock(object):
+    def __init__(self, proc=None, load=None):
+        self.now = 0.0
+        self.sleeps = []
+        self.proc = proc
+        self.load = load
+    def time(self):
+        return self.now
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.proc is not None and len(self.sleeps) == 2:
+            # things calm down eventually
+            _proc(os.path.dirname(self.proc), load=self.load)
+
+def test_loadavg():
+    tmp = maketemp()
+    eq(shedding.loadavg(_proc(tmp, load=3.25)), 3.25)
+
+def test_available_memory():
+    tmp = maketemp()
+    eq(shedding.available_memory(_proc(tmp, available=123456)), 123456)
+
+def test_available_memory_old_kernel():
+    tmp = maketemp()
+    proc = _proc(tmp, available=100000, meminfo=OLD_MEMINFO)
+    eq(shedding.available_memory(proc), 50000 + 10000 + 20000)
+
+def test_low_priority():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    assert shedding.low_priority(cfg, 'bot')
+    assert not shedding.low_priority(cfg, 'jdoe')
+    assert not shedding.low_priority(cfg, 'stranger')
+
+def test_enabled():
+    cfg = RawConfigParser()
+    assert not shedding.enabled(cfg)
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'shed-min-memory', '10')
+    assert shedding.enabled(cfg)
+
+def test_overloaded():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    assert not shedding.overloaded(cfg, _proc(tmp))
+    assert shedding.overloaded(cfg, _proc(tmp, load=8.5))
+    assert shedding.overloaded(cfg, _proc(tmp, available=50 * 1024))
+
+def test_check():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    proc = _proc(tmp, load=20)
+    eq(shedding.check(cfg, 'bot', proc), 60)
+    eq(shedding.check(cfg, 'jdoe', proc), None)
+    eq(shedding.check(cfg, 'bot', _proc(tmp)), None)
+
+def test_check_retry_after():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    cfg.set('gitosis', 'shed-retry-after', '300')
+    eq(shedding.check(cfg, 'bot', _proc(tmp, load=20)), 300)
+
+def test_check_delay():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    cfg.set('gitosis', 'shed-delay', '5')
+    proc = _proc(tmp, load=20)
+    clock = _Clock()
+    eq(shedding.check(cfg, 'bot', proc, clock=clock.time,
+                      sleep=clock.sleep), 60)
+    eq(sum(clock.sleeps), 5)
+    clock = _Clock(proc=proc, load=1)
+    eq(shedding.check(cfg, 'bot', proc, clock=clock.time,
+                      sleep=clock.sleep), None)
+    eq(clock.sleeps, [1.0, 1.0])
+
+def test_check_unreadable():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    eq(shedding.check(cfg, 'bot', os.path.join(tmp, 'nothing')), None)
+
+def test_serve():
+    tmp = maketemp()
+    cfg = makeConfig(tmp, CONFIG, ['foo'])
+    old = shedding.PROC
+    shedding.PROC = _proc(tmp, load=20)
+    try:
+        e = assert_raises(serve.ServerOverloaded, serve.serve, cfg=cfg,
+                          user='bot', command="git-upload-pack 'foo'")
+        eq(str(e), 'Server too busy for low priority fetches,'
+           ' retry after 60 seconds')
+        # pushes and other users still get through
+        serve.serve(cfg=cfg, user='bot', command="git-receive-pack 'foo'")
+        serve.serve(cfg=cfg, user='jdoe', command="git-upload-pack 'foo'")
+    finally:
+        shedding.PROC = old
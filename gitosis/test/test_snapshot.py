@@ -0,0 +1,106 @@
+from nose.tools import eq_ as eq
+
+import os
+
+from gitosis import access
+from gitosis import snapshot
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import makeConfig, maketemp, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = /srv/git
+
+[group devs]
+members = jdoe @admins
+writable = foo baz/*
+readonly = xyzzy
+map readonly Visible = actual
+
+[group admins]
+members = wsmith
+repositories = /srv/admin
+writeable = typo
+
+[group everybody]
+members = @all
+readonly = public
+
+[repo owned]
+owner = alice
+"""
+
+def test_load_missing():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    eq(snapshot.load(path), None)
+    assert not snapshot.restore(RawConfigParser(), path)
+
+def test_load_corrupt():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    writeFile(snapshot.path_for(path), 'garbage')
+    eq(snapshot.load(path), None)
+
+def test_load_stale():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    snapshot.write(cfg, path)
+    assert snapshot.load(path) is not None
+    tmp_path = path + '.new'
+    writeFile(tmp_path, CONFIG)
+    os.rename(tmp_path, path)
+    eq(snapshot.load(path), None)
+
+def test_restore_sections():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    snapshot.write(cfg, path)
+    restored = RawConfigParser()
+    assert snapshot.restore(restored, path)
+    eq(restored.sections(), cfg.sections())
+    eq(restored.get('group devs', 'writable'), 'foo baz/*')
+    eq(restored.repository_dir, '/srv/git')
+    assert restored.snapshot is not None
+
+def test_restore_dropped_on_change():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    snapshot.write(cfg, path)
+    restored = RawConfigParser()
+    snapshot.restore(restored, path)
+    restored.set('group devs', 'writable', 'other')
+    eq(restored.snapshot, None)
+    eq(access.allowed(restored, user='jdoe', mode='writable', path='other'),
+       ('/srv/git', 'other'))
+
+def test_same_answers():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    snapshot.write(cfg, path)
+    restored = RawConfigParser()
+    snapshot.restore(restored, path)
+    for user in ['jdoe', 'wsmith', 'alice', 'nobody']:
+        for mode in ['writable', 'writeable', 'readonly']:
+            for repo in ['foo', 'foo.git', 'baz/quux', 'baz/quux/thud',
+                         'xyzzy', 'visible', 'Visible', 'typo', 'public',
+                         'owned', 'missing']:
+                eq(access.allowed(restored, user=user, mode=mode, path=repo),
+                   access.allowed(cfg, user=user, mode=mode, path=repo),
+                   'mismatch for %r as %r on %r' % (user, mode, repo))
+
+def test_membership():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    cfg = makeConfig(tmp, CONFIG, path=path)
+    snapshot.write(cfg, path)
+    snap = snapshot.load(path)
+    eq(list(snap.membership('wsmith')),
+       ['admins', 'devs', 'everybody', 'all'])
+    eq(list(snap.membership('nobody')), ['everybody', 'all'])
@@ -1,5 +1,6 @@
 from nose.tools import eq_ as eq, assert_raises, raises
 
+import logging
 import os
 from cStringIO import StringIO
 
@@ -99,6 +100,100 @@ class ReadKeys_Test(object):
             ('jdoe', KEY_2),
             ]))
 
+    def test_identities(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'identities')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'),
+                  '# gitosis-identity: John Doe <jdoe@example.com>\n'
+                  +KEY_1+'\n')
+        writeFile(os.path.join(keydir, 'wsmith.pub'), KEY_2+'\n')
+
+        identities = {}
+        got = frozenset( (i, j.full_key)
+                         for (i, j) in ssh.readKeys(keydir, identities))
+        eq(got,
+           frozenset([
+            ('jdoe', KEY_1),
+            ('wsmith', KEY_2),
+            ]))
+        eq(identities, {
+            'jdoe': dict(GITOSIS_NAME='John Doe',
+                         GITOSIS_EMAIL='jdoe@example.com'),
+            })
+
+    def _keydir(self, tmp, count):
+        keydir = os.path.join(tmp, 'keydir')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'),
+                  '# gitosis-name: John Doe\n'+KEY_1+'\n')
+        writeFile(os.path.join(keydir, 'jd"oe.pub'), KEY_1+'\n')
+        writeFile(os.path.join(keydir, 'broken.pub'),
+                  'bogus '+KEY_1+'\n'+KEY_2+'\n\n# comment\n')
+        for i in range(count):
+            writeFile(os.path.join(keydir, 'user%d.pub' % i), KEY_2+'\n')
+        return keydir
+
+    def _read(self, keydir, **kw):
+        """Returns the keys, identities and warnings of readKeys."""
+        log = logging.getLogger('gitosis.ssh')
+        buf = StringIO()
+        handler = logging.StreamHandler(buf)
+        log.addHandler(handler)
+        identities = {}
+        try:
+            got = [(user, key.full_key)
+                   for (user, key) in ssh.readKeys(keydir, identities, **kw)]
+        finally:
+            log.removeHandler(handler)
+        return (got, identities, buf.getvalue())
+
+    def test_cache(self):
+        tmp = maketemp()
+        keydir = self._keydir(tmp, 2)
+        cache = os.path.join(tmp, 'keys-cache')
+        want = self._read(keydir)
+        assert 'Unsafe SSH username' in want[2], want[2]
+        assert 'Malformed SSH key' in want[2], want[2]
+        parsed = []
+        explode = sshkey.explode_ssh_key
+        def counting(line):
+            parsed.append(line)
+            return explode(line)
+        sshkey.explode_ssh_key = counting
+        try:
+            eq(self._read(keydir, cache=cache), want)
+            eq(len(parsed), 5)
+            del parsed[:]
+            eq(self._read(keydir, cache=cache), want)
+            eq(parsed, [])
+            writeFile(os.path.join(keydir, 'user1.pub'), KEY_1+'\n')
+            (got, _, _) = self._read(keydir, cache=cache)
+            eq(parsed, [KEY_1])
+            assert ('user1', KEY_1) in got, got
+        finally:
+            sshkey.explode_ssh_key = explode
+
+    def test_cache_corrupt(self):
+        tmp = maketemp()
+        keydir = self._keydir(tmp, 2)
+        cache = os.path.join(tmp, 'keys-cache')
+        writeFile(cache, 'garbage')
+        want = self._read(keydir)
+        (got, identities, warnings) = self._read(keydir, cache=cache)
+        eq((got, identities), want[:2])
+        eq(warnings, 'Ignoring unreadable key cache %r\n%s'
+           % (cache, want[2]))
+        eq(self._read(keydir, cache=cache), want)
+
+    def test_pool(self):
+        tmp = maketemp()
+        keydir = self._keydir(tmp, ssh._MIN_POOL)
+        cache = os.path.join(tmp, 'keys-cache')
+        want = self._read(keydir, jobs=1)
+        eq(self._read(keydir, cache=cache, jobs=2), want)
+        eq(self._read(keydir, cache=cache, jobs=2), want)
+
 class GenerateAuthorizedKeys_Test(object):
     def test_simple(self):
         def k():
@@ -1,6 +1,9 @@
 from nose.tools import eq_ as eq, assert_raises, raises
 
+import random
+
 from gitosis import sshkey
+from gitosis.test import shlex_sshkey
 
 def test_sshkey_username_simple():
     _ = sshkey.get_ssh_pubkey(
@@ -97,3 +100,95 @@ def test_sshkey_username_bad():
     except sshkey.InsecureSSHKeyUsername, e:
         eq(str(e), "Username contains not allowed characters: 'ER3%'")
         raise e
+
+ED25519_KEY = ('ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIHSwd2i2h1bg0PE3j+kI'
+               'K1Ad+dPMYbaJAnlZ9PVbx8Tq jdoe@host')
+
+def test_sshkey_modern_types():
+    for (keytype, blob) in [
+        ('ssh-ed25519', ED25519_KEY.split()[1]),
+        ('ecdsa-sha2-nistp256', 'AAAAE2VjZHNhLXNoYTItbmlzdHAyNTY='),
+        ('ecdsa-sha2-nistp521', 'AAAAE2VjZHNhLXNoYTItbmlzdHA1MjE='),
+        ('sk-ssh-ed25519@openssh.com', 'AAAAGnNrLXNzaC1lZDI1NTE5'),
+        ('sk-ecdsa-sha2-nistp256@openssh.com', 'AAAAInNrLWVjZHNh'),
+        ]:
+        key = sshkey.get_ssh_pubkey(
+            'from="10.0.0.1" %s %s jdoe@host' % (keytype, blob))
+        assert isinstance(key, sshkey.SSH2PublicKey), key
+        eq(key.key, '%s %s' % (keytype, blob))
+        eq(key.options, {'from': '10.0.0.1'})
+        eq(key.username, 'jdoe@host')
+
+def test_sshkey_slots():
+    key = sshkey.get_ssh_pubkey(ED25519_KEY)
+    assert not hasattr(key, '__dict__')
+    key = sshkey.get_ssh_pubkey('1024 35 12345 jdoe@host')
+    assert isinstance(key, sshkey.SSH1PublicKey), key
+    assert not hasattr(key, '__dict__')
+
+def test_sshkey_unbalanced_quote():
+    for line in ['command="gitosis-serve jdoe ssh-rsa AAAA',
+                 "ssh-rsa AAAA John's key",
+                 'ssh-rsa AAAA comment\\']:
+        assert_raises(sshkey.MalformedSSHKey, sshkey.get_ssh_pubkey, line)
+
+def _explode(func, line):
+    try:
+        return func(line)
+    except ValueError:
+        # old and new parser both raise MalformedSSHKey, or the
+        # ValueError of shlex
+        return ValueError
+
+DIFFERENTIAL = [
+    'ssh-rsa AAAA jdoe@host',
+    '  ssh-dss\tAAAA\t jdoe@host  ',
+    'ssh-rsa AAAA',
+    'ssh-rsa',
+    '',
+    '# just a comment',
+    'ssh-rsa AAAA # comment',
+    'ssh-rsa AAAA#x comment',
+    'ssh-rsa AAAA two  spaces, a comma and \'quotes\' "too"',
+    'ssh-rsa AAAA trailing \\x escape',
+    '1024 35 12345 jdoe@host',
+    '1024 35',
+    'no-pty,no-port-forwarding ssh-rsa AAAA jdoe',
+    'no-pty,,, ,no-X11-forwarding ssh-rsa AAAA jdoe',
+    'command="gitosis-serve jdoe",no-pty ssh-rsa AAAA jdoe@host',
+    'command="echo \\"hi\\" \\\\ \\n",from="a,b" ssh-rsa AAAA x',
+    "command='single \\ quoted',tunnel=\"0\" ssh-rsa AAAA x",
+    'command=unquoted\\ escaped ssh-rsa AAAA x',
+    'command="a"\'b\'c ssh-rsa AAAA x',
+    'environment="A=B" ssh-rsa AAAA x',
+    'permitopen="host:22" ssh-rsa "AA""AA" quoted key',
+    'unknown ssh-rsa AAAA x',
+    'bogus="x" ssh-rsa AAAA x',
+    '"" ssh-rsa AAAA x',
+    'command="# not a comment" ssh-rsa AAAA x',
+    'command="unterminated ssh-rsa AAAA x',
+    'command="x\\',
+    'ssh-rsa AAAA "',
+    'ssh-rsa AAAA \\',
+    'ssh-rsa AAAA comment\nssh-rsa BBBB # second line',
+    'ssh-rsa AAAA #\ncomment on the next line',
+    'ssh-ecdh AAAA a\rb',
+    ]
+
+def test_sshkey_differential():
+    for line in DIFFERENTIAL:
+        eq(_explode(sshkey.explode_ssh_key, line),
+           _explode(shlex_sshkey.explode_ssh_key, line),
+           repr(line))
+
+def test_sshkey_differential_random():
+    rand = random.Random(0)
+    words = ['ssh-rsa ', 'ssh-dss', '1024 ', 'AAAA', 'no-pty', 'command=',
+             'from=', 'x=y', 'jdoe@host', ' ', '  ', ',', '\t', '\n', '#',
+             '"', "'", '\\', '\\"', '=', 'a', '-']
+    for _ in xrange(5000):
+        line = ''.join(rand.choice(words)
+                       for _ in xrange(rand.randint(1, 12)))
+        eq(_explode(sshkey.explode_ssh_key, line),
+           _explode(shlex_sshkey.explode_ssh_key, line),
+           repr(line))
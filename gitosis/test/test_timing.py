@@ -0,0 +1,141 @@
+from nose.tools import eq_ as eq
+from nose.plugins.skip import SkipTest
+
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+from gitosis import serve
+from gitosis import timing
+from gitosis.config import GitosisRawConfigParser as RawConfigParser
+from gitosis.test.util import maketemp, readFile
+
+def _fields(line):
+    assert line.endswith('\n'), repr(line)
+    return [field.split('=', 1) for field in line[:-1].split('\t')]
+
+def test_format():
+    timer = timing.Timer()
+    timer.note('user', 'jdoe')
+    timer.note('decision', 'deny: Unknown command denied')
+    timer.phases = [('config', 100), ('command', 20)]
+    got = _fields(timer.format())
+    eq([name for (name, _) in got],
+       ['time', 'pid', 'user', 'verb', 'repo', 'decision', 'config',
+        'command', 'total'])
+    eq(got[2:], [['user', 'jdoe'], ['verb', '-'], ['repo', '-'],
+                 ['decision', 'deny: Unknown command denied'],
+                 ['config', '100'], ['command', '20'], ['total', '120']])
+
+def test_format_escapes():
+    timer = timing.Timer()
+    timer.note('decision', 'a\tb\nc')
+    line = timer.format()
+    eq(line.count('\n'), 1)
+    eq(dict(_fields(line))['decision'], 'a\\tb\\nc')
+
+def test_mark():
+    timer = timing.Timer()
+    timer.mark('one')
+    timer.mark('two')
+    eq([name for (name, _) in timer.phases], ['one', 'two'])
+    assert all(us >= 0 for (_, us) in timer.phases)
+
+def test_mark_clock_set_back():
+    timer = timing.Timer()
+    timer._last += 3600
+    timer.mark('one')
+    eq(timer.phases, [('one', 0)])
+
+def test_monotonic():
+    if not sys.platform.startswith('linux'):
+        raise SkipTest('CLOCK_MONOTONIC is only checked on Linux')
+    monotonic = timing.monotonic()
+    assert monotonic is not time.time
+    assert timing.monotonic() is monotonic
+    before = monotonic()
+    assert monotonic() >= before
+
+def test_use():
+    timer = timing.Timer()
+    timer._last -= 2
+    # the current phase carries over to the new clock
+    timer.use(lambda: 1000.0)
+    timer.mark('one')
+    eq(len(timer.phases), 1)
+    assert timer.phases[0][1] >= 2000000, timer.phases
+
+def test_log_path():
+    cfg = RawConfigParser()
+    eq(timing.log_path(cfg), None)
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'timing-log', '/var/log/timing')
+    eq(timing.log_path(cfg), '/var/log/timing')
+
+def test_record_none():
+    timing.record(None, timing.Timer())
+
+def test_record_unwritable():
+    tmp = maketemp()
+    timing.record(os.path.join(tmp, 'missing', 'timing.log'), timing.Timer())
+
+def test_record_concurrent():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'timing.log')
+    children = []
+    for n in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                timer = timing.Timer()
+                timer.note('user', 'user%d' % n)
+                timer.note('repo', 'x' * 500)
+                for _ in range(200):
+                    timing.record(path, timer)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+    lines = readFile(path).splitlines()
+    eq(len(lines), 800)
+    for line in lines:
+        fields = dict(_fields(line + '\n'))
+        eq(fields['repo'], 'x' * 500)
+
+def test_serve_phases():
+    tmp = maketemp()
+    repositories = os.path.join(tmp, 'repositories')
+    os.mkdir(repositories)
+    os.mkdir(os.path.join(repositories, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO("""\
+[gitosis]
+repositories = %s
+
+[group foo]
+members = jdoe
+readonly = foo
+""" % repositories))
+    timer = timing.Timer()
+    serve.serve(cfg=cfg, user='jdoe',
+                command="git-upload-pack '%s/foo'" % repositories,
+                timer=timer)
+    eq([name for (name, _) in timer.phases],
+       ['command', 'realpath', 'access', 'exists'])
+    eq(timer.fields, dict(verb='git-upload-pack', repo='foo'))
+
+def test_serve_denied():
+    cfg = RawConfigParser()
+    timer = timing.Timer()
+    try:
+        serve.serve(cfg=cfg, user='jdoe', command="git-upload-pack 'foo'",
+                    timer=timer)
+    except serve.ReadAccessDenied:
+        pass
+    else:
+        raise AssertionError('access should be denied')
+    eq([name for (name, _) in timer.phases],
+       ['command', 'access'])
+    eq(timer.fields, dict(verb='git-upload-pack', repo='foo'))
@@ -5,6 +5,9 @@ import os
 import shutil
 import stat
 import sys
+from cStringIO import StringIO
+
+from gitosis.config import GitosisRawConfigParser
 
 def mkdir(*a, **kw):
     try:
@@ -52,6 +55,27 @@ def readFile(path):
         f.close()
     return data
 
+def makeConfig(tmp, text, repositories=(), path=None, **values):
+    """
+    Returns the config in `text`, with ``%(tmp)s`` replaced by `tmp`,
+    and any other ``%(name)s`` by the keyword argument of that name.
+
+    The bare repositories named in `repositories` are created, empty,
+    below ``tmp/repositories``. If a `path` is given, the config is
+    written there and read back from it.
+    """
+    values['tmp'] = tmp
+    text = text % values
+    for name in repositories:
+        os.makedirs(os.path.join(tmp, 'repositories', '%s.git' % name))
+    cfg = GitosisRawConfigParser()
+    if path is None:
+        cfg.readfp(StringIO(text))
+    else:
+        writeFile(path, text)
+        cfg.read(path)
+    return cfg
+
 def assert_raises(excClass, callableObj, *args, **kwargs):
     """
     Like unittest.TestCase.assertRaises, but returns the exception.
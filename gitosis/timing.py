@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+    gitosis.timing
+    ~~~~~~~~~~~~~~
+
+    This module implements the opt-in timing of ``gitosis-serve``
+    requests. With::
+
+        [gitosis]
+        timing-log = /var/log/gitosis/timing.log
+
+    every request appends a line of tab-separated fields to that file::
+
+        time=1350000000.123  pid=4711  user=jdoe  verb=git-upload-pack
+        repo=foo  decision=allow  options=310  config=812  identity=35
+        command=21  access=204  exists=9  total=1391
+
+    Phases are in microseconds, in the order they ran, ``total`` being
+    their sum. Which phases show up depends on the request: ``realpath``
+    for absolute paths, ``autocreate`` for repositories created on the
+    fly, ``authd`` for asking ``gitosis-authd``, on top of the phases it
+    reports. ``access`` includes looking up the groups of the user. Time
+    spent in ``git`` itself is not part of the record, it starts when the
+    record is written.
+
+    Phases are measured with ``CLOCK_MONOTONIC`` once the config is
+    read and tells to record them, ``gitosis-authd`` uses it throughout.
+    The first phases of ``gitosis-serve``, ``options``, ``config`` and
+    ``authd``, and any phase on a platform without ``CLOCK_MONOTONIC``,
+    are measured with the wall clock: a phase during which that clock is
+    stepped, by NTP or by hand, is off by the step, and recorded as 0 if
+    the clock went back.
+
+    Each record is a single ``write`` to a file opened with
+    ``O_APPEND``, so concurrent requests never mix their lines.
+
+    :license: GPL
+"""
+
+import os
+import sys
+import time
+
+#: ``CLOCK_MONOTONIC`` of the platforms with ``clock_gettime``.
+CLOCK_MONOTONIC = {"linux": 1, "freebsd": 4, "darwin": 6}
+
+#: The clock new timers start with. :func:`monotonic` is not the
+#: default, as importing :mod:`ctypes` is not free either.
+clock = time.time
+
+_monotonic = []
+
+
+def _load_monotonic():
+    """Returns ``clock_gettime(CLOCK_MONOTONIC)``, in seconds, as a
+    function, or ``None``."""
+    clock_id = None
+    for prefix, value in CLOCK_MONOTONIC.items():
+        if sys.platform.startswith(prefix):
+            clock_id = value
+    if clock_id is None:
+        return None
+    try:
+        import ctypes
+    except ImportError:
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    clock_gettime = None
+    # glibc before 2.17 only has it in librt
+    for name in (None, "librt.so.1"):
+        try:
+            clock_gettime = ctypes.CDLL(name).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        break
+    if clock_gettime is None:
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clock_gettime.restype = ctypes.c_int
+    if clock_gettime(clock_id, ctypes.byref(timespec())) != 0:
+        return None
+
+    def monotonic():
+        # not shared, gitosis-authd times requests in several threads
+        ts = timespec()
+        clock_gettime(clock_id, ctypes.byref(ts))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+def monotonic():
+    """Returns the monotonic clock, or the wall clock if there is none.
+
+    Python 2 has no monotonic clock, so it is loaded through
+    :mod:`ctypes`, once.
+    """
+    if not _monotonic:
+        _monotonic.append(_load_monotonic() or time.time)
+    return _monotonic[0]
+
+
+class Timer(object):
+    """Collects the phases and fields of one request."""
+
+    def __init__(self):
+        self.phases = []
+        self.fields = {}
+        self._clock = clock
+        self._last = self._clock()
+
+    def use(self, new_clock):
+        """Measure with `new_clock` from now on, the current phase
+        included."""
+        elapsed = max(0, self._clock() - self._last)
+        self._clock = new_clock
+        self._last = self._clock() - elapsed
+
+    def mark(self, phase):
+        """End `phase`, which started when the previous one ended."""
+        now = self._clock()
+        # the wall clock may have been set back
+        self.phases.append((phase, max(0, int((now - self._last) * 1e6))))
+        self._last = now
+
+    def note(self, field, value):
+        """Remember `value` for `field` in the record."""
+        self.fields[field] = value
+
+    def format(self):
+        """Returns the record line for this request."""
+        fields = [("time", "%.3f" % time.time()), ("pid", os.getpid())]
+        for field in ("user", "verb", "repo", "decision"):
+            fields.append((field, self.fields.get(field, "-")))
+        fields.extend(self.phases)
+        fields.append(("total", sum(us for (_, us) in self.phases)))
+        return "\t".join("%s=%s" % (field, str(value).encode("string_escape"))
+                         for (field, value) in fields) + "\n"
+
+
+def append(path, data):
+    """Append `data` to the file at `path` in a single ``write``."""
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0640)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def log_path(config):
+    """Returns where to record timings for `config`, or ``None``."""
+    path = config.get("gitosis", "timing-log")
+    if path:
+        return os.path.expanduser(path)
+    return None
+
+
+def record(path, timer):
+    """Append the record of `timer` to `path`, if there's a `path`.
+
+    Failing to record never fails the request.
+    """
+    if path is None:
+        return
+    try:
+        append(path, timer.format())
+    except (IOError, OSError):
+        pass
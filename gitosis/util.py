@@ -28,5 +28,6 @@ def catch(func, ignore=[]):
 
 walk = catch(os.walk, [errno.ENOENT])
 mkdir = catch(os.mkdir, [errno.EEXIST])
+makedirs = catch(os.makedirs, [errno.EEXIST])
 unlink = catch(os.unlink, [errno.ENOENT])
 rmtree = catch(shutil.rmtree, [errno.ENOENT])
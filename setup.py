@@ -45,6 +45,13 @@ arbitrary commands.
             'gitosis-serve = gitosis.serve:Main.run',
             'gitosis-run-hook = gitosis.run_hook:Main.run',
             'gitosis-init = gitosis.init:Main.run',
+            'gitosis-authd = gitosis.authd:Main.run',
+            'gitosis-audit = gitosis.audit:Main.run',
+            'gitosis-pack-objects = gitosis.packcache:Main.run',
+            'gitosis-bundle = gitosis.bundle:Main.run',
+            'gitosis-upload-archive = gitosis.archive:Main.run',
+            'gitosis-keys-lookup = gitosis.keydb:Main.run',
+            'gitosis-principals = gitosis.principals:Main.run',
             ],
         },
 